@@ -1,10 +1,18 @@
 """This is the scrivo package."""
 
+from importlib import import_module
 from importlib.metadata import version as _get_version
 
-from scrivo import blog, build, config, ml, page  # noqa: F401
+from scrivo import blog, build, cache, config, manifest, page  # noqa: F401
 from scrivo.build import compile_site  # noqa: F401
 from scrivo.config import Config, read_config  # noqa: F401
 from scrivo.page import Page, load_templates_from_dir  # noqa: F401
 
 __version__ = _get_version("scrivo")
+
+
+def __getattr__(name: str):
+    """Import the ML tools (NumPy, SciPy, etc.) only once they are used."""
+    if name == "ml":
+        return import_module("scrivo.ml")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
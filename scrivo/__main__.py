@@ -1,9 +1,13 @@
 """Command-line interface to the website generation tool."""
 import logging
 from argparse import ArgumentParser, Namespace
+from contextlib import nullcontext
 
-from scrivo.build import compile_site
+from scrivo.build import ASSET_MODES, compile_site
 from scrivo.config import read_config
+from scrivo.deploy import deploy, make_target
+from scrivo.serve import serve_site, watch_site
+from scrivo.trace import tracing
 
 
 def parse_args() -> Namespace:
@@ -21,6 +25,101 @@ def parse_args() -> Namespace:
         dest="INCLUDE_DRAFTS",
         help="compile drafts in addition to finalized posts",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        dest="INCREMENTAL",
+        help="only rebuild outputs whose sources changed since the last build",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_false",
+        dest="CACHE",
+        help="parse and tokenize every page from scratch instead of using caches",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        dest="JOBS",
+        help="number of processes to use during the build (0: one per CPU); "
+        "--serve renders in one process, and only parses with the others",
+    )
+    parser.add_argument(
+        "--max-related",
+        metavar="N",
+        type=int,
+        default=10,
+        dest="MAX_RELATED",
+        help="number of related pages to find for each post (0: skip)",
+    )
+    parser.add_argument(
+        "--min-related-score",
+        metavar="X",
+        type=float,
+        default=0.0,
+        dest="MIN_RELATED_SCORE",
+        help="leave out related pages less similar than this (cosine, 0 to 1)",
+    )
+    parser.add_argument(
+        "--parallel-archives",
+        action="store_true",
+        dest="PARALLEL_ARCHIVES",
+        help="render the year and month archive pages across the --jobs processes",
+    )
+    parser.add_argument(
+        "--assets",
+        choices=ASSET_MODES,
+        default="copy",
+        dest="ASSET_MODE",
+        help="copy images etc. into the build directory, or link them (default: copy)",
+    )
+    parser.add_argument(
+        "--precompile-templates",
+        action="store_true",
+        dest="PRECOMPILE_TEMPLATES",
+        help="compile the templates into Python modules kept until they change",
+    )
+    parser.add_argument(
+        "--gzip",
+        action="store_true",
+        dest="GZIP",
+        help="keep a gzipped copy of each HTML, XML and JSON output for the server",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        dest="WATCH",
+        help="keep running and rebuild whenever a source or template changes",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        dest="SERVE",
+        help="watch, and serve the build directory for previewing",
+    )
+    parser.add_argument(
+        "--port",
+        metavar="N",
+        type=int,
+        default=8000,
+        dest="PORT",
+        help="port to serve the preview on",
+    )
+    parser.add_argument(
+        "--no-reload",
+        action="store_false",
+        dest="LIVE_RELOAD",
+        help="do not reload previewed pages in the browser after each build",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="<trace_json>",
+        dest="TRACE",
+        help="write a Chrome/Perfetto trace of the build and list the slowest pages",
+    )
     parser.add_argument(
         "-c",
         metavar="<config_yml>",
@@ -29,6 +128,35 @@ def parse_args() -> Namespace:
         required=True,
         help="location of the YAML configuration file",
     )
+    commands = parser.add_subparsers(dest="COMMAND", metavar="<command>")
+    deploy_command = commands.add_parser(
+        "deploy",
+        help="send what changed since the last deploy (instead of building)",
+    )
+    deploy_command.add_argument(
+        "TARGET",
+        help='a local directory, or an rsync destination like "host:/var/www"',
+    )
+    deploy_command.add_argument(
+        "--transfers",
+        metavar="N",
+        type=int,
+        default=4,
+        dest="TRANSFERS",
+        help="number of batches to transfer in parallel",
+    )
+    deploy_command.add_argument(
+        "--dry-run",
+        action="store_true",
+        dest="DRY_RUN",
+        help="list the files that would be sent and deleted",
+    )
+    deploy_command.add_argument(
+        "--full",
+        action="store_true",
+        dest="FULL",
+        help="forget what the target has and send everything",
+    )
     return parser.parse_args()
 
 
@@ -38,9 +166,45 @@ if __name__ == "__main__":
         logging.getLogger().setLevel(logging.INFO)
     config = read_config(cli.CONFIG_YAML)
     # FIXME: Combine CLI args with config in a sensible way
-    compile_site(
-        source_dir=config.site.source_dir,
-        build_dir=config.site.build_dir,
-        config=config,
+    options = dict(
         include_drafts=cli.INCLUDE_DRAFTS,
+        cache=cli.CACHE,
+        jobs=cli.JOBS,
+        max_related=cli.MAX_RELATED,
+        min_related_score=cli.MIN_RELATED_SCORE,
+        parallel_archives=cli.PARALLEL_ARCHIVES,
+        asset_mode=cli.ASSET_MODE,
+        precompile_templates=cli.PRECOMPILE_TEMPLATES,
+        gzip_outputs=cli.GZIP,
     )
+    with tracing(cli.TRACE) if cli.TRACE else nullcontext() as tracer:
+        try:
+            if cli.COMMAND == "deploy":
+                plan = deploy(
+                    config.site.build_dir,
+                    make_target(cli.TARGET),
+                    transfers=cli.TRANSFERS,
+                    dry_run=cli.DRY_RUN,
+                    full=cli.FULL,
+                )
+                for label, paths in zip(("+", "*", "-"), plan):
+                    for path in paths:
+                        print(label, path)
+            elif cli.SERVE:
+                serve_site(
+                    config, port=cli.PORT, live_reload=cli.LIVE_RELOAD, **options
+                )
+            elif cli.WATCH:
+                watch_site(config, **options)
+            else:
+                compile_site(
+                    source_dir=config.site.source_dir,
+                    build_dir=config.site.build_dir,
+                    config=config,
+                    incremental=cli.INCREMENTAL,
+                    **options,
+                )
+        except KeyboardInterrupt:
+            pass
+    if tracer is not None:
+        print(tracer.summary())
@@ -0,0 +1,8 @@
+"""Benchmarks of site builds on synthetic sites."""
+
+from scrivo.bench.corpus import CorpusSpec, generate_corpus  # noqa: F401
+from scrivo.bench.runner import (  # noqa: F401
+    compare_results,
+    format_results,
+    run_benchmarks,
+)
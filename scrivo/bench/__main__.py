@@ -0,0 +1,164 @@
+"""Command-line interface to the build benchmarks."""
+
+import json
+import sys
+from argparse import ArgumentParser, Namespace
+
+from scrivo.bench.corpus import CorpusSpec, generate_corpus
+from scrivo.bench.runner import compare_results, format_results, run_benchmarks
+
+
+def parse_args() -> Namespace:
+    """Provide a command-line interface to the benchmarks."""
+    defaults = CorpusSpec()
+    parser = ArgumentParser(
+        prog="python -m scrivo.bench",
+        description="Time the stages of site builds on synthetic sites.",
+    )
+    parser.add_argument(
+        "--scales",
+        metavar="N",
+        type=int,
+        nargs="+",
+        default=[100, 1000, 10000],
+        dest="SCALES",
+        help="numbers of posts to benchmark (default: 100 1000 10000)",
+    )
+    parser.add_argument(
+        "--repeat",
+        metavar="N",
+        type=int,
+        default=3,
+        dest="REPEAT",
+        help="runs of each scenario; the fastest counts",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        dest="JOBS",
+        help="number of processes each build uses (0: one per CPU)",
+    )
+    parser.add_argument(
+        "--tags",
+        metavar="N",
+        type=int,
+        default=defaults.tags,
+        dest="TAGS",
+        help="number of distinct tags",
+    )
+    parser.add_argument(
+        "--years",
+        metavar="N",
+        type=int,
+        default=defaults.years,
+        dest="YEARS",
+        help="years of archives",
+    )
+    parser.add_argument(
+        "--words",
+        metavar="N",
+        type=int,
+        default=defaults.words,
+        dest="WORDS",
+        help="average words per post",
+    )
+    parser.add_argument(
+        "--code-blocks",
+        metavar="N",
+        type=int,
+        default=defaults.code_blocks,
+        dest="CODE_BLOCKS",
+        help="highlighted code blocks per post",
+    )
+    parser.add_argument(
+        "--math",
+        metavar="N",
+        type=int,
+        default=defaults.math,
+        dest="MATH",
+        help="formulas per post",
+    )
+    parser.add_argument(
+        "--seed",
+        metavar="N",
+        type=int,
+        default=defaults.seed,
+        dest="SEED",
+        help="random seed for the generated sites",
+    )
+    parser.add_argument(
+        "--workdir",
+        metavar="<dir>",
+        dest="WORKDIR",
+        help="generate (and keep) the sites here instead of a temporary directory",
+    )
+    parser.add_argument(
+        "--generate-only",
+        action="store_true",
+        dest="GENERATE_ONLY",
+        help="only generate the sites in --workdir, without building them",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        metavar="<results_json>",
+        dest="OUTPUT",
+        help="save the results here, to serve as a baseline later",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="<results_json>",
+        dest="BASELINE",
+        help="compare against earlier results; exit with status 1 on regressions",
+    )
+    parser.add_argument(
+        "--tolerance",
+        metavar="X",
+        type=float,
+        default=0.2,
+        dest="TOLERANCE",
+        help="relative slowdown to allow before reporting a regression",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    cli = parse_args()
+    spec = CorpusSpec(
+        tags=cli.TAGS,
+        years=cli.YEARS,
+        words=cli.WORDS,
+        code_blocks=cli.CODE_BLOCKS,
+        math=cli.MATH,
+        seed=cli.SEED,
+    )
+    if cli.GENERATE_ONLY:
+        if cli.WORKDIR is None:
+            sys.exit("--generate-only needs --workdir")
+        for pages in cli.SCALES:
+            print(
+                generate_corpus(
+                    f"{cli.WORKDIR}/site-{pages}", spec._replace(pages=pages)
+                )
+            )
+        sys.exit(0)
+
+    results = run_benchmarks(
+        cli.SCALES, spec, cli.REPEAT, ["-j", str(cli.JOBS)], cli.WORKDIR
+    )
+    baseline = None
+    if cli.BASELINE is not None:
+        with open(cli.BASELINE, "r", encoding="utf-8") as fh:
+            baseline = json.load(fh)
+    print(format_results(results, baseline))
+    if cli.OUTPUT is not None:
+        with open(cli.OUTPUT, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+    if baseline is not None:
+        regressions = compare_results(results, baseline, cli.TOLERANCE)
+        for regression in regressions:
+            print("Regression:", regression)
+        sys.exit(1 if regressions else 0)
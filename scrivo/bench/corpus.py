@@ -0,0 +1,248 @@
+"""Generate synthetic sites to benchmark builds on.
+
+A corpus is a complete site: Markdown sources (blog posts spread over years
+of monthly archives, plus a few plain pages), templates exercising every
+kind of output, some assets, and a config file. Everything is derived from a
+seed, so a given spec always produces exactly the same site.
+
+Post text is drawn from a made-up vocabulary with a Zipf-like distribution,
+so the similarity stage sees something like natural word frequencies.
+"""
+
+import itertools
+import os
+import random
+import shutil
+from typing import Dict, List, NamedTuple, Tuple
+
+__all__ = ["CorpusSpec", "generate_corpus"]
+
+
+class CorpusSpec(NamedTuple):
+    """The shape of a synthetic site.
+
+    Args:
+        pages (int): the number of blog posts
+        tags (int): the number of distinct tags
+        tags_per_post (int): the number of tags on each post
+        years (int): the span of the archives, ending in `last_year`
+        words (int): the (average) number of words in a post
+        vocabulary (int): the number of distinct words
+        code_blocks (int): highlighted code blocks per post
+        math (int): inline formulas per post
+        drafts (float): the fraction of posts that are drafts
+        assets (int): the number of asset files
+        seed (int): the random seed
+        last_year (int): the year of the newest post
+    """
+
+    pages: int = 100
+    tags: int = 20
+    tags_per_post: int = 3
+    years: int = 10
+    words: int = 400
+    vocabulary: int = 5000
+    code_blocks: int = 2
+    math: int = 2
+    drafts: float = 0.05
+    assets: int = 10
+    seed: int = 0
+    last_year: int = 2024
+
+
+_SYLLABLES = [c + v for c in "bdgklmnprstvz" for v in "aeiou"]
+
+_CODE = {
+    "python": "def f{i}(x, y={j}):\n    return [x * k + y for k in range({j})]\n",
+    "r": (
+        "f{i} <- function(x, y = {j}) {{\n"
+        "  sapply(seq_len({j}), function(k) x * k + y)\n}}\n"
+    ),
+    "bash": 'for k in $(seq {j}); do\n  echo "f{i} $k" | tr a-z A-Z\ndone\n',
+}
+
+TEMPLATES: Dict[str, str] = {
+    "base.html": (
+        "<!DOCTYPE html>\n<html><head><title>{% block title %}{% endblock %}"
+        "</title></head>\n<body>{% include 'nav.html' %}\n"
+        "<main>{% block body %}{% endblock %}</main>\n</body></html>\n"
+    ),
+    "nav.html": "<nav><a href='/'>Home</a> <a href='/blog/'>Blog</a></nav>",
+    "main.html": (
+        "{% extends 'base.html' %}{% block title %}{{ title }}{% endblock %}"
+        "{% block body %}{{ content }}{% endblock %}"
+    ),
+    "blog.html": (
+        "{% extends 'base.html' %}{% block title %}{{ title }}{% endblock %}"
+        "{% block body %}<article><h1>{{ title }}</h1>"
+        "<p>{{ date.strftime('%B %-d, %Y') }} {{ tags|join(', ') }}</p>"
+        "{{ content }}</article><ul>{% for score, p in related_pages.items() %}"
+        "{% if loop.index <= 5 %}<li><a href='/{{ p.url }}'>{{ p.meta.title }}</a>"
+        "</li>{% endif %}{% endfor %}</ul>{% endblock %}"
+    ),
+    "blog-index.html": (
+        "{% extends 'base.html' %}{% block body %}{% for p in posts[:20] %}"
+        "<h2><a href='/{{ p.url }}'>{{ p.meta.title }}</a></h2>{{ p.html }}"
+        "{% endfor %}{% endblock %}"
+    ),
+    "blog-archives.html": (
+        "{% extends 'base.html' %}{% block body %}{% if archive_title %}"
+        "<h1>{{ archive_title.strftime(date_format) }}</h1>{% endif %}"
+        "{% for p in posts %}<a href='/{{ p.url }}'>{{ p.meta.title }}</a> "
+        "{{ p.date.strftime('%Y-%m-%d') }}{% endfor %}{% endblock %}"
+    ),
+    "blog-tags.html": (
+        "{% extends 'base.html' %}{% block body %}{% for tag, posts in tags.items() %}"
+        "<h2>{{ tag }}</h2>{% for p in posts %}<a href='/{{ p.url }}'>"
+        "{{ p.meta.title }}</a>{% endfor %}{% endfor %}{% endblock %}"
+    ),
+    "rss.xml": (
+        "<?xml version='1.0' encoding='UTF-8'?><rss version='2.0'><channel>"
+        "{% for post in posts %}{% block item scoped %}<item><title>"
+        "{{ post.meta.title }}</title><description>{{ post.html|e }}</description>"
+        "</item>{% endblock %}{% endfor %}</channel></rss>"
+    ),
+    "rss-tag.xml": (
+        "<?xml version='1.0' encoding='UTF-8'?><rss version='2.0'><channel>"
+        "<title>{{ tag }}</title>{% for post in posts %}{% block item scoped %}"
+        "<item><title>{{ post.meta.title }}</title></item>{% endblock %}"
+        "{% endfor %}</channel></rss>"
+    ),
+    "feed.json": (
+        '{"version": "https://jsonfeed.org/version/1.1", "items": ['
+        "{% for p in posts %}"
+        '{"title": {{ p.meta.title|tojson }}, "content_html": {{ p.escaped_html }}}'
+        "{% if not loop.last %},{% endif %}{% endfor %}]}"
+    ),
+}
+
+CONFIG = """site:
+  url: https://example.com
+  source_dir: {source_dir}
+  build_dir: {build_dir}
+templates:
+  source_dir: {templates_dir}
+  default: main.html
+  blog:
+    default: blog.html
+    home: blog-index.html
+    archives: blog-archives.html
+    tags: blog-tags.html
+  feeds:
+    rss: rss.xml
+    rss_tag: rss-tag.xml
+    json: feed.json
+    tags: {{tag-0: rss-tag-0.xml, tag-1: rss-tag-1.xml, tag-2: rss-tag-2.xml}}
+    max_items: 50
+build_count_file: null
+"""
+
+
+def _vocabulary(rng: random.Random, size: int) -> List[str]:
+    words: Dict[str, None] = {}
+    while len(words) < size:
+        words["".join(rng.choices(_SYLLABLES, k=rng.randint(1, 4)))] = None
+    # Short words first, so the common words are short, as in English
+    return sorted(words, key=len)
+
+
+def _post(
+    rng: random.Random,
+    spec: CorpusSpec,
+    i: int,
+    vocab: List[str],
+    cum_weights: List[float],
+) -> Tuple[int, int, str]:
+    """Return the year, month and Markdown source of one post."""
+    year = spec.last_year - rng.randrange(spec.years)
+    month, day = rng.randint(1, 12), rng.randint(1, 28)
+    hour, minute = rng.randint(1, 12), rng.randrange(60)
+    ampm = rng.choice(["AM", "PM"])
+    tags = rng.sample(range(spec.tags), min(spec.tags_per_post, spec.tags))
+    lines = [
+        "---",
+        f"title: Post {i} about {vocab[i % len(vocab)]}",
+        f"date: {year}-{month:02d}-{day:02d} {hour}:{minute:02d} {ampm}",
+        f"tags: [{', '.join(f'tag-{t}' for t in sorted(tags))}]",
+    ]
+    if rng.random() < spec.drafts:
+        lines += ["draft: true"]
+    lines += ["---", ""]
+
+    # Zipf-distributed words; beyond the most common ones, each post favours
+    # its own part of the vocabulary, like a topic
+    topic = rng.randrange(len(vocab))
+
+    def words(n: int) -> str:
+        picks = rng.choices(range(len(vocab)), cum_weights=cum_weights, k=n)
+        return " ".join(
+            vocab[k if k < 100 else (k + topic) % len(vocab)] for k in picks
+        )
+
+    n_words = max(10, int(rng.gauss(spec.words, spec.words / 4)))
+    paragraphs = max(1, n_words // 80)
+    blocks = []
+    for p in range(paragraphs):
+        text = words(n_words // paragraphs)
+        if p < spec.math:
+            text += f" with $x_{{{p}}}^{{{i % 5 + 2}}} + \\alpha$ inline"
+        if p == 0:
+            text += "[^1]"
+        if p % 3 == 2:
+            text = f"## {words(3).title()}\n\n{text}"
+        blocks += [f"\n{text}\n"]
+    for c in range(spec.code_blocks):
+        lang = rng.choice(sorted(_CODE))
+        code = _CODE[lang].format(i=i, j=c + 2)
+        blocks.insert(rng.randrange(len(blocks) + 1), f"\n```{lang}\n{code}```\n")
+    blocks += [f"\n[^1]: A footnote to post {i}.\n"]
+    return year, month, "\n".join(lines) + "".join(blocks)
+
+
+def generate_corpus(root: str, spec: CorpusSpec = CorpusSpec()) -> str:
+    """Write a synthetic site, replacing whatever is at `root`.
+
+    Args:
+        root (str): the directory to generate the site in
+        spec (CorpusSpec): the shape of the site
+
+    Returns:
+        (str) the path of the site's config file
+    """
+    shutil.rmtree(root, ignore_errors=True)
+    source_dir = os.path.join(root, "src")
+    templates_dir = os.path.join(root, "templates")
+    build_dir = os.path.join(root, "build")
+    for directory in (source_dir, templates_dir, build_dir):
+        os.makedirs(directory)
+
+    rng = random.Random(spec.seed)
+    vocab = _vocabulary(rng, spec.vocabulary)
+    cum_weights = list(itertools.accumulate(1 / k for k in range(1, len(vocab) + 1)))
+    for i in range(spec.pages):
+        year, month, source = _post(rng, spec, i, vocab, cum_weights)
+        directory = os.path.join(source_dir, "blog", f"{year:04d}", f"{month:02d}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"post-{i}.md"), "w") as fh:
+            fh.write(source)
+    for name in ("index", "about"):
+        with open(os.path.join(source_dir, f"{name}.md"), "w") as fh:
+            fh.write(f"---\ntitle: {name.title()}\n---\n\nThe {name} page.\n")
+
+    assets = os.path.join(source_dir, "assets")
+    os.makedirs(assets)
+    for i in range(spec.assets):
+        with open(os.path.join(assets, f"image-{i}.png"), "wb") as fh:
+            fh.write(rng.randbytes(4096))
+
+    for name, template in TEMPLATES.items():
+        with open(os.path.join(templates_dir, name), "w") as fh:
+            fh.write(template)
+    config = os.path.join(root, "config.yml")
+    with open(config, "w") as fh:
+        fh.write(
+            CONFIG.format(
+                source_dir=source_dir, build_dir=build_dir, templates_dir=templates_dir
+            )
+        )
+    return config
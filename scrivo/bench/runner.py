@@ -0,0 +1,257 @@
+"""Time the stages of builds of synthetic sites, and compare against baselines.
+
+Every build runs in a fresh interpreter (`python -m scrivo --trace ...`), so
+no scale benefits from what an earlier one left in memory, and the stage
+times are read back from the trace. At each scale, three scenarios are
+timed:
+
+- cold: an empty build directory, so no caches and no previous outputs
+- warm: the same build again, with every cache filled
+- edit: an incremental build after one post was edited
+
+Each is repeated and the fastest time of each stage kept, which is the
+least noisy estimate of what the code itself costs.
+"""
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from importlib.metadata import version
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from scrivo.bench.corpus import CorpusSpec, generate_corpus
+
+__all__ = [
+    "SCENARIOS",
+    "STAGES",
+    "Regression",
+    "compare_results",
+    "format_results",
+    "run_benchmarks",
+]
+
+# The stage spans worth reporting, in build order
+STAGES = (
+    "symlink_directory",
+    "fetch_pages",
+    "page_similarities",
+    "render_markdown_pages",
+    "render archives",
+    "render tags",
+    "render feeds",
+    "render sitemap",
+    "compile_site",
+)
+SCENARIOS = ("cold", "warm", "edit")
+# Version of the results format
+RESULTS_VERSION = 1
+
+# scenario -> stage -> seconds
+ScaleResults = Dict[str, Dict[str, float]]
+
+
+def stage_times(trace_path: str) -> Dict[str, float]:
+    """Return the seconds the main process spent in each stage of a trace."""
+    with open(trace_path, "r", encoding="utf-8") as fh:
+        events = json.load(fh)["traceEvents"]
+    main = next(
+        e["pid"]
+        for e in events
+        if e.get("name") == "process_name" and e["args"]["name"] == "scrivo"
+    )
+    times = dict.fromkeys(STAGES, 0.0)
+    for event in events:
+        if event.get("pid") == main and event.get("name") in times:
+            times[event["name"]] += event["dur"] / 1e6
+    # Whatever compile_site does outside the stages above (the manifest, stale outputs)
+    times["other"] = times["compile_site"] - sum(
+        seconds for stage, seconds in times.items() if stage != "compile_site"
+    )
+    return times
+
+
+def run_build(config: str, options: Sequence[str], trace_path: str) -> Dict[str, float]:
+    """Build a site in a new interpreter and return its stage times.
+
+    The time of the whole process (imports included) is reported as the
+    "process" stage.
+    """
+    command = [sys.executable, "-m", "scrivo", "-c", config, "--trace", trace_path]
+    timer_start = time.perf_counter()
+    subprocess.run([*command, *options], check=True, stdout=subprocess.DEVNULL)
+    seconds = time.perf_counter() - timer_start
+    return dict(stage_times(trace_path), process=seconds)
+
+
+def _first_post(source_dir: str) -> str:
+    for pwd, dirs, files in sorted(os.walk(os.path.join(source_dir, "blog"))):
+        dirs.sort()
+        for f in sorted(files):
+            return os.path.join(pwd, f)
+    raise FileNotFoundError(f"no posts in {source_dir}")
+
+
+def benchmark_scale(
+    root: str, spec: CorpusSpec, repeat: int = 3, options: Sequence[str] = ()
+) -> ScaleResults:
+    """Generate a site and time its builds in every scenario.
+
+    Args:
+        root (str): the directory to generate the site in
+        spec (CorpusSpec): the shape of the site
+        repeat (int): the number of times to run each scenario
+        options (sequence[str]): extra command-line options for the builds
+
+    Returns:
+        (ScaleResults) the fastest time of each stage, by scenario
+    """
+    config = generate_corpus(root, spec)
+    build_dir = os.path.join(root, "build")
+    post = _first_post(os.path.join(root, "src"))
+    with open(post, "r") as fh:
+        original = fh.read()
+    trace = os.path.join(root, "trace.json")
+
+    runs: Dict[str, List[Dict[str, float]]] = {s: [] for s in SCENARIOS}
+    for _ in range(repeat):
+        shutil.rmtree(build_dir)
+        os.makedirs(build_dir)
+        runs["cold"] += [run_build(config, options, trace)]
+        runs["warm"] += [run_build(config, options, trace)]
+        with open(post, "a") as fh:
+            fh.write(f"\nAn edit made at {time.time()}.\n")
+        try:
+            runs["edit"] += [run_build(config, [*options, "--incremental"], trace)]
+        finally:
+            with open(post, "w") as fh:
+                fh.write(original)
+    return {
+        scenario: {stage: min(r[stage] for r in results) for stage in results[0]}
+        for scenario, results in runs.items()
+    }
+
+
+def run_benchmarks(
+    scales: Iterable[int],
+    spec: CorpusSpec = CorpusSpec(),
+    repeat: int = 3,
+    options: Sequence[str] = (),
+    workdir: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Benchmark builds of synthetic sites at several scales.
+
+    Args:
+        scales (iterable[int]): the numbers of posts to try
+        spec (CorpusSpec): the shape of the sites, apart from their size
+        repeat (int): the number of times to run each scenario
+        options (sequence[str]): extra command-line options for the builds
+        workdir (str): generate the sites here (and keep them) rather than
+          in a temporary directory
+
+    Returns:
+        (dict) the results, with enough about the environment to judge
+          whether two sets of results are comparable
+    """
+    results: Dict[str, ScaleResults] = {}
+    with tempfile.TemporaryDirectory(prefix="scrivo-bench-") as tmp:
+        for pages in scales:
+            root = os.path.join(workdir or tmp, f"site-{pages}")
+            results[str(pages)] = benchmark_scale(
+                root, spec._replace(pages=pages), repeat, options
+            )
+    return {
+        "version": RESULTS_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "scrivo": version("scrivo"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "spec": {k: v for k, v in spec._asdict().items() if k != "pages"},
+        "repeat": repeat,
+        "options": list(options),
+        "results": results,
+    }
+
+
+class Regression(NamedTuple):
+    """A stage that got slower than its baseline."""
+
+    pages: str
+    scenario: str
+    stage: str
+    baseline: float
+    current: float
+
+    def __str__(self) -> str:
+        """Describe the regression."""
+        return (
+            f"{self.stage} ({self.scenario}, {self.pages} pages): "
+            f"{self.baseline:.3f} s -> {self.current:.3f} s "
+            f"({self.current / self.baseline:.2f}x)"
+        )
+
+
+def compare_results(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float = 0.2,
+    min_seconds: float = 0.05,
+) -> List[Regression]:
+    """Find the stages that got slower than in a baseline.
+
+    Args:
+        current (dict): results from `run_benchmarks`
+        baseline (dict): earlier results
+        tolerance (float): the relative slowdown to allow
+        min_seconds (float): ignore slowdowns smaller than this, which are
+          mostly noise
+
+    Returns:
+        (list[Regression]) every stage slower than its baseline by more than
+          both `tolerance` and `min_seconds`
+    """
+    regressions = []
+    for pages, scenarios in current["results"].items():
+        for scenario, stages in scenarios.items():
+            before = baseline["results"].get(pages, {}).get(scenario, {})
+            for stage, seconds in stages.items():
+                if stage not in before:
+                    continue
+                limit = before[stage] * (1 + tolerance)
+                if seconds > limit and seconds - before[stage] > min_seconds:
+                    regressions += [
+                        Regression(pages, scenario, stage, before[stage], seconds)
+                    ]
+    return regressions
+
+
+def format_results(
+    current: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None
+) -> str:
+    """Return a table of stage times, with the change from a baseline."""
+    lines = []
+    for pages, scenarios in current["results"].items():
+        lines += [f"{pages} pages", ""]
+        header = f"  {'stage':<24}" + "".join(f"{s:>16}" for s in scenarios)
+        lines += [header]
+        stages = list(next(iter(scenarios.values())))
+        for stage in stages:
+            row = f"  {stage:<24}"
+            for scenario, times in scenarios.items():
+                cell = f"{times[stage]:.3f}"
+                if baseline is not None:
+                    before = (
+                        baseline["results"].get(pages, {}).get(scenario, {}).get(stage)
+                    )
+                    if before:
+                        cell += f" ({times[stage] / before:.2f}x)"
+                row += f"{cell:>16}"
+            lines += [row]
+        lines += [""]
+    return "\n".join(lines)
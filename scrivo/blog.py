@@ -9,19 +9,45 @@ To consider:
 - Sentiment analysis
 
 """
-from collections import defaultdict
+from collections import ChainMap, defaultdict
 from datetime import datetime
-from typing import DefaultDict, Iterable, List, Optional
+from typing import Any, DefaultDict, Dict, Iterable, List, Optional
 
 from jinja2 import Template
 
 from scrivo.page import Page
 
-__all__ = ["render_archives_page", "render_tags_page"]
+__all__ = [
+    "TaggedPost",
+    "index_archives",
+    "index_tags",
+    "render_archives_page",
+    "render_tags_page",
+]
 
 
 # For typing
 Posts = Iterable[Page]
+# year -> month -> posts
+ArchiveIndex = Dict[int, Dict[int, List[Page]]]
+
+
+def index_archives(posts: Posts) -> ArchiveIndex:
+    """Bucket posts by year and month in a single pass.
+
+    Args:
+        posts (Posts): a collection of blog posts
+
+    Returns:
+        (dict[int, dict[int, list[Page]]]) year -> month -> posts, with
+          years, months and posts all newest first
+
+    """
+    archives: ArchiveIndex = {}
+    for post in sorted(posts, key=lambda p: p.date, reverse=True):
+        date = post.date
+        archives.setdefault(date.year, {}).setdefault(date.month, []).append(post)
+    return archives
 
 
 def render_archives_page(
@@ -29,6 +55,7 @@ def render_archives_page(
     template: Template,
     year: Optional[int] = None,
     month: Optional[int] = None,
+    presorted: bool = False,
 ) -> str:
     """Render a blog archives page according to a template.
 
@@ -37,6 +64,7 @@ def render_archives_page(
         template: a Jinja2 template
         year (optional, int): the archive year (for formatting)
         month (optional, int): the archive month (for formatting)
+        presorted (bool): the posts are already newest first
 
     """
     archive_date: Optional[datetime] = None
@@ -48,25 +76,73 @@ def render_archives_page(
             date_format = "%B %Y"
             archive_date = datetime(year=year, month=1, day=1)
     return template.render(
-        posts=sorted(posts, key=lambda p: p.date, reverse=True),
+        posts=posts if presorted else sorted(posts, key=lambda p: p.date, reverse=True),
         archive_title=archive_date,
         date_format=date_format,
     )
 
 
-def render_tags_page(posts: Posts, template: Template) -> str:
+class TaggedPost:
+    """A post as it appears on the page of one of its tags.
+
+    The view shares everything with the post, except that its metadata list
+    only that one tag. Nothing is copied and the post itself is untouched.
+
+    Args:
+        post (Page): the blog post
+        tag (str): the tag whose page the post is shown on
+    """
+
+    __slots__ = ("post", "meta")
+
+    def __init__(self, post: Page, tag: str) -> None:
+        """A view of a post under a single tag."""
+        self.post = post
+        self.meta = ChainMap({"tags": [tag]}, post.meta)
+
+    def __repr__(self) -> str:
+        """String representation of a TaggedPost."""
+        return f"TaggedPost({self.post.website_path}, {self.meta['tags'][0]})"
+
+    def __getattr__(self, name: str) -> Any:
+        """Everything else comes from the post."""
+        return getattr(self.post, name)
+
+
+def index_tags(posts: Posts) -> Dict[str, List[Page]]:
+    """Group posts by tag in a single pass.
+
+    Args:
+        posts (Posts): a collection of blog posts
+
+    Returns:
+        (dict[str, list[Page]]) the posts with each tag, newest first; tags
+          are ordered by their newest post
+
+    """
+    tagged_posts: DefaultDict[str, List[Page]] = defaultdict(list)
+    for post in sorted(posts, key=lambda p: p.date, reverse=True):
+        for tag in post.meta["tags"]:
+            tagged_posts[tag].append(post)
+    return dict(tagged_posts)
+
+
+def render_tags_page(
+    posts: Posts, template: Template, tag: Optional[str] = None
+) -> str:
     """Render blog archived by tag.
 
     Args:
         posts (Posts): a collection of blog posts
         template: a Jinja2 template
+        tag (optional, str): render the page of this one tag, showing each
+          post as if it had no other tags
 
     Returns:
         a rendered document with blogs organized by tag
 
     """
-    tagged_posts: DefaultDict[str, List[Page]] = defaultdict(lambda: [])
-    for post in sorted(posts, key=lambda p: p.date, reverse=True):
-        for tag in post.meta["tags"]:
-            tagged_posts[tag] += [post]
-    return template.render(tags=tagged_posts)
+    if tag is None:
+        return template.render(tags=index_tags(posts))
+    tag_posts = sorted(posts, key=lambda p: p.date, reverse=True)
+    return template.render(tags={tag: [TaggedPost(p, tag) for p in tag_posts]})
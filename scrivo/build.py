@@ -1,26 +1,61 @@
 """Compile a static site from Markdown files."""
 
-import copy
 import logging
+import multiprocessing as mp
 import os
-import time
+import threading
+from collections import ChainMap, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Iterable, List
+from importlib.metadata import version
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
 import shutil
 
-from jinja2 import Environment
+from jinja2 import Environment, Template
 
-from scrivo.blog import render_archives_page, render_tags_page
+from scrivo.blog import (
+    index_archives,
+    index_tags,
+    render_archives_page,
+    render_tags_page,
+)
+from scrivo.compress import GzipSidecars
 from scrivo.config import Config
-from scrivo.ml import page_similarities
-from scrivo.page import Page, load_templates_from_dir
-from scrivo.utils import logtime
+from scrivo.feeds import FeedCache, posts_by_tag, stream_feed
+from scrivo.manifest import STATE_DIR, BuildManifest, hash_config
+from scrivo.output import OutputWriter, remove_output
+from scrivo.page import (
+    HighlightCache,
+    Page,
+    ParseCache,
+    Parsed,
+    highlighting,
+    is_draft,
+    load_templates_from_dir,
+    parse_markdown,
+    parser_fingerprint,
+)
+from scrivo.sitemap import PAGE_EXTENSIONS, last_modified, write_sitemaps
+from scrivo.templates import TemplateEnvironment
+from scrivo.trace import TraceEvent, add_events, span, worker_events
+from scrivo.utils import chunked, content_hash, cpu_jobs, logtime
 
 __all__ = [
     "increment_counter",
     "find_pages",
     "symlink_directory",
     "render_markdown_pages",
+    "render_feeds",
     "compile_site",
 ]
 
@@ -63,11 +98,243 @@ def find_pages(directory: str, exts: Iterable[str] = ("md",)) -> List[str]:
     ]
 
 
+# A source's modification time and size, as SourceWatcher sees it
+SourceStat = Tuple[int, int]
+
+
+def _source_stat(path: str) -> SourceStat:
+    """Return the modification time and size of a source file."""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+class WarmState:
+    """What a long-running process keeps in memory from one build to the next.
+
+    `watch_site` hands the same one to every build, so that a rebuild after
+    editing a post reads and parses that post alone, and updates the TF-IDF
+    model without loading it from disk.
+    """
+
+    def __init__(self) -> None:
+        """Nothing is known before the first build."""
+        # Each source read so far, and its page (None for a left-out draft)
+        self.pages: Dict[str, Tuple[SourceStat, Optional[Page]]] = {}
+        # The TF-IDF model as the last build left it
+        self.model: Any = None
+
+    def __repr__(self) -> str:
+        """String representation of a WarmState."""
+        return f"WarmState({len(self.pages)} sources)"
+
+
+def _parse_batch(
+    paths: List[str], highlight_dir: Optional[str] = None, root: str = ""
+) -> Tuple[List[Tuple[str, Parsed]], Dict[str, str], List[TraceEvent]]:
+    """Parse a batch of source files in a worker process.
+
+    Each worker process has its own copy of the Markdown parser. Workers
+    only read the highlight cache; newly highlighted code blocks go back to
+    the parent along with the parsed pages (and any trace events).
+    """
+    results = []
+    highlights: Dict[str, str] = {}
+    reader, cache = None, None
+    if highlight_dir is not None:
+        reader = HighlightCache(highlight_dir, readonly=True)
+        cache = ChainMap(highlights, reader)
+    try:
+        with span("parse batch", "stage", pages=len(paths)), highlighting(cache):
+            for path in paths:
+                with open(path, "r") as f:
+                    source = f.read()
+                with span("parse", "page", page=os.path.relpath(path, root)):
+                    results += [(content_hash(source), parse_markdown(source))]
+    finally:
+        if reader is not None:
+            reader.close()
+    return results, highlights, worker_events()
+
+
+# Fewer sources than this (say, the one just edited) are left for `Page` to
+# parse: starting the workers would take longer
+MIN_PARALLEL_PAGES = 8
+
+
+@logtime
+def parse_pages_parallel(
+    paths: List[str],
+    parsed: MutableMapping[str, Parsed],
+    jobs: int = 0,
+    highlights: Optional[HighlightCache] = None,
+    root: str = "",
+) -> None:
+    """Parse source files across a pool of processes.
+
+    Only sources missing from `parsed` are parsed (and only if there are at
+    least MIN_PARALLEL_PAGES of them); the results are added to it by source
+    hash, ready for `Page` to pick up.
+
+    Args:
+        paths (list[str]): source files
+        parsed (mapping): previously parsed sources, keyed by source hash
+        jobs (int): number of worker processes (zero for one per CPU)
+        highlights (HighlightCache): highlighted code blocks to reuse; the
+          ones highlighted by the workers are added to it
+        root (str): the website root, which traced page paths are relative to
+    """
+    missing = []
+    for path in paths:
+        with open(path, "r") as f:
+            if content_hash(f.read()) not in parsed:
+                missing += [path]
+    if len(missing) < MIN_PARALLEL_PAGES:
+        return
+    jobs = cpu_jobs(jobs)
+    highlight_dir = None
+    if highlights is not None:
+        highlight_dir = os.path.dirname(highlights.path)
+    batches = chunked(missing, jobs)
+    # The workers read the highlight cache file, so nothing is written to it
+    # until they are done: a writer holding SQLite's lock (say, to spill a
+    # large transaction) locks the readers out
+    new_highlights: Dict[str, str] = {}
+    context = None if can_fork() else mp.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+        for batch, batch_highlights, events in pool.map(
+            _parse_batch,
+            batches,
+            [highlight_dir] * len(batches),
+            [root] * len(batches),
+        ):
+            for source_hash, result in batch:
+                parsed[source_hash] = result
+            new_highlights.update(batch_highlights)
+            add_events(events)
+    if highlights is not None:
+        highlights.update(new_highlights)
+    logger.info("Parsed %d pages with %d processes", len(missing), jobs)
+
+
 @logtime
-def fetch_pages(srcdir: str, include_drafts: bool = False) -> List[Page]:
-    """Return a list of Page objects for processing."""
-    pages = (Page.from_path(path, srcdir) for path in find_pages(srcdir))
-    return [p for p in pages if include_drafts or not p.meta["draft"]]
+def fetch_pages(
+    srcdir: str,
+    include_drafts: bool = False,
+    parsed: Optional[MutableMapping[str, Parsed]] = None,
+    jobs: int = 1,
+    highlights: Optional[HighlightCache] = None,
+    keep_sources: bool = False,
+    defer: bool = False,
+    known: Optional[Dict[str, Tuple[SourceStat, Optional[Page]]]] = None,
+) -> List[Page]:
+    """Return a list of Page objects for processing.
+
+    Drafts are found from the YAML block at the top of each source alone, and
+    left out before any Markdown is converted.
+
+    Args:
+        srcdir (str): the source directory
+        include_drafts (bool): keep pages marked as drafts
+        parsed (mapping): previously parsed sources, keyed by source hash;
+          newly parsed sources are added to it
+        jobs (int): parse with this many processes (zero for one per CPU)
+        highlights (HighlightCache): highlighted code blocks to reuse;
+          newly highlighted ones are added to it
+        keep_sources (bool): keep each page's Markdown source; the build
+          itself has no use for it once the page is parsed
+        defer (bool): convert each page's Markdown only once its HTML or text
+          is used (pages found in `parsed` excepted); for uses that mostly
+          need metadata. Deferred pages are not added to `parsed`.
+        known (dict): the pages of an earlier call (with the same arguments),
+          by source path, with their source's modification time and size; the
+          sources that are unchanged since are not read again. It is updated
+          to this call's pages.
+    """
+    paths = find_pages(srcdir)
+    stats = {path: _source_stat(path) for path in paths} if known is not None else {}
+    # Pages (or None for drafts left out) that need not be read again
+    found: Dict[str, Optional[Page]] = {}
+    if known is not None:
+        for path, stat in stats.items():
+            if path in known and known[path][0] == stat:
+                page = known[path][1]
+                if page is not None or not include_drafts:
+                    found[path] = page
+    fresh = [path for path in paths if path not in found]
+    if not include_drafts:
+        with span("scan metadata", "stage", pages=len(fresh)):
+            found.update((path, None) for path in fresh if is_draft(path))
+        fresh = [path for path in fresh if path not in found]
+    with highlighting(highlights):
+        if jobs != 1 and not defer:
+            parsed = {} if parsed is None else parsed
+            parse_pages_parallel(fresh, parsed, jobs, highlights, srcdir)
+        for path in fresh:
+            found[path] = Page.from_path(path, srcdir, parsed, keep_sources, defer)
+    if known is not None:
+        known.clear()
+        known.update((path, (stat, found[path])) for path, stat in stats.items())
+    return [page for page in (found[path] for path in paths) if page is not None]
+
+
+# How assets are put into the build directory
+ASSET_MODES = ("copy", "hardlink", "symlink", "reflink")
+# ioctl request number for FICLONE, from linux/fs.h
+_FICLONE = 0x40049409
+
+
+def _reflink(src: str, dest: str) -> None:
+    """Clone a file copy-on-write (Linux: Btrfs, XFS, ...), else copy it."""
+    try:
+        import fcntl
+
+        with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+            fcntl.ioctl(fdest.fileno(), _FICLONE, fsrc.fileno())
+    except (ImportError, OSError):
+        shutil.copyfile(src, dest)
+    shutil.copystat(src, dest)
+
+
+def _asset_is_current(src: str, dest: str, mode: str) -> bool:
+    """Is a synced asset still the same as its source?"""
+    try:
+        src_stat, dest_stat = os.stat(src), os.lstat(dest)
+    except OSError:
+        return False
+    if mode == "symlink":
+        return os.path.islink(dest) and os.readlink(dest) == src
+    same_file = (src_stat.st_dev, src_stat.st_ino) == (
+        dest_stat.st_dev,
+        dest_stat.st_ino,
+    )
+    if mode == "hardlink":
+        return same_file
+    # Copies keep the source's size and modification time
+    return (
+        not same_file
+        and not os.path.islink(dest)
+        and src_stat.st_size == dest_stat.st_size
+        and src_stat.st_mtime_ns == dest_stat.st_mtime_ns
+    )
+
+
+def _sync_asset(src: str, dest: str, mode: str) -> None:
+    """Put an asset into place, replacing whatever was there."""
+    # Never write through an old link into the source itself
+    if os.path.lexists(dest):
+        os.remove(dest)
+    if mode == "symlink":
+        os.symlink(src, dest)
+    elif mode == "hardlink":
+        try:
+            os.link(src, dest)
+        except OSError as e:
+            logger.info("Copying %s instead of linking it: %s", src, e)
+            shutil.copy2(src, dest)
+    elif mode == "reflink":
+        _reflink(src, dest)
+    else:
+        shutil.copy2(src, dest)
 
 
 @logtime
@@ -76,19 +343,30 @@ def symlink_directory(
     dest: str,
     hide_prefixes: Iterable[str] = "_.",
     hide_suffixes: Iterable[str] = ("md", "draft"),
-) -> None:
-    """Symlink a directory tree from one location to another.
+    mode: str = "copy",
+) -> List[str]:
+    """Sync the files of a directory tree into another location.
 
-    Only files are linked; directories are created as necessary.
+    Only files are synced; directories are created as necessary. Files that
+    are unchanged since the last sync (same size and modification time, or
+    already linked) are left alone.
 
     Args:
         source (str): source dir
         dest (str): dest dir
         hide_prefixes (iter[str]): ignore files starting with these values
         hide_suffixes (iter[str]): ignore files ending with these values
+        mode (str): "copy", or "hardlink", "symlink" or "reflink" (a
+          copy-on-write clone, where the filesystem supports it) the files
+
+    Returns:
+        (list[str]) the synced files, relative to `dest`
 
     Matching is case-insensitive (using `.lower()`).
     """
+    if mode not in ASSET_MODES:
+        raise ValueError(f"unknown asset mode {mode!r}; use one of {ASSET_MODES}")
+    synced, updated = [], 0
     for pwd, _, files in os.walk(source):
         relpwd = os.path.relpath(pwd, source)
         hidden = any(
@@ -109,52 +387,369 @@ def symlink_directory(
         dest_dir = os.path.join(dest, relpwd)
         os.makedirs(dest_dir, exist_ok=True)
 
-        # TODO: Check for dead links?
         for f in files:
             src_link = os.path.abspath(os.path.join(pwd, f))
             dest_link = os.path.abspath(os.path.join(dest_dir, f))
-            shutil.copy2(src_link, dest_link)
+            synced += [os.path.normpath(os.path.join(relpwd, f))]
+            if not _asset_is_current(src_link, dest_link, mode):
+                _sync_asset(src_link, dest_link, mode)
+                updated += 1
+    logger.info("Synced %d of %d assets (%s)", updated, len(synced), mode)
+    return synced
+
+
+def select_template(page: Page, cfg: Config) -> str:
+    """Return the name of the template a Markdown page is rendered with."""
+    # Find a better way to do this -- source the template
+    if page.meta["template"]:
+        return page.meta["template"]
+    if page.is_blog:
+        return cfg.templates.blog.default
+    return cfg.templates.default
+
+
+def render_markdown_page(
+    page: Page,
+    tmpls: Environment,
+    cfg: Config,
+    writer: Optional[OutputWriter] = None,
+) -> None:
+    """Render a single Markdown page into the build directory."""
+    writer = writer or OutputWriter(cfg.site.build_dir)
+    with span("render", "page", page=page.website_path):
+        template = tmpls.get_template(select_template(page, cfg))
+        writer.write(os.path.join(cfg.site.build_dir, page.url), page.render(template))
+
+
+# An archive page: (output path, posts newest first, year, month)
+ArchiveBucket = Tuple[str, List[Page], Optional[int], Optional[int]]
+
+
+def render_archive_bucket(
+    bucket: ArchiveBucket, template: Template, writer: OutputWriter
+) -> None:
+    """Render a single archive page into the build directory."""
+    dest, posts, year, month = bucket
+    writer.write(
+        dest,
+        render_archives_page(posts, template, year=year, month=month, presorted=True),
+    )
+
+
+def can_fork() -> bool:
+    """Can worker processes be forked safely?
+
+    Only the forking thread carries on in a forked child, so a lock another
+    thread holds (in logging, say) stays locked there for good. Nothing is
+    forked while other threads run, as they do under `serve`.
+    """
+    return "fork" in mp.get_all_start_methods() and threading.active_count() == 1
+
+
+# Render workers are forked with the pages, config and (already compiled)
+# templates in memory, so only indices are sent to them
+_render_state: Dict[str, Any] = {}
+# What a worker reports: pid, pages, seconds, changed outputs, unchanged
+# count and trace events
+_BatchResult = Tuple[int, int, float, List[str], int, List[TraceEvent]]
+
+
+def _render_batch(indices: Sequence[int]) -> _BatchResult:
+    """Render a batch of pages in a worker."""
+    pages, cfg = _render_state["pages"], _render_state["config"]
+    writer = OutputWriter(cfg.site.build_dir)
+    with span("render batch", "stage", pages=len(indices)) as timer:
+        for i in indices:
+            render_markdown_page(pages[i], _render_state["templates"], cfg, writer)
+    return (
+        os.getpid(),
+        len(indices),
+        timer.seconds,
+        writer.changed,
+        writer.unchanged,
+        worker_events(),
+    )
+
+
+def _render_archive_batch(indices: Sequence[int]) -> _BatchResult:
+    """Render a batch of archive pages in a worker."""
+    buckets, cfg = _render_state["archives"], _render_state["config"]
+    template = _render_state["templates"].get_template(cfg.templates.blog.archives)
+    writer = OutputWriter(cfg.site.build_dir)
+    with span("render archive batch", "stage", pages=len(indices)) as timer:
+        for i in indices:
+            render_archive_bucket(buckets[i], template, writer)
+    return (
+        os.getpid(),
+        len(indices),
+        timer.seconds,
+        writer.changed,
+        writer.unchanged,
+        worker_events(),
+    )
+
+
+def _render_in_pool(
+    batch_fn: Callable[[Sequence[int]], _BatchResult],
+    count: int,
+    jobs: int,
+    writer: OutputWriter,
+    **state: Any,
+) -> None:
+    """Spread `count` renders across forked workers and log their throughput."""
+    _render_state.update(state)
+    throughput: Dict[int, List[float]] = defaultdict(lambda: [0, 0.0])
+    try:
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=mp.get_context("fork"),
+        ) as pool:
+            batches = chunked(range(count), jobs)
+            for pid, done, seconds, changed, unchanged, events in pool.map(
+                batch_fn, batches
+            ):
+                throughput[pid][0] += done
+                throughput[pid][1] += seconds
+                writer.merge(changed, unchanged)
+                add_events(events)
+    finally:
+        _render_state.clear()
+    for pid, (done, seconds) in sorted(throughput.items()):
+        logger.info(
+            "Render worker %d: %d pages in %.03f s (%.0f pages/s)",
+            pid,
+            done,
+            seconds,
+            done / seconds if seconds else 0,
+        )
 
 
 @logtime
-def render_markdown_pages(pages: List[Page], tmpls: Environment, cfg: Config) -> None:
+def render_markdown_pages(
+    pages: List[Page],
+    tmpls: Environment,
+    cfg: Config,
+    jobs: int = 1,
+    writer: Optional[OutputWriter] = None,
+) -> None:
     """Render the standard collection on Markdown pages (not the generated ones).
 
     Args:
         pages (list[Page]): the pages
         tmpls (Environment): the templates
         cfg (Config): the website configuration
+        jobs (int): render with this many processes (zero for one per CPU);
+          needs to fork them (see `can_fork`), otherwise pages render
+          serially
+        writer (OutputWriter): records which pages actually changed
     """
-    for page in pages:
-        # Find a better way to do this -- source the template
-        if page.meta["template"]:
-            template = tmpls.get_template(page.meta["template"])
-        elif page.is_blog:
-            template = tmpls.get_template(cfg.templates.blog.default)
-        else:
-            template = tmpls.get_template(cfg.templates.default)
-        # Prepare the way
-        dest = os.path.join(cfg.site.build_dir, page.url)
-        if not os.path.exists(os.path.dirname(dest)):
-            os.makedirs(os.path.dirname(dest))
-        # Rendering
-        with open(dest, "w", encoding="utf-8") as fh:
-            fh.write(page.render(template))
+    writer = writer or OutputWriter(cfg.site.build_dir)
+    # Prepare the way
+    for dest_dir in {os.path.dirname(p.url) for p in pages}:
+        os.makedirs(os.path.join(cfg.site.build_dir, dest_dir), exist_ok=True)
+
+    jobs = cpu_jobs(jobs)
+    if jobs == 1 or len(pages) < 2 or not can_fork():
+        for page in pages:
+            render_markdown_page(page, tmpls, cfg, writer)
+        return
+    _render_in_pool(
+        _render_batch,
+        len(pages),
+        jobs,
+        writer,
+        pages=pages,
+        config=cfg,
+        templates=tmpls,
+    )
 
 
 @logtime
-def generate_sitemap(urllist: List[str]) -> str:
-    out = ['<?xml version="1.0" encoding="UTF-8"?>']
-    out += ['<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">']
-    out += [f"<url>\n<loc>{url}</loc>\n</url>" for url in sorted(set(urllist))]
-    out += ["</urlset>"]
-    return "\n".join(out) + "\n"
+def render_archive_pages(
+    buckets: List[ArchiveBucket],
+    tmpls: Environment,
+    cfg: Config,
+    jobs: int = 1,
+    writer: Optional[OutputWriter] = None,
+) -> None:
+    """Render the blog archive pages.
+
+    Args:
+        buckets (list[ArchiveBucket]): the archive pages and their posts
+        tmpls (Environment): the templates
+        cfg (Config): the website configuration
+        jobs (int): render with this many processes (zero for one per CPU);
+          needs to fork them (see `can_fork`), otherwise pages render
+          serially
+        writer (OutputWriter): records which pages actually changed
+    """
+    writer = writer or OutputWriter(cfg.site.build_dir)
+    for dest_dir in {os.path.dirname(dest) for dest, *_ in buckets}:
+        os.makedirs(dest_dir, exist_ok=True)
+
+    jobs = cpu_jobs(jobs)
+    if jobs == 1 or len(buckets) < 2 or not can_fork():
+        template = tmpls.get_template(cfg.templates.blog.archives)
+        for bucket in buckets:
+            render_archive_bucket(bucket, template, writer)
+        return
+    _render_in_pool(
+        _render_archive_batch,
+        len(buckets),
+        jobs,
+        writer,
+        archives=buckets,
+        config=cfg,
+        templates=tmpls,
+    )
+
+
+def render_feeds(
+    posts: List[Page],
+    tmpls: TemplateEnvironment,
+    cfg: Config,
+    writer: OutputWriter,
+    is_current: Callable[[str, str, str], bool],
+    items: Optional[MutableMapping[str, str]] = None,
+) -> None:
+    """Render the JSON and RSS feeds, and an RSS feed for each configured tag.
+
+    Args:
+        posts (list[Page]): the blog posts, newest first
+        tmpls (TemplateEnvironment): the templates
+        cfg (Config): the website configuration
+        writer (OutputWriter): records which feeds actually changed
+        is_current (callable): given a feed's path, fingerprint and template,
+          whether the feed can be left as it is
+        items (mapping): rendered feed items to reuse; new ones are added
+    """
+    feeds = cfg.templates.feeds
+    feed_posts = [p for p in posts if p.meta.get("feed", True)]
+    by_tag = posts_by_tag(feed_posts, feeds.tags, feeds.max_items)
+    feed_posts = feed_posts[: feeds.max_items]
+    hashes = tmpls.template_hashes()
+
+    def render(filename: str, name: str, posts: List[Page], **context: Any) -> None:
+        path = os.path.join(cfg.site.build_dir, "blog", filename)
+        if is_current(path, fingerprint_posts(posts), name):
+            return
+        # Items are reused for as long as the feed's templates are unchanged
+        key = content_hash(repr([(t, hashes.get(t)) for t in tmpls.dependencies(name)]))
+        feed = stream_feed(
+            tmpls.get_template(name), dict(context, posts=posts), items, key
+        )
+        writer.write_stream(path, feed)
+
+    render("feed.json", feeds.json, feed_posts)
+    render("rss.xml", feeds.rss, feed_posts, build_date=datetime.now())
+    for tag, filename in feeds.tags.items():
+        render(filename, feeds.rss_tag, by_tag[tag], build_date=datetime.now(), tag=tag)
 
 
 @logtime
-def compile_site(
-    source_dir: str, build_dir: str, config: Config, include_drafts: bool = False
+def bind_related_pages(
+    pages: List[Page],
+    state_dir: Optional[str],
+    max_related: int,
+    incremental: bool = False,
+    min_score: float = 0.0,
+    warm: Optional[WarmState] = None,
 ) -> None:
+    """Find the most similar pages to each blog post.
+
+    Args:
+        pages (list[Page]): all of the pages
+        state_dir (str): where to keep the TF-IDF model and token cache
+          between builds; None to start from scratch
+        max_related (int): the number of related pages for each post
+        incremental (bool): update the TF-IDF model of the previous build,
+          whose weights may drift a little from an exact fit; otherwise fit
+          a new one, so that full builds do not depend on earlier ones
+        min_score (float): leave out related pages less similar than this
+        warm (WarmState): keep the TF-IDF model in memory for the next
+          incremental build, rather than have it load the saved one
+    """
+    # Imported here so builds without related pages skip NumPy, SciPy etc.
+    from scrivo.ml import (
+        TfidfModel,
+        TokenCache,
+        page_similarities,
+        tokenizer_fingerprint,
+    )
+
+    if state_dir is not None:
+        model_path = os.path.join(state_dir, "tfidf.pickle")
+        model = None
+        if incremental and warm is not None:
+            # Forgotten until it is brought up to date, should that fail
+            model, warm.model = warm.model, None
+        kept = model is not None
+        if model is None and incremental:
+            model = TfidfModel.load(model_path, tokenizer_fingerprint())
+        elif model is None:
+            model = TfidfModel(tokenizer_fingerprint())
+        with TokenCache(state_dir) as tokens:
+            related, scores = page_similarities(
+                pages, tokens, model, max_related, min_score
+            )
+        # A model kept in memory is only saved by the build that made it; the
+        # next build in another process updates the saved one all the same
+        if not kept:
+            model.save(model_path)
+        if warm is not None:
+            warm.model = model
+    else:
+        related, scores = page_similarities(pages, k=max_related, min_score=min_score)
+    for i, page in enumerate(pages):
+        if page.is_blog:
+            # Plain ints and floats are smaller than NumPy scalars
+            page.bind_related_pages(
+                pages,
+                (
+                    (j, score)
+                    for j, score in zip(related[i].tolist(), scores[i].tolist())
+                    if j >= 0
+                ),
+            )
+
+
+def fingerprint_posts(posts: Iterable[Page], *extra: Any) -> str:
+    """Return a hash of the posts (and anything else) behind an output."""
+    return content_hash(
+        repr([(p.website_path, p.source_hash) for p in posts] + list(extra))
+    )
+
+
+def fingerprint_page(page: Page) -> str:
+    """Return a hash of everything a single page is rendered from.
+
+    Templates show related pages' titles, dates and the like, so their
+    sources count too.
+    """
+    related = [
+        (p.website_path, p.source_hash, score)
+        for score, p in page.related_pages.items()
+    ]
+    return content_hash(repr((page.website_path, page.source_hash, related)))
+
+
+@logtime
+def compile_site(
+    source_dir: str,
+    build_dir: str,
+    config: Config,
+    include_drafts: bool = False,
+    incremental: bool = False,
+    cache: bool = True,
+    jobs: int = 1,
+    max_related: int = 10,
+    min_related_score: float = 0.0,
+    parallel_archives: bool = False,
+    asset_mode: str = "copy",
+    precompile_templates: bool = False,
+    gzip_outputs: bool = False,
+    warm: Optional[WarmState] = None,
+) -> List[str]:
     """Build a website from source.
 
     Args:
@@ -162,152 +757,259 @@ def compile_site(
         build_dir (str): directory in which to write output files
         config (Config): site configuration
         include_drafts (bool): include drafts in output
+        incremental (bool): only rewrite outputs whose inputs changed since
+          the previous build, according to its manifest
+        cache (bool): reuse parsed Markdown and page tokens from previous
+          builds, and (if `incremental`) update their TF-IDF model
+        jobs (int): number of processes to use (zero for one per CPU)
+        max_related (int): the number of related pages to find for each post;
+          zero skips the similarity stage (and never imports its libraries)
+        min_related_score (float): leave out related pages whose (cosine)
+          similarity is below this
+        parallel_archives (bool): also spread the archive pages across `jobs`
+          processes; worth it for blogs with many years of monthly archives
+        asset_mode (str): how to put images etc. into the build directory:
+          "copy", "hardlink", "symlink" or "reflink"
+        precompile_templates (bool): load the templates from Python modules
+          compiled ahead of time (and kept, with `cache`, until they change)
+          rather than from the bytecode cache
+        gzip_outputs (bool): keep a gzipped copy next to every HTML, XML and
+          JSON output, compressing the changed ones in the background
+        warm (WarmState): keep the pages and TF-IDF model in memory for the
+          next build in this process (with `cache`), as `watch_site` does
+
+    Returns:
+        (list[str]) the generated outputs whose content changed, relative to
+          the build directory
+
+    Outputs (and assets) that the previous build wrote but this one did not
+    are removed. Outputs whose content is unchanged are not rewritten.
     """
     if not os.path.isdir(source_dir):
         raise FileNotFoundError(f"source directory {source_dir} does not exist")
     if not os.path.isdir(build_dir):
         raise FileNotFoundError(f"build directory {build_dir} does not exist")
 
-    # Symlink the non-generated contents (images, etc.) into the destination
-    symlink_directory(
+    # Compare against the previous build; a new config, Markdown parser or
+    # scrivo means every output has to be rendered again, a changed template
+    # only the outputs that use it
+    state_dir = os.path.join(build_dir, STATE_DIR)
+    previous = BuildManifest.load(build_dir)
+    templates = load_templates_from_dir(
+        config.templates.source_dir,
+        state_dir if cache else None,
+        precompile=precompile_templates,
+        references=previous.references if cache else None,
+    )
+    manifest = BuildManifest(
+        settings=hash_config(
+            config,
+            include_drafts=include_drafts,
+            parser=parser_fingerprint(),
+            scrivo=version("scrivo"),
+        ),
+        templates=templates.template_hashes(),
+    )
+    reuse = incremental and manifest.is_compatible(previous)
+    logger.info("Incremental build: %s (%r)", reuse, previous)
+
+    # Page outputs and when their content last changed, for the sitemap
+    sitemap: Dict[str, Optional[datetime]] = {}
+
+    def is_current(
+        path: str,
+        fingerprint: str,
+        template: str,
+        lastmod: Optional[datetime] = None,
+    ) -> bool:
+        """Record an output and return whether it can be left as-is."""
+        output = os.path.relpath(path, config.site.build_dir)
+        manifest.outputs[output] = fingerprint
+        if output.endswith(PAGE_EXTENSIONS):
+            sitemap[output] = lastmod
+        manifest.dependencies[output] = templates.dependencies(template)
+        return (
+            reuse
+            and previous.is_current(output, fingerprint, manifest.templates)
+            and os.path.exists(path)
+        )
+
+    # Gzip changed outputs in the background, once the render workers are done
+    sidecars = GzipSidecars(build_dir, jobs) if gzip_outputs else None
+    writer = OutputWriter(
+        config.site.build_dir, sidecars.submit if sidecars is not None else None
+    )
+
+    # Sync the non-generated contents (images, etc.) into the destination
+    assets = symlink_directory(
         source=source_dir,
         dest=build_dir,
         hide_prefixes="_.",
         hide_suffixes=("md", "draft", "pxm"),
+        mode=asset_mode,
     )
+    manifest.outputs.update((asset, f"asset:{asset_mode}") for asset in assets)
 
     # Read and render the pages
-    pages = fetch_pages(source_dir, include_drafts)
+    if cache:
+        with ParseCache(state_dir) as parsed, HighlightCache(state_dir) as highlights:
+            pages = fetch_pages(
+                source_dir,
+                include_drafts,
+                parsed,
+                jobs,
+                highlights,
+                known=warm.pages if warm is not None else None,
+            )
+    else:
+        pages = fetch_pages(source_dir, include_drafts, jobs=jobs)
+    manifest.sources = {p.website_path: p.source_hash for p in pages}
     blogs = sorted(
         (p for p in pages if p.is_blog),
         key=lambda p: p.date,
         reverse=True,
     )
-    templates = load_templates_from_dir(config.templates.source_dir)
-    sitemap_cache = [os.path.join(config.site.build_dir, p.website_path) for p in pages]
 
     # Bind in the text similarity for blog posts
-    sim = page_similarities(pages)
-    for page in blogs:
-        page.related_pages = sim[page]
+    if max_related > 0:
+        bind_related_pages(
+            pages,
+            state_dir if cache else None,
+            max_related,
+            incremental,
+            min_related_score,
+            warm,
+        )
 
-    render_markdown_pages(pages, templates, config)
+    stale_pages = [
+        p
+        for p in pages
+        if not is_current(
+            os.path.join(config.site.build_dir, p.url),
+            fingerprint_page(p),
+            select_template(p, config),
+            last_modified([p]),
+        )
+    ]
+    logger.info("Rendering %d of %d pages", len(stale_pages), len(pages))
+    render_markdown_pages(stale_pages, templates, config, jobs, writer)
 
     # Render generated pages ---------------------------------------------------
 
     # TODO: Clean these up
     # Index page
-    timer_start = time.time()
-    with open(os.path.join(config.site.build_dir, "blog/index.html"), "w") as f:
-        template = templates.get_template(config.templates.blog.home)
-        f.write(template.render(posts=blogs, template=template))
-    logger.info("Rendered index page in %.03f s", time.time() - timer_start)
-
-    # Archive pages
-    timer_start = time.time()
-    template = templates.get_template(config.templates.blog.archives)
-
-    # Main archive
-    url = os.path.join(config.site.build_dir, "blog/archive/index.html")
-    sitemap_cache += [url]
-    if not os.path.exists(url):
-        os.makedirs(os.path.dirname(url))
-    with open(url, "w") as f:
-        f.write(render_archives_page(blogs, template))
-
-    # Year and month archives
-    for year in {b.date.year for b in blogs}:
-        year_blogs = [b for b in blogs if b.date.year == year]
-        url = os.path.join(config.site.build_dir, f"blog/{year:04d}/index.html")
-        sitemap_cache += [url]
-        with open(url, "w") as f:
-            f.write(render_archives_page(year_blogs, template, year=year))
-        for month in {b.date.month for b in year_blogs}:
-            month_blogs = [b for b in year_blogs if b.date.month == month]
-            url = os.path.join(
-                config.site.build_dir, f"blog/{year:04d}/{month:02d}/index.html"
-            )
-            sitemap_cache += [url]
-            with open(url, "w") as f:
-                f.write(
-                    render_archives_page(month_blogs, template, year=year, month=month)
+    with span("render index", "stage") as timer:
+        url = os.path.join(config.site.build_dir, "blog/index.html")
+        if not is_current(
+            url,
+            fingerprint_posts(blogs),
+            config.templates.blog.home,
+            last_modified(blogs),
+        ):
+            template = templates.get_template(config.templates.blog.home)
+            writer.write(url, template.render(posts=blogs, template=template))
+    logger.info("Rendered index page in %.03f s", timer.seconds)
+
+    # Archive pages: the main archive, then each year and month
+    with span("render archives", "stage") as timer:
+        url = os.path.join(config.site.build_dir, "blog/archive/index.html")
+        buckets: List[ArchiveBucket] = [(url, blogs, None, None)]
+        fingerprints = [fingerprint_posts(blogs)]
+        for year, months in index_archives(blogs).items():
+            year_blogs = [b for month_blogs in months.values() for b in month_blogs]
+            url = os.path.join(config.site.build_dir, f"blog/{year:04d}/index.html")
+            buckets += [(url, year_blogs, year, None)]
+            fingerprints += [fingerprint_posts(year_blogs, year)]
+            for month, month_blogs in months.items():
+                url = os.path.join(
+                    config.site.build_dir, f"blog/{year:04d}/{month:02d}/index.html"
                 )
-    logger.info("Rendered archive pages in %.03f s", time.time() - timer_start)
+                buckets += [(url, month_blogs, year, month)]
+                fingerprints += [fingerprint_posts(month_blogs, year, month)]
+        stale_buckets = [
+            bucket
+            for bucket, fp in zip(buckets, fingerprints)
+            if not is_current(
+                bucket[0], fp, config.templates.blog.archives, last_modified(bucket[1])
+            )
+        ]
+        render_archive_pages(
+            stale_buckets, templates, config, jobs if parallel_archives else 1, writer
+        )
+    logger.info("Rendered archive pages in %.03f s", timer.seconds)
+
+    # Nothing is forked from here on, so the gzip threads can get going
+    if sidecars is not None:
+        sidecars.start()
 
     # Tags page
-    timer_start = time.time()
-    url = os.path.join(config.site.build_dir, "blog/tags/index.html")
-    sitemap_cache += [url]
-    if not os.path.exists(url):
-        os.makedirs(os.path.dirname(url))
-    with open(url, "w") as f:
+    with span("render tags", "stage") as timer:
         template = templates.get_template(config.templates.blog.tags)
-        f.write(render_tags_page(posts=blogs, template=template))
-    tags = {t for b in blogs for t in list(b.meta["tags"])}
-    for tag in tags:
-        url = os.path.join(config.site.build_dir, f"blog/tags/{tag}/index.html")
-        if not os.path.exists(url):
-            os.makedirs(os.path.dirname(url))
-        with open(url, "w") as f:
-            template = templates.get_template(config.templates.blog.tags)
-            tag_posts = [copy.deepcopy(b) for b in blogs if tag in b.meta["tags"]]
-            for p in tag_posts:
-                p.meta["tags"] = [tag]
-            f.write(render_tags_page(posts=tag_posts, template=template))
-    logger.info("Rendered tags pages in %.03f s", time.time() - timer_start)
-
-    # JSON feed
-    feed_posts = [p for p in blogs if p.meta.get("feed", True)]
-
-    timer_start = time.time()
-    with open(os.path.join(config.site.build_dir, "blog", "feed.json"), "w") as f:
-        template = templates.get_template(config.templates.feeds.json)
-        f.write(template.render(posts=feed_posts))
-
-    # RSS feeds
-    with open(os.path.join(config.site.build_dir, "blog", "rss.xml"), "w") as f:
-        template = templates.get_template(config.templates.feeds.rss)
-        f.write(template.render(posts=feed_posts, build_date=datetime.now()))
-
-    rp = (b for b in feed_posts if "r-programming" in b.meta["tags"])
-    with open(os.path.join(config.site.build_dir, "blog", "rss-r.xml"), "w") as f:
-        template = templates.get_template(config.templates.feeds.rss_tag)
-        f.write(template.render(posts=rp, build_date=datetime.now()))
-    logger.info("Rendered feeds in %.03f s", time.time() - timer_start)
-
-    rp = (b for b in feed_posts if "python-programming" in b.meta["tags"])
-    with open(os.path.join(config.site.build_dir, "blog", "rss-python.xml"), "w") as f:
-        template = templates.get_template(config.templates.feeds.rss_tag)
-        f.write(template.render(posts=rp, build_date=datetime.now()))
-    logger.info("Rendered feeds in %.03f s", time.time() - timer_start)
-
-    # Sitemap
-    psages = []
-    for pwd, _, files in os.walk(config.site.build_dir):
-        relpath = os.path.relpath(pwd, config.site.build_dir).replace("./", "")
-        if relpath.startswith("assets"):
-            continue
-        pages = [f for f in files if f.endswith(("html", "json", "xml", "pdf"))]
-        if not pages:
-            continue
-        pages = ["" if p == "index.html" else p for p in pages]
-        pages = [p.replace(".html", "") for p in pages]
-        psages += [os.path.join("https://tshafer.com", relpath, p) for p in pages]
-    for p in psages:
-        print(p)
-
-    # with open(os.path.join(config.site.build_dir, "sitemap.xml"), "w") as f:
-    #     sitemap_cache = [
-    #         "https://tshafer.com/"
-    #         + re.sub(
-    #             r"(index\.[^.]+$|\.md$)",
-    #             "",
-    #             os.path.relpath(c, config.site.build_dir),
-    #             re.I,
-    #         )
-    #         for c in sitemap_cache
-    #     ]
-    #     f.write(generate_sitemap(sitemap_cache)
+        url = os.path.join(config.site.build_dir, "blog/tags/index.html")
+        if not is_current(
+            url,
+            fingerprint_posts(blogs),
+            config.templates.blog.tags,
+            last_modified(blogs),
+        ):
+            writer.write(url, render_tags_page(posts=blogs, template=template))
+        for tag, tag_posts in index_tags(blogs).items():
+            url = os.path.join(config.site.build_dir, f"blog/tags/{tag}/index.html")
+            if is_current(
+                url,
+                fingerprint_posts(tag_posts, tag),
+                config.templates.blog.tags,
+                last_modified(tag_posts),
+            ):
+                continue
+            writer.write(
+                url, render_tags_page(posts=tag_posts, template=template, tag=tag)
+            )
+    logger.info("Rendered tags pages in %.03f s", timer.seconds)
+
+    # Feeds
+    with span("render feeds", "stage") as timer:
+        if cache:
+            with FeedCache(state_dir) as items:
+                render_feeds(blogs, templates, config, writer, is_current, items)
+        else:
+            render_feeds(blogs, templates, config, writer, is_current)
+    logger.info("Rendered feeds in %.03f s", timer.seconds)
+
+    # Sitemap, from the pages this build produced
+    with span("render sitemap", "stage"):
+        # Hand-written HTML and PDFs among the assets are pages too
+        sitemap.update(
+            (asset, None)
+            for asset in assets
+            if asset.endswith(PAGE_EXTENSIONS)
+            and not asset.startswith("assets" + os.sep)
+        )
+        for output in write_sitemaps(
+            sitemap, config.site.url, writer, compressed=sidecars is None
+        ):
+            manifest.outputs[output] = "sitemap"
+
+    # Wait for the gzipped outputs, and gzip any outputs the previous build
+    # did not (say, with gzipping off)
+    if sidecars is not None:
+        with span("gzip outputs", "stage"):
+            for sidecar in sidecars.finish(list(manifest.outputs)):
+                manifest.outputs[sidecar] = "gzip"
+
+    # Remove outputs of pages and assets that have gone away since the
+    # previous build (links to removed assets dangle, hence islink), and the
+    # directories (of a month's archive, a tag, ...) they leave empty
+    for output in set(previous.outputs).difference(manifest.outputs):
+        path = os.path.join(config.site.build_dir, output)
+        if os.path.isfile(path) or os.path.islink(path):
+            logger.info("Removing stale output %s", output)
+            remove_output(config.site.build_dir, output)
+    manifest.references = templates.known_references()
+    manifest.save(build_dir)
+    logger.info(
+        "Wrote %d changed outputs (%d unchanged)", len(writer.changed), writer.unchanged
+    )
 
     # Only count full builds; here at the end
     if config.build_count_file is not None:
@@ -315,3 +1017,4 @@ def compile_site(
             config.site.source_dir, os.path.basename(config.build_count_file)
         )
         increment_counter(path)
+    return writer.changed
@@ -0,0 +1,188 @@
+"""Persistent, size-bounded caches for expensive build steps.
+
+Each cache is a single SQLite file of pickled values. A cache is opened with a
+fingerprint of whatever produced its values (library versions, options); when
+the fingerprint changes the whole cache is dropped. When the cache grows past
+its size limit, the least recently used entries are evicted.
+"""
+
+import logging
+import os
+import pickle
+import sqlite3
+import time
+from typing import Any, Iterator, MutableMapping, Optional, Set
+
+__all__ = ["DiskCache"]
+
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (fingerprint TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+"""
+
+
+class DiskCache(MutableMapping[str, Any]):
+    """A dict-like cache of pickled values stored on disk.
+
+    Args:
+        path (str): location of the cache file
+        fingerprint (str): identifies how the cached values were produced
+        max_bytes (int): evict least recently used entries beyond this size
+
+    The cache is written on `close()`, which also runs eviction; use it as
+    a context manager.
+
+    A read-only cache (say, in a worker process while another process has
+    the cache open for writing) never changes the file; a missing or stale
+    cache file reads as empty.
+    """
+
+    def __init__(
+        self, path: str, fingerprint: str, max_bytes: int, readonly: bool = False
+    ) -> None:
+        """Open (and maybe invalidate) a cache file."""
+        self.path = path
+        self.fingerprint = fingerprint
+        self.max_bytes = max_bytes
+        self.readonly = readonly
+        self.hits = 0
+        self.misses = 0
+        self._used: Set[str] = set()
+        if readonly:
+            self._db: Optional[sqlite3.Connection] = self._open_readonly()
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+        row = self._db.execute("SELECT fingerprint FROM info").fetchone()
+        if row is None or row[0] != fingerprint:
+            if row is not None:
+                logger.info("Invalidating cache %s", path)
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("DELETE FROM info")
+            self._db.execute("INSERT INTO info VALUES (?)", (fingerprint,))
+            self._db.commit()
+
+    def _open_readonly(self) -> sqlite3.Connection:
+        try:
+            db = sqlite3.connect(f"file:{os.path.abspath(self.path)}?mode=ro", uri=True)
+            row = db.execute("SELECT fingerprint FROM info").fetchone()
+            if row is not None and row[0] == self.fingerprint:
+                return db
+            db.close()
+        except sqlite3.Error:
+            pass
+        db = sqlite3.connect(":memory:")
+        db.executescript(_SCHEMA)
+        return db
+
+    def __repr__(self) -> str:
+        """String representation of a DiskCache."""
+        return f"{type(self).__name__}({self.path})"
+
+    def __enter__(self) -> "DiskCache":
+        """Use the cache as a context manager."""
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        """Save and close the cache."""
+        self.close()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        """Return the open database connection."""
+        if self._db is None:
+            raise ValueError(f"{self!r} is closed")
+        return self._db
+
+    def __getitem__(self, key: str) -> Any:
+        """Return a cached value."""
+        row = self.db.execute("SELECT value FROM entries WHERE key = ?", (key,))
+        found = row.fetchone()
+        if found is None:
+            self.misses += 1
+            raise KeyError(key)
+        self.hits += 1
+        self._used.add(key)
+        return pickle.loads(found[0])
+
+    def __contains__(self, key: object) -> bool:
+        """Is a key in the cache?"""
+        row = self.db.execute("SELECT 1 FROM entries WHERE key = ?", (key,))
+        return row.fetchone() is not None
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        """Cache a value."""
+        if self.readonly:
+            raise TypeError(f"{self!r} is read-only")
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.db.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+            (key, blob, len(blob), time.time()),
+        )
+
+    def __delitem__(self, key: str) -> None:
+        """Remove a cached value."""
+        if self.readonly:
+            raise TypeError(f"{self!r} is read-only")
+        if self.db.execute("DELETE FROM entries WHERE key = ?", (key,)).rowcount == 0:
+            raise KeyError(key)
+        self._used.discard(key)
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the cached keys."""
+        return (key for (key,) in self.db.execute("SELECT key FROM entries"))
+
+    def __len__(self) -> int:
+        """Return the number of cached values."""
+        return self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def evict(self) -> int:
+        """Drop least recently used entries beyond the size limit.
+
+        Returns:
+            (int) the number of entries removed
+        """
+        (total,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return 0
+        doomed = []
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY used"):
+            if excess <= 0:
+                break
+            doomed += [(key,)]
+            excess -= size
+        self.db.executemany("DELETE FROM entries WHERE key = ?", doomed)
+        logger.info("Evicted %d entries from %r", len(doomed), self)
+        return len(doomed)
+
+    def close(self) -> None:
+        """Record which entries were used, evict, and write the cache."""
+        if self._db is None:
+            return
+        if self.readonly:
+            self._db.close()
+            self._db = None
+            return
+        now = time.time()
+        self.db.executemany(
+            "UPDATE entries SET used = ? WHERE key = ?",
+            ((now, key) for key in self._used),
+        )
+        self.evict()
+        self.db.commit()
+        logger.info("%r: %d hits, %d misses", self, self.hits, self.misses)
+        self._db.close()
+        self._db = None
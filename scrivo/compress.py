@@ -0,0 +1,143 @@
+"""Write gzipped copies of text outputs for web servers to send as they are.
+
+Servers like nginx (with `gzip_static`) send `page.html.gz` in place of
+`page.html` when it exists. These "sidecars" are compressed in a pool of
+threads while the build goes on, and only for outputs that changed (or whose
+sidecar is missing or older than they are), so a build that changes nothing
+compresses nothing. The threads only start once the build says so, since
+processes must not be forked while they run. If the optional `zopfli`
+package is installed, its slower, multi-pass compressor makes the sidecars a
+little smaller.
+"""
+
+import gzip
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from scrivo.output import write_atomic
+from scrivo.trace import span
+from scrivo.utils import cpu_jobs
+
+try:
+    from zopfli.gzip import compress as zopfli_compress
+except ImportError:  # pragma: no cover
+    zopfli_compress = None
+
+__all__ = ["COMPRESSIBLE", "GzipSidecars", "compress", "sidecar_is_current"]
+
+
+logger = logging.getLogger(__name__)
+
+# Outputs worth compressing
+COMPRESSIBLE = (".html", ".xml", ".json")
+SUFFIX = ".gz"
+
+
+def compress(data: bytes) -> bytes:
+    """Gzip some data as small as we can, with no timestamp in the header."""
+    if zopfli_compress is not None:
+        return zopfli_compress(data)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def sidecar_is_current(path: str) -> bool:
+    """Does a file have a sidecar at least as new as itself?"""
+    try:
+        return os.stat(path + SUFFIX).st_mtime_ns >= os.stat(path).st_mtime_ns
+    except OSError:
+        return False
+
+
+def _compress_file(path: str, output: str) -> None:
+    with span("gzip", "io", output=output):
+        with open(path, "rb") as fh:
+            data = fh.read()
+        write_atomic(path + SUFFIX, compress(data))
+
+
+class GzipSidecars:
+    """Compresses outputs into sidecars in the background.
+
+    Hand `submit` to an `OutputWriter` to compress outputs as they are
+    written, then call `finish` once the build has written everything.
+    Outputs submitted before `start` wait for it; start the threads once
+    the build is done forking worker processes.
+
+    Args:
+        build_dir (str): the build directory
+        jobs (int): number of threads (zero for one per CPU)
+    """
+
+    def __init__(self, build_dir: str, jobs: int = 0) -> None:
+        """Get ready to compress, without starting any threads yet."""
+        self.build_dir = build_dir
+        self.jobs = jobs
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._waiting: Dict[str, None] = {}
+        self._pending: Dict[str, Future] = {}
+
+    def __repr__(self) -> str:
+        """String representation of a GzipSidecars."""
+        return (
+            f"GzipSidecars({self.build_dir!r}, {len(self._pending)} submitted, "
+            f"{len(self._waiting)} waiting)"
+        )
+
+    def start(self) -> None:
+        """Start the threads, and compress the outputs waiting for them."""
+        if self._pool is not None:
+            return
+        self._pool = ThreadPoolExecutor(
+            max_workers=cpu_jobs(self.jobs), thread_name_prefix="gzip"
+        )
+        waiting, self._waiting = self._waiting, {}
+        for output in waiting:
+            self.submit(output)
+
+    def submit(self, output: str) -> None:
+        """Compress an output (relative to the build directory), if it is text.
+
+        An output written twice is compressed after each write, in order;
+        before `start`, only once.
+        """
+        if not output.endswith(COMPRESSIBLE):
+            return
+        if self._pool is None:
+            self._waiting[output] = None
+            return
+        path = os.path.join(self.build_dir, output)
+        previous = self._pending.get(output)
+        if previous is not None:
+            previous.result()
+        self._pending[output] = self._pool.submit(_compress_file, path, output)
+
+    def finish(self, outputs: Iterable[str]) -> List[str]:
+        """Wait for the sidecars, first filling in any that are out of date.
+
+        Args:
+            outputs (iterable[str]): every output of the build, relative to
+              the build directory
+
+        Returns:
+            (list[str]) the sidecars of the outputs, relative to the build
+              directory
+        """
+        self.start()
+        sidecars = []
+        for output in outputs:
+            if not output.endswith(COMPRESSIBLE):
+                continue
+            if output not in self._pending and not sidecar_is_current(
+                os.path.join(self.build_dir, output)
+            ):
+                self.submit(output)
+            sidecars += [output + SUFFIX]
+        try:
+            for future in self._pending.values():
+                future.result()
+        finally:
+            self._pool.shutdown(cancel_futures=True)  # type: ignore
+        logger.info("Compressed %d of %d outputs", len(self._pending), len(sidecars))
+        return sidecars
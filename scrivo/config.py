@@ -26,12 +26,26 @@ class BlogTemplatesConfig(NamedTuple):
     tags: str
 
 
+# The tag feeds from before they were configurable
+DEFAULT_TAG_FEEDS = {
+    "r-programming": "rss-r.xml",
+    "python-programming": "rss-python.xml",
+}
+
+
 class FeedTemplatesConfig(NamedTuple):
-    """Templates YAML sub-configuration options for feeds."""
+    """Templates YAML sub-configuration options for feeds.
+
+    `tags` maps each tag that gets its own RSS feed to the feed's file name
+    (in the blog directory), by default the two tag feeds from before they
+    were configurable; `max_items` caps the posts in every feed.
+    """
 
     rss: str
     rss_tag: str
     json: str
+    tags: Dict[str, str] = DEFAULT_TAG_FEEDS
+    max_items: Optional[int] = None
 
 
 class TemplatesConfig(NamedTuple):
@@ -78,6 +92,8 @@ def read_config(path: str) -> Config:
                 rss=yaml["templates"]["feeds"]["rss"],
                 rss_tag=yaml["templates"]["feeds"]["rss_tag"],
                 json=yaml["templates"]["feeds"]["json"],
+                tags=yaml["templates"]["feeds"].get("tags", DEFAULT_TAG_FEEDS),
+                max_items=yaml["templates"]["feeds"].get("max_items"),
             ),
         ),
         build_count_file=yaml["build_count_file"],
@@ -0,0 +1,307 @@
+"""Deploy only the outputs that changed since the last deploy.
+
+For every target, the build directory's state directory keeps a record of
+what was last deployed there: the content hash, size and modification time
+of every file. A deploy takes the files to send from the build manifest, so
+it never walks the build directory. It hashes them (reusing the hashes of
+files whose size and modification time are unchanged; the build leaves
+unchanged outputs alone), compares them against that record, and sends the
+target exactly the added and changed files and the list of deleted ones, in
+batches spread across a few parallel transfers.
+
+Targets are pluggable; there is one for a local directory (or mount) and
+one that drives rsync with `--files-from`.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+from scrivo.manifest import STATE_DIR, BuildManifest
+from scrivo.output import remove_output
+from scrivo.utils import chunked, content_hash, logtime
+
+__all__ = [
+    "DeployPlan",
+    "DeployTarget",
+    "LocalTarget",
+    "RsyncTarget",
+    "deploy",
+    "hash_outputs",
+    "make_target",
+    "plan_deploy",
+]
+
+
+logger = logging.getLogger(__name__)
+
+# path -> (content hash, size, modification time in ns)
+OutputHashes = Dict[str, Tuple[str, int, int]]
+
+
+def hash_file(path: str) -> str:
+    """Return a short hex digest of a file's content (as `content_hash`)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@logtime
+def hash_outputs(
+    build_dir: str, outputs: Iterable[str], known: OutputHashes
+) -> OutputHashes:
+    """Hash the outputs of a build.
+
+    Args:
+        build_dir (str): the build directory
+        outputs (iterable[str]): the files to hash, relative to `build_dir`
+        known (OutputHashes): earlier hashes; reused for any file whose size
+          and modification time are unchanged
+
+    Returns:
+        (OutputHashes) path (relative to `build_dir`) -> hash, size, mtime
+    """
+    hashes: OutputHashes = {}
+    for output in outputs:
+        path = os.path.join(build_dir, output)
+        try:
+            # Links are deployed as the files they point to
+            st = os.stat(path)
+        except OSError:
+            logger.warning("Not deploying %s, which the build did not leave", output)
+            continue
+        previous = known.get(output)
+        if previous is not None and tuple(previous[1:]) == (
+            st.st_size,
+            st.st_mtime_ns,
+        ):
+            hashes[output] = previous
+        else:
+            hashes[output] = (hash_file(path), st.st_size, st.st_mtime_ns)
+    return hashes
+
+
+class DeployPlan(NamedTuple):
+    """The files a deploy has to send to, and delete from, its target."""
+
+    added: List[str]
+    changed: List[str]
+    deleted: List[str]
+
+    @property
+    def uploads(self) -> List[str]:
+        """Return every file to send."""
+        return sorted(self.added + self.changed)
+
+
+def plan_deploy(current: OutputHashes, deployed: OutputHashes) -> DeployPlan:
+    """Compare the build against what the target last received."""
+    return DeployPlan(
+        added=sorted(set(current).difference(deployed)),
+        changed=sorted(
+            p for p in current if p in deployed and current[p][0] != deployed[p][0]
+        ),
+        deleted=sorted(set(deployed).difference(current)),
+    )
+
+
+class DeployTarget(ABC):
+    """Somewhere to deploy the build directory to.
+
+    Subclasses implement `upload` and `delete`; both take paths relative to
+    the build directory and must be safe to call from several threads.
+    """
+
+    @abstractmethod
+    def upload(self, build_dir: str, paths: Sequence[str]) -> None:
+        """Send files from the build directory to the target."""
+
+    @abstractmethod
+    def delete(self, paths: Sequence[str]) -> None:
+        """Remove files from the target."""
+
+    @property
+    def key(self) -> str:
+        """Return a short identifier for the target's deploy record."""
+        return content_hash(repr(self))[:12]
+
+
+class LocalTarget(DeployTarget):
+    """Deploy into a local directory, such as a mounted web root.
+
+    Args:
+        directory (str): the directory to deploy into
+    """
+
+    def __init__(self, directory: str) -> None:
+        """A target directory; it is created on the first upload."""
+        self.directory = os.path.abspath(directory)
+
+    def __repr__(self) -> str:
+        """String representation of a LocalTarget."""
+        return f"LocalTarget({self.directory!r})"
+
+    def upload(self, build_dir: str, paths: Sequence[str]) -> None:
+        """Copy files into place through temporary files."""
+        for path in paths:
+            dest = os.path.join(self.directory, path)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            tmp = os.path.join(
+                os.path.dirname(dest), f".{os.path.basename(dest)}.{uuid.uuid4().hex}"
+            )
+            shutil.copy2(os.path.join(build_dir, path), tmp)
+            os.replace(tmp, dest)
+
+    def delete(self, paths: Sequence[str]) -> None:
+        """Remove files, and any directories that leaves empty."""
+        for path in paths:
+            remove_output(self.directory, path)
+
+
+class RsyncTarget(DeployTarget):
+    """Deploy with rsync, sending it exactly the files to transfer.
+
+    Args:
+        destination (str): anything rsync accepts, like "host:/var/www"
+        command (sequence[str]): the rsync command and its options
+
+    Deletions need rsync 3.1 or later (`--delete-missing-args`).
+    """
+
+    def __init__(
+        self, destination: str, command: Sequence[str] = ("rsync", "-rLz")
+    ) -> None:
+        """An rsync destination."""
+        self.destination = destination
+        self.command = tuple(command)
+
+    def __repr__(self) -> str:
+        """String representation of an RsyncTarget."""
+        return f"RsyncTarget({self.destination!r})"
+
+    def _run(self, source: str, paths: Sequence[str], *options: str) -> None:
+        subprocess.run(
+            [*self.command, *options, "--files-from=-", source, self.destination],
+            input="\n".join(paths) + "\n",
+            text=True,
+            check=True,
+        )
+
+    def upload(self, build_dir: str, paths: Sequence[str]) -> None:
+        """Send files with one rsync run."""
+        # The trailing "/" makes the listed paths relative to the build root
+        self._run(os.path.join(build_dir, ""), paths)
+
+    def delete(self, paths: Sequence[str]) -> None:
+        """Delete files by listing them as missing from an empty source."""
+        with tempfile.TemporaryDirectory() as empty:
+            self._run(os.path.join(empty, ""), paths, "--delete-missing-args")
+
+
+def make_target(destination: str) -> DeployTarget:
+    """Return the target for a destination: rsync for "host:dir", else local."""
+    head = destination.split("/", 1)[0]
+    if ":" in head and not os.path.exists(destination):
+        return RsyncTarget(destination)
+    return LocalTarget(destination)
+
+
+def _record_path(build_dir: str, target: DeployTarget) -> str:
+    return os.path.join(build_dir, STATE_DIR, f"deploy-{target.key}.json")
+
+
+def _load_record(path: str) -> OutputHashes:
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return {k: tuple(v) for k, v in json.load(fh).items()}  # type: ignore
+    except (OSError, ValueError) as e:
+        logger.info("No previous deploy record: %s", e)
+        return {}
+
+
+def _save_record(path: str, record: OutputHashes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(record, fh, indent=1, sort_keys=True)
+
+
+def _batches(paths: List[str], transfers: int) -> List[Sequence[str]]:
+    return chunked(paths, max(1, transfers)) if paths else []
+
+
+@logtime
+def deploy(
+    build_dir: str,
+    target: DeployTarget,
+    transfers: int = 4,
+    dry_run: bool = False,
+    full: bool = False,
+) -> DeployPlan:
+    """Send the target whatever changed in the build since its last deploy.
+
+    The files are the outputs in the build's manifest; without one (say,
+    before the first build), FileNotFoundError is raised. The deploy record
+    is updated batch by batch, so an interrupted deploy picks up where it
+    stopped.
+
+    Args:
+        build_dir (str): the build directory
+        target (DeployTarget): where to deploy to
+        transfers (int): the number of batches to run in parallel
+        dry_run (bool): only work out (and return) what would be sent
+        full (bool): forget the previous deploy and send everything
+
+    Returns:
+        (DeployPlan) the files added, changed and deleted
+    """
+    manifest = BuildManifest.load(build_dir)
+    if not manifest.outputs:
+        # Deploying nothing would delete everything from the target
+        raise FileNotFoundError(f"no build to deploy in {build_dir}")
+    record_path = _record_path(build_dir, target)
+    deployed = {} if full else _load_record(record_path)
+    current = hash_outputs(build_dir, manifest.outputs, deployed)
+    plan = plan_deploy(current, deployed)
+    logger.info(
+        "Deploying to %r: %d added, %d changed, %d deleted",
+        target,
+        len(plan.added),
+        len(plan.changed),
+        len(plan.deleted),
+    )
+    if dry_run:
+        return plan
+
+    # Unchanged files (whose mtimes may have moved) are recorded right away
+    record = {p: current[p] for p in current if p in deployed}
+    record.update({p: deployed[p] for p in plan.deleted})
+    record.update({p: deployed[p] for p in plan.changed})
+
+    def upload(batch: Sequence[str]) -> Sequence[str]:
+        target.upload(build_dir, batch)
+        return batch
+
+    def delete(batch: Sequence[str]) -> Sequence[str]:
+        target.delete(batch)
+        return batch
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, transfers)) as pool:
+            for batch in pool.map(upload, _batches(plan.uploads, transfers)):
+                record.update((p, current[p]) for p in batch)
+            for batch in pool.map(delete, _batches(plan.deleted, transfers)):
+                for p in batch:
+                    del record[p]
+    finally:
+        _save_record(record_path, record)
+    return plan
@@ -0,0 +1,183 @@
+"""Render feeds by streaming them, reusing the items rendered before.
+
+A feed template renders a list of `posts`, as before. If it renders each one
+in a block named "item" over a loop variable named `post`, like
+
+    {% for post in posts %}{% block item scoped %}
+      <item><title>{{ post.meta.title }}</title>...</item>
+    {% endblock %}{% endfor %}
+
+then every item is rendered once and kept in a cache, keyed by the post's
+path and source and by the feed's templates, so a feed only renders the
+items that are new or changed. That is only done if the item block uses
+nothing but `post` (and Jinja's globals); items that show the feed's `tag`,
+say, or use `loop`, are rendered every time.
+
+Feeds are streamed to disk chunk by chunk rather than rendered into one
+string first.
+"""
+
+import logging
+import os
+from importlib.metadata import version
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    MutableMapping,
+    Optional,
+)
+from weakref import WeakKeyDictionary
+
+from jinja2 import Template, TemplateNotFound, meta, nodes
+from jinja2.runtime import Context
+
+from scrivo.cache import DiskCache
+from scrivo.page import Page, parser_fingerprint
+from scrivo.utils import content_hash
+
+__all__ = ["FeedCache", "posts_by_tag", "stream_feed"]
+
+
+logger = logging.getLogger(__name__)
+
+# The block a feed template renders each post in
+ITEM_BLOCK = "item"
+
+
+class FeedCache(DiskCache):
+    """An on-disk cache of rendered feed items.
+
+    Items show the HTML of their posts, so the cache is dropped whenever the
+    Markdown parser changes, as well as Jinja2.
+
+    Args:
+        directory (str): directory to keep the cache file in
+        max_bytes (int): size limit for the cache
+    """
+
+    FILENAME = "feed-cache.sqlite"
+
+    def __init__(self, directory: str, max_bytes: int = 32 * 2**20) -> None:
+        """Open the feed item cache within a directory."""
+        super().__init__(
+            os.path.join(directory, self.FILENAME),
+            fingerprint=content_hash(
+                repr(("jinja2", version("jinja2"), parser_fingerprint()))
+            ),
+            max_bytes=max_bytes,
+        )
+
+
+# Template -> the variables its item block uses
+_item_variables: "WeakKeyDictionary[Template, Optional[FrozenSet[str]]]" = (
+    WeakKeyDictionary()
+)
+
+
+def _find_item_variables(template: Template) -> Optional[FrozenSet[str]]:
+    env = template.environment
+    # A TemplateEnvironment may load compiled templates, but keeps the sources
+    loader = getattr(env, "sources", env.loader)
+    if loader is None or template.name is None:
+        return None
+    try:
+        source, _, _ = loader.get_source(env, template.name)
+    except TemplateNotFound:
+        return None
+    for block in env.parse(source).find_all(nodes.Block):
+        if block.name == ITEM_BLOCK:
+            body = nodes.Template(block.body)
+            body.set_environment(env)
+            return frozenset(
+                meta.find_undeclared_variables(body).difference(env.globals)
+            )
+    return None
+
+
+def item_variables(template: Template) -> Optional[FrozenSet[str]]:
+    """Return the variables a feed template's item block uses, besides globals.
+
+    Args:
+        template (Template): the feed template
+
+    Returns:
+        (frozenset[str]) the variable names; None if the template has no item
+          block of its own, or its source cannot be found
+    """
+    if template not in _item_variables:
+        found = _item_variables[template] = _find_item_variables(template)
+        if found is not None and not found <= {"post"}:
+            logger.info(
+                "Not caching the items of %s, which use %s",
+                template.name,
+                ", ".join(sorted(found)),
+            )
+    return _item_variables[template]
+
+
+def posts_by_tag(
+    posts: Iterable[Page], tags: Iterable[str], max_items: Optional[int] = None
+) -> Dict[str, List[Page]]:
+    """Collect the posts for several tag feeds in one pass.
+
+    Args:
+        posts (iterable[Page]): the posts, newest first
+        tags (iterable[str]): the tags to collect posts for
+        max_items (int): keep at most this many (newest) posts per tag
+
+    Returns:
+        (dict[str, list[Page]]) the posts with each tag
+    """
+    by_tag: Dict[str, List[Page]] = {tag: [] for tag in tags}
+    for post in posts:
+        for tag in post.meta["tags"]:
+            found = by_tag.get(tag)
+            if found is not None and (max_items is None or len(found) < max_items):
+                found.append(post)
+    return by_tag
+
+
+def stream_feed(
+    template: Template,
+    context: Dict[str, Any],
+    items: Optional[MutableMapping[str, str]] = None,
+    key: str = "",
+) -> Iterator[str]:
+    """Render a feed template chunk by chunk.
+
+    Args:
+        template (Template): the feed template
+        context (dict): the template variables, such as `posts`
+        items (mapping): rendered items to reuse; newly rendered ones are
+          added to it (if the item block uses nothing but `post`)
+        key (str): identifies the feed and the version of its templates;
+          part of every item's cache key
+
+    Returns:
+        (iterator[str]) the rendered feed, in pieces
+    """
+    ctx = template.new_context(context)
+    block = template.blocks.get(ITEM_BLOCK)
+    variables = item_variables(template) if block is not None else None
+    if items is not None and variables is not None and variables <= {"post"}:
+
+        def cached_item(item_ctx: Context) -> Iterator[str]:
+            post = item_ctx.get("post")
+            if not isinstance(post, Page):
+                yield from block(item_ctx)
+                return
+            item_key = content_hash(repr((key, post.website_path, post.source_hash)))
+            fragment = items.get(item_key)
+            if fragment is None:
+                fragment = items[item_key] = "".join(block(item_ctx))
+            yield fragment
+
+        ctx.blocks[ITEM_BLOCK] = [cached_item] + ctx.blocks[ITEM_BLOCK][1:]
+    try:
+        yield from template.root_render_func(ctx)
+    except Exception:
+        yield template.environment.handle_exception()
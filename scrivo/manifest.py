@@ -0,0 +1,141 @@
+"""Record what a build consumed and produced for incremental rebuilds.
+
+The manifest lives in a hidden state directory inside the build directory.
+It stores the content hash of every source file and template, a hash of the
+config, a fingerprint of the inputs behind every output file, and the
+templates each output was rendered with. On the next build, outputs whose
+fingerprint and templates are unchanged are left alone. It also keeps the
+templates each template refers to, so those are not parsed again.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from scrivo.config import Config
+from scrivo.utils import content_hash
+
+__all__ = ["BuildManifest", "STATE_DIR", "hash_config"]
+
+
+logger = logging.getLogger(__name__)
+
+# Everything scrivo persists between builds goes in here
+STATE_DIR = ".scrivo"
+
+
+def hash_config(config: Config, **options: Any) -> str:
+    """Return a hash of the site configuration plus any build options."""
+    return content_hash(repr((config, sorted(options.items()))))
+
+
+class BuildManifest:
+    """The inputs and outputs of a single build.
+
+    Args:
+        settings (str): hash of the configuration and build options
+        templates (dict[str, str]): template name -> content hash
+        sources (dict[str, str]): source path -> content hash
+        outputs (dict[str, str]): output path -> fingerprint of its inputs
+        dependencies (dict[str, list[str]]): output path -> the templates it
+          was rendered with, including those they extend, include or import
+        references (dict[str, list[str]]): template content hash -> the
+          templates it refers to directly (None if not all are known)
+
+    Paths are relative to the source and build directories, respectively.
+    """
+
+    VERSION = 3
+
+    def __init__(
+        self,
+        settings: str = "",
+        templates: Optional[Dict[str, str]] = None,
+        sources: Optional[Dict[str, str]] = None,
+        outputs: Optional[Dict[str, str]] = None,
+        dependencies: Optional[Dict[str, List[str]]] = None,
+        references: Optional[Dict[str, Optional[List[str]]]] = None,
+    ) -> None:
+        """A manifest starts out empty unless given its contents."""
+        self.settings = settings
+        self.templates: Dict[str, str] = templates or {}
+        self.sources: Dict[str, str] = sources or {}
+        self.outputs: Dict[str, str] = outputs or {}
+        self.dependencies: Dict[str, List[str]] = dependencies or {}
+        self.references: Dict[str, Optional[List[str]]] = references or {}
+
+    def __repr__(self) -> str:
+        """String representation of a BuildManifest."""
+        return (
+            f"BuildManifest({len(self.sources)} sources, {len(self.outputs)} outputs)"
+        )
+
+    def is_compatible(self, other: "BuildManifest") -> bool:
+        """Were both builds made with the same configuration?"""
+        return self.settings == other.settings
+
+    def is_current(
+        self,
+        output: str,
+        fingerprint: str,
+        templates: Optional[Dict[str, str]] = None,
+    ) -> bool:
+        """Was an output last written from the same inputs and templates?
+
+        Args:
+            output (str): the output path
+            fingerprint (str): the fingerprint of its inputs now
+            templates (dict[str, str]): the template hashes now; if given,
+              none of the templates the output was rendered with may differ
+        """
+        if self.outputs.get(output) != fingerprint:
+            return False
+        return templates is None or all(
+            self.templates.get(t) == templates.get(t)
+            for t in self.dependencies.get(output, [])
+        )
+
+    @staticmethod
+    def _path(build_dir: str) -> str:
+        return os.path.join(build_dir, STATE_DIR, "manifest.json")
+
+    @classmethod
+    def load(cls, build_dir: str) -> "BuildManifest":
+        """Read the manifest of the previous build, or return an empty one."""
+        try:
+            with open(cls._path(build_dir), "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError) as e:
+            logger.info("Ignoring previous build manifest: %s", e)
+            return cls()
+        if data.get("version") != cls.VERSION:
+            return cls()
+        return cls(
+            settings=data["settings"],
+            templates=data["templates"],
+            sources=data["sources"],
+            outputs=data["outputs"],
+            dependencies=data["dependencies"],
+            references=data["references"],
+        )
+
+    def save(self, build_dir: str) -> None:
+        """Write the manifest into the build directory."""
+        path = self._path(build_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(
+                {
+                    "version": self.VERSION,
+                    "settings": self.settings,
+                    "templates": self.templates,
+                    "sources": self.sources,
+                    "outputs": self.outputs,
+                    "dependencies": self.dependencies,
+                    "references": self.references,
+                },
+                fh,
+                indent=1,
+                sort_keys=True,
+            )
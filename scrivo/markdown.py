@@ -1,13 +1,44 @@
-"""Custom Markdown extension for YAML metadata parsing."""
+"""Custom Markdown extensions for YAML metadata, plaintext and highlighting."""
+import functools
+import html
 import logging
 import re
-from typing import Any, Dict, List
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Iterator, List, MutableMapping, Optional, Tuple
+from xml.etree.ElementTree import Element
 
 import yaml
+from markdown import util
 from markdown.extensions import Extension
+from markdown.extensions.codehilite import CodeHilite
+from markdown.postprocessors import Postprocessor
 from markdown.preprocessors import Preprocessor
+from markdown.treeprocessors import Treeprocessor
 
-__all__ = ["YAMLMetadataExtension", "YAMLMetadataPreprocessor"]
+from scrivo.trace import span
+from scrivo.utils import content_hash
+
+__all__ = [
+    "HighlightCacheExtension",
+    "HighlightCacheSwitch",
+    "PlaintextExtension",
+    "PlaintextTreeprocessor",
+    "YAMLMetadataExtension",
+    "YAMLMetadataPreprocessor",
+    "load_front_matter",
+    "split_front_matter",
+]
+
+RE_TAG = re.compile(r"<[^>]*>")
+# Elements whose content is not text: math (from mdx_math), scripts and styles
+NOT_TEXT = ("script", "style")
+RE_NOT_TEXT = re.compile(r"<(script|style)\b.*?</\1\s*>", re.DOTALL | re.IGNORECASE)
+# The lines that open and close a YAML metadata block
+RE_YAML = re.compile(r"^(-|\.){3}$")
+# libyaml's loader is many times faster than the pure-Python one
+YAMLLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+# Whatever placeholders are left for postprocessors (footnote backlinks, etc.)
+RE_PLACEHOLDER = re.compile(f"{util.STX}[^{util.ETX}]*{util.ETX}")
 
 
 logger = logging.getLogger()
@@ -37,34 +68,212 @@ class YAMLMetadataPreprocessor(Preprocessor):
             extracted YAML content.
 
         """
-        RE_YAML = re.compile(r"^(-|\.){3}$")
-
-        yaml_start, yaml_end = None, None
-        for i, line in enumerate(lines):
-            if not line.strip():
-                continue
-            rx = RE_YAML.match(line.strip())
-            # We're into text without ever seeing YAML
-            if not rx and yaml_start is None:
-                break
-            # We see a YAML line and we haven't before
-            if rx and yaml_start is None:
-                yaml_start = i
-                continue
-            # We see a YAML line and we are tracking the YAML block
-            if rx and yaml_start is not None:
-                yaml_end = i
-                break
-
-        metadata: Dict[str, Any] = {}
-        if yaml_start is None and yaml_end is None:
-            new_lines = lines
-        elif yaml_start is not None and yaml_end is not None:
-            new_lines = lines[(yaml_end + 1) :]
-            metadata = yaml.safe_load("\n".join(lines[(yaml_start + 1) : yaml_end]))
+        block, end = split_front_matter(lines)
+        self.md.metadata = load_front_matter(block) if block is not None else {}
+        return lines[end:]
+
+
+def split_front_matter(lines: Iterable[str]) -> Tuple[Optional[List[str]], int]:
+    """Find the YAML block at the top of a document.
+
+    Lines are only read up to the end of the block, so `lines` can be a file
+    that is never read past its header.
+
+    Args:
+        lines (iterable[str]): the lines of the document, without newlines
+
+    Returns:
+        tuple(list[str], int):
+            1. the lines of the YAML block, or None if there is none
+            2. the number of lines up to the end of the block
+
+    """
+    block: Optional[List[str]] = None
+    for i, line in enumerate(lines):
+        if not line.strip():
+            if block is not None:
+                block.append(line)
+            continue
+        rx = RE_YAML.match(line.strip())
+        # We're into text without ever seeing YAML
+        if not rx and block is None:
+            break
+        # We see a YAML line and we haven't before
+        if block is None:
+            block = []
+        # We see a YAML line and we are tracking the YAML block
+        elif rx:
+            return block, i + 1
         else:
-            raise ValueError("did not find the end of the YAML header block")
+            block.append(line)
+    if block is not None:
+        raise ValueError("did not find the end of the YAML header block")
+    return None, 0
+
+
+def load_front_matter(block: List[str]) -> Dict[str, Any]:
+    """Load a YAML block (with libyaml, if PyYAML has it), lowercasing its keys."""
+    metadata = yaml.load("\n".join(block), Loader=YAMLLoader) or {}  # noqa: S506
+    return {k.lower(): v for k, v in metadata.items()}
+
+
+class PlaintextExtension(Extension):
+    """Capture a plaintext rendering of a Markdown document.
+
+    The text is left in `md.plaintext`, ready for tokenizing, search and the
+    like without re-parsing the HTML.
+    """
+
+    def __init__(self, **kwargs):
+        """Configure whether code blocks count as text."""
+        self.config = {
+            "include_code": [True, "Include the text of code blocks"],
+        }
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md):
+        """Register our treeprocessor after all of the others."""
+        md.registerExtension(self)
+        self.md = md
+        self.reset()
+        md.treeprocessors.register(
+            PlaintextTreeprocessor(md, self.getConfig("include_code")), "plaintext", -1
+        )
+
+    def reset(self) -> None:
+        """Forget the previous document's text."""
+        self.md.plaintext = ""  # type: ignore
+
+
+class PlaintextTreeprocessor(Treeprocessor):
+    """Collect the text of a finished Markdown element tree."""
+
+    def __init__(self, md, include_code: bool = True):
+        """Create a treeprocessor, optionally skipping code blocks."""
+        super().__init__(md)
+        self.include_code = include_code
+
+    def stashed_text(self, match: re.Match) -> str:
+        """Return the text of a block of raw HTML set aside by the parser."""
+        raw = self.md.htmlStash.rawHtmlBlocks[int(match.group(1))]
+        raw = raw if isinstance(raw, str) else raw.text or ""
+        if not self.include_code and raw.lstrip().startswith(
+            ('<div class="codehilite"', "<pre")
+        ):
+            return " "
+        return RE_TAG.sub(" ", RE_NOT_TEXT.sub(" ", raw))
+
+    def itertext(self, element: Element) -> Iterator[str]:
+        """Like `Element.itertext`, but skipping what is not text.
+
+        Math is left out, as are code blocks if they are not text. Code
+        blocks CodeHilite highlights are stashed HTML by now; the rest (with
+        CodeHilite off, say) are still `<pre>` elements.
+        """
+        if not isinstance(element.tag, str) or element.tag in NOT_TEXT:
+            return
+        if element.tag == "pre" and not self.include_code:
+            return
+        if element.text:
+            yield element.text
+        for child in element:
+            yield from self.itertext(child)
+            if child.tail:
+                yield child.tail
+
+    def run(self, root: Element) -> None:
+        """Run the Treeprocessor to record the document's text.
+
+        NB: This sets 'self.md.plaintext' and leaves the tree untouched.
+
+        """
+        text = " ".join(t.strip() for t in self.itertext(root) if t.strip())
+        text = util.HTML_PLACEHOLDER_RE.sub(self.stashed_text, text)
+        text = RE_PLACEHOLDER.sub(" ", text)
+        text = html.unescape(text.replace(util.AMP_SUBSTITUTE, "&"))
+        self.md.plaintext = " ".join(text.split())  # type: ignore
+
+
+# The highlight cache of the conversion in progress, if any
+_highlights: ContextVar[Optional[MutableMapping[str, str]]] = ContextVar(
+    "highlights", default=None
+)
+
+
+def _cached_hilite(hilite):
+    """Wrap CodeHilite.hilite to look code blocks up in the active cache."""
+
+    @functools.wraps(hilite)
+    def wrap(self: CodeHilite, shebang: bool = True) -> str:
+        cache = _highlights.get()
+        if not self.use_pygments:
+            return hilite(self, shebang)
+        if cache is None:
+            with span("highlight", "code", lang=self.lang):
+                return hilite(self, shebang)
+        formatter = self.pygments_formatter
+        key = content_hash(
+            repr(
+                (
+                    self.src,
+                    self.lang,
+                    shebang,
+                    self.guess_lang,
+                    self.lang_prefix,
+                    formatter if isinstance(formatter, str) else repr(formatter),
+                    sorted(self.options.items()),
+                )
+            )
+        )
+        code = cache.get(key)
+        if code is None:
+            with span("highlight", "code", lang=self.lang):
+                code = cache[key] = hilite(self, shebang)
+        return code
+
+    wrap.scrivo_cached = True  # type: ignore
+    return wrap
+
+
+class HighlightCacheExtension(Extension):
+    """Reuse the Pygments output of code blocks highlighted before.
+
+    Both fenced and indented code blocks are highlighted by CodeHilite; while
+    a parser with this extension converts a document, each code block is
+    looked up in `cache` by a hash of its language, text and CodeHilite
+    options. Set `cache` to any mutable mapping (such as a DiskCache); it
+    should be dropped when Pygments changes. With no cache (the default),
+    code is highlighted as usual.
+    """
+
+    def __init__(self, **kwargs: Any) -> None:
+        """Start out without a cache."""
+        self.cache: Optional[MutableMapping[str, str]] = None
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md):
+        """Hook into CodeHilite and bracket each conversion."""
+        if not getattr(CodeHilite.hilite, "scrivo_cached", False):
+            CodeHilite.hilite = _cached_hilite(CodeHilite.hilite)  # type: ignore
+        md.registerExtension(self)
+        # Before any code block is highlighted, and after all of them are
+        md.preprocessors.register(HighlightCacheSwitch(md, self), "highlights", 100)
+        md.postprocessors.register(HighlightCacheSwitch(md, None), "highlights", -100)
+
+    def reset(self) -> None:
+        """Stop using the cache (a conversion may have failed midway)."""
+        _highlights.set(None)
+
+
+class HighlightCacheSwitch(Preprocessor, Postprocessor):
+    """Turn an extension's highlight cache on (or off, given no extension)."""
+
+    def __init__(self, md, extension: Optional[HighlightCacheExtension]) -> None:
+        """A switch for one parser."""
+        super().__init__(md)
+        self.extension = extension
 
-        # lowercase the keys
-        self.md.metadata = {k.lower(): v for k, v in metadata.items()}
-        return new_lines
+    def run(self, data):
+        """Set the active cache, passing the lines or text through."""
+        _highlights.set(self.extension.cache if self.extension else None)
+        return data
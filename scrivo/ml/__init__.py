@@ -1,3 +1,8 @@
 """ML tools for the website."""
 
-from scrivo.ml.page_similarity import page_similarities  # noqa: F401
+from scrivo.ml.page_similarity import (  # noqa: F401
+    TokenCache,
+    page_similarities,
+    tokenizer_fingerprint,
+)
+from scrivo.ml.tfidf import TfidfModel  # noqa: F401
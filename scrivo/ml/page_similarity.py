@@ -1,32 +1,45 @@
 """Compute text similarity between Pages."""
 
 import logging
+import os
 import re
-from typing import Dict, List
+from functools import lru_cache
+from importlib.metadata import version
+from typing import List, MutableMapping, Optional, Tuple
 
 import numpy as np
-from bs4 import BeautifulSoup
-from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, TfidfVectorizer
 from snowballstemmer import EnglishStemmer
 
+from scrivo.cache import DiskCache
+from scrivo.ml.stop_words import ENGLISH_STOP_WORDS
+from scrivo.ml.tfidf import TfidfModel
 from scrivo.page import Page
-from scrivo.utils import logtime
+from scrivo.trace import span
+from scrivo.utils import content_hash, logtime
 
 STEMMER = EnglishStemmer()
 
+# From TfidfVectorizer.__init__()
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+# Bump this when tokenization changes in a way the versions below don't show
+TOKENIZER_REVISION = 3
+# Anything whose upgrade could change the tokens
+_TOKEN_PACKAGES = ("snowballstemmer",)
+
 logger = logging.getLogger(__name__)
 
+# Most words in a corpus have been stemmed many times before
+stem_word = lru_cache(maxsize=2**16)(STEMMER.stemWord)
+
 
 # Get a plaintext rendering of a page
 def get_page_plaintext(p: Page) -> str:
-    """Return a plaintext page rendering for tokenization."""
-    # Bit of a hack, but throw in any tags and the page title
-    title_text = p.meta["title"]
-    tags_text = " ".join(p.meta["tags"])
-    page_text = BeautifulSoup(p.html, features="html.parser").get_text(
-        separator=" ", strip=True
-    )
-    return " ".join([title_text, tags_text, page_text])
+    """Return a plaintext page rendering for tokenization.
+
+    The Markdown parser captures this (title, tags and text) as it converts.
+    """
+    return p.plaintext
 
 
 def tokenize_stop_stem(doc: str) -> List[str]:
@@ -34,43 +47,80 @@ def tokenize_stop_stem(doc: str) -> List[str]:
 
     Same tokenizer and stop words as sklearn, but with snowball stemming.
     """
-    # From TfidfVectorizer.__init__()
-    PATTERN = re.compile(r"(?u)\b\w\w+\b")
-    return STEMMER.stemWords(
-        t for t in PATTERN.findall(doc) if t not in ENGLISH_STOP_WORDS
-    )
+    return [
+        stem_word(t) for t in TOKEN_PATTERN.findall(doc) if t not in ENGLISH_STOP_WORDS
+    ]
+
+
+def tokenizer_fingerprint() -> str:
+    """Return a hash of everything that determines a page's tokens."""
+    versions = [version(package) for package in _TOKEN_PACKAGES]
+    return content_hash(repr((TOKENIZER_REVISION, TOKEN_PATTERN.pattern, versions)))
+
+
+class TokenCache(DiskCache):
+    """An on-disk cache of page tokens, keyed by page source hash.
+
+    Args:
+        directory (str): directory to keep the cache file in
+        max_bytes (int): size limit for the cache
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 2**20) -> None:
+        """Open the token cache within a directory."""
+        super().__init__(
+            os.path.join(directory, "token-cache.sqlite"),
+            fingerprint=tokenizer_fingerprint(),
+            max_bytes=max_bytes,
+        )
+
+
+def page_tokens(
+    p: Page, tokens: Optional[MutableMapping[str, List[str]]] = None
+) -> List[str]:
+    """Return the (possibly cached) tokens for a page.
+
+    Pages are lowercased before tokenizing, as TfidfVectorizer would.
+    """
+    cached = tokens.get(p.source_hash) if tokens is not None else None
+    if cached is None:
+        with span("tokenize", "page", page=p.website_path):
+            cached = tokenize_stop_stem(get_page_plaintext(p).lower())
+        if tokens is not None:
+            tokens[p.source_hash] = cached
+    return cached
 
 
 # Compute the TF-IDF for a collection of Pages
 @logtime
-def page_similarities(pages: List[Page]) -> Dict[Page, Dict[float, Page]]:
-    """Calculate TF-IDF page similarities between all pages.
+def page_similarities(
+    pages: List[Page],
+    tokens: Optional[MutableMapping[str, List[str]]] = None,
+    model: Optional[TfidfModel] = None,
+    k: int = 10,
+    min_score: float = 0.0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Find the most similar pages to each page by TF-IDF.
 
     Args:
         pages (list[Page]): the full collection of pages
+        tokens (mapping): previously computed page tokens, keyed by page
+          source hash; newly tokenized pages are added to it
+        model (TfidfModel): the model from a previous build, to be updated
+          rather than refit
+        k (int): the number of similar pages to find for each page
+        min_score (float): ignore similarities below this (and zero)
 
     Returns:
-        (dict[Page, dict[float, Page]]): a dict, keyed by Page, that
-          maps similar pages. The values are dicts keyed by the
-          similarity value for easy processing.
+        (ndarray, ndarray): two len(pages) x k arrays. Row i holds the
+          positions in `pages` of the pages most similar to `pages[i]`, in
+          descending order and padded with -1, and their similarities.
     """
-    # Compute the similarities
-    texts = map(get_page_plaintext, pages)
-    tfidf = TfidfVectorizer(
-        tokenizer=tokenize_stop_stem, stop_words=None, ngram_range=(1, 1)
+    model = TfidfModel() if model is None else model
+    model.update(
+        [p.source_hash for p in pages],
+        lambda i: page_tokens(pages[i], tokens),
+        k=k,
+        min_score=min_score,
     )
-    mat = tfidf.fit_transform(texts)
-    similarity = mat @ mat.T
-    # Return a descending-ordered set of nonzero similarities
-    result = {}
-    for i, page in enumerate(pages):
-        # Sort by similarity, descending, but track indices to match to pages
-        vec = similarity[:, i].toarray().reshape(-1)
-        indices = np.argsort(-vec)
-        # Mask out nonzero results
-        nonzero_indices = np.argwhere(vec > 0).reshape(-1)
-        indices = indices[np.isin(indices, nonzero_indices)]
-        # Build the final dict
-        result[page] = {vec[j]: pages[j] for j in indices if pages[j] != page}
-
-    return result
+    return model.related, model.scores
@@ -0,0 +1,330 @@
+"""An incrementally updated TF-IDF model.
+
+Weights follow scikit-learn's `TfidfVectorizer` defaults: raw term counts,
+smoothed IDF (`ln((1 + n) / (1 + df)) + 1`) and L2-normalized rows.
+
+Rather than refitting the corpus, the model keeps the term counts of every
+document and the document frequency of every term. An update only counts the
+documents that were added, adjusts the document frequencies, and recomputes
+the most similar documents only for rows whose TF-IDF vectors changed (or
+that might have gained or lost a neighbor that did).
+
+Since the IDF of every term depends on the number of documents, any added or
+removed document nudges every weight. Weights are only updated once they
+drift beyond a small tolerance, so the model's similarities stay within
+about a percent of an exact refit while one new post changes a handful of
+rows rather than all of them.
+"""
+
+import logging
+import os
+import pickle
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+__all__ = ["TfidfModel", "top_k_similar"]
+
+
+logger = logging.getLogger(__name__)
+
+# A document's (term columns, term counts)
+TermCounts = Tuple[np.ndarray, np.ndarray]
+
+
+def _select(
+    rows: np.ndarray, cols: np.ndarray, scores: np.ndarray, n_rows: int, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Pick the k best (row, col, score) candidates for each row.
+
+    Candidates are ranked by descending score, then ascending column, so ties
+    always resolve the same way.
+
+    Returns:
+        (ndarray, ndarray) n_rows x k columns (-1 if missing) and scores
+    """
+    indices = np.full((n_rows, k), -1, dtype=np.int64)
+    best = np.zeros((n_rows, k))
+    order = np.lexsort((cols, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = rank < k
+    indices[rows[keep], rank[keep]] = cols[keep]
+    best[rows[keep], rank[keep]] = scores[keep]
+    return indices, best
+
+
+def _candidates(
+    sim: np.ndarray, k: int, min_score: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return the (row, col, score) entries of a dense block that could be top-k.
+
+    Anything tied with the k-th best score is kept so `_select` can break
+    the tie by column.
+    """
+    m = sim.shape[1]
+    kth = np.partition(sim, m - min(k, m), axis=1)[:, m - min(k, m)]
+    mask = (sim >= kth[:, None]) & (sim > 0) & (sim >= min_score)
+    rows, cols = np.nonzero(mask)
+    return rows, cols, sim[rows, cols]
+
+
+def top_k_similar(
+    matrix: csr_matrix,
+    k: int,
+    min_score: float = 0.0,
+    rows: Optional[np.ndarray] = None,
+    max_bytes: int = 32 * 2**20,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Find the k most similar rows for each row of a normalized matrix.
+
+    Similarities are computed a block of rows at a time, so memory stays
+    within about `max_bytes` however large the corpus is.
+
+    Args:
+        matrix (csr_matrix): L2-normalized document vectors
+        k (int): the number of similar rows to find
+        min_score (float): ignore similarities below this (and zero)
+        rows (ndarray): only compute these rows
+        max_bytes (int): memory budget for a block of similarities
+
+    Returns:
+        (ndarray, ndarray) for each row, the k most similar other rows,
+          best first and -1 where there are none, and their similarities
+    """
+    n = matrix.shape[0]
+    rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.int64)
+    indices = np.full((len(rows), k), -1, dtype=np.int64)
+    scores = np.zeros((len(rows), k))
+    if n == 0 or k == 0:
+        return indices, scores
+    step = max(1, max_bytes // (8 * n))
+    matrix_t = matrix.T.tocsr()
+    for start in range(0, len(rows), step):
+        block = rows[start : start + step]
+        sim = (matrix[block] @ matrix_t).toarray()
+        # Pages are not related to themselves
+        sim[np.arange(len(block)), block] = 0
+        r, c, s = _candidates(sim, k, min_score)
+        indices[start : start + step], scores[start : start + step] = _select(
+            r, c, s, len(block), k
+        )
+    return indices, scores
+
+
+class TfidfModel:
+    """TF-IDF weights and most similar documents for an evolving corpus.
+
+    Documents are identified by a key (scrivo uses page source hashes), so an
+    edited document is a removed key plus an added one.
+
+    Args:
+        fingerprint (str): identifies the tokenizer that produced the terms
+
+    Attributes:
+        keys (list[str]): the documents, in matrix row order
+        matrix (csr_matrix): the normalized TF-IDF matrix
+        related (ndarray): rows of the k most similar documents (-1: none)
+        scores (ndarray): the cosine similarities that go with `related`
+        idf (ndarray): the weight of each term, each within IDF_TOLERANCE
+          (relative) of its exact value
+    """
+
+    VERSION = 3
+    # How far (relative) a term's weight may drift before it is updated
+    IDF_TOLERANCE = 0.01
+
+    def __init__(self, fingerprint: str = "") -> None:
+        """A model starts out with an empty corpus."""
+        self.fingerprint = fingerprint
+        self.vocabulary: Dict[str, int] = {}
+        self.counts: Dict[str, TermCounts] = {}
+        self.df = np.zeros(0, dtype=np.int64)
+        self.idf = np.zeros(0)
+        self.keys: List[str] = []
+        self.matrix = csr_matrix((0, 0))
+        self.k, self.min_score = 0, 0.0
+        self.related = np.zeros((0, 0), dtype=np.int64)
+        self.scores = np.zeros((0, 0))
+
+    def __repr__(self) -> str:
+        """String representation of a TfidfModel."""
+        return f"TfidfModel({len(self.keys)} documents, {len(self.vocabulary)} terms)"
+
+    def _count(self, tokens: List[str]) -> TermCounts:
+        """Return the sorted term columns and counts of a document."""
+        counter = Counter(tokens)
+        columns = np.fromiter(
+            (self.vocabulary.setdefault(t, len(self.vocabulary)) for t in counter),
+            dtype=np.int64,
+            count=len(counter),
+        )
+        counts = np.fromiter(counter.values(), dtype=np.float64, count=len(counter))
+        order = np.argsort(columns)
+        return columns[order], counts[order]
+
+    def update(
+        self,
+        keys: Sequence[str],
+        get_tokens: Callable[[int], List[str]],
+        k: int = 10,
+        min_score: float = 0.0,
+        max_bytes: int = 32 * 2**20,
+    ) -> np.ndarray:
+        """Bring the model up to date with a new corpus.
+
+        Args:
+            keys (sequence[str]): the documents, in the desired row order
+            get_tokens (callable): return the tokens of `keys[i]`; only called
+              for documents the model has not seen
+            k (int): the number of similar documents to keep for each one
+            min_score (float): ignore similarities below this
+            max_bytes (int): memory budget for a block of similarities
+
+        Returns:
+            (ndarray) a boolean mask of the rows whose TF-IDF vectors changed
+        """
+        previous = {k: i for i, k in enumerate(self.keys)}
+        delta = Counter(keys)
+        delta.subtract(self.keys)
+        for i, key in enumerate(keys):
+            if key not in self.counts:
+                self.counts[key] = self._count(get_tokens(i))
+
+        # Document frequencies move with the documents that came and went
+        df = np.zeros(len(self.vocabulary), dtype=np.int64)
+        df[: len(self.df)] = self.df
+        for key, change in delta.items():
+            if change:
+                df[self.counts[key][0]] += change
+        for key in set(self.counts).difference(keys):
+            del self.counts[key]
+
+        # Every weight drifts a little whenever the number of documents
+        # changes; a term keeps its weight until it is off by more than
+        # IDF_TOLERANCE, so adding or removing a document only reweights the
+        # (rarer) terms whose document frequency moved noticeably
+        n = len(keys)
+        exact_idf = np.log((1 + n) / (1 + df)) + 1
+        old_idf = np.full(len(exact_idf), np.nan)
+        old_idf[: len(self.idf)] = self.idf
+        current = np.abs(exact_idf - old_idf) <= self.IDF_TOLERANCE * exact_idf
+        idf = np.where(current, old_idf, exact_idf)
+        self.keys, self.df, self.idf = list(keys), df, idf
+
+        # Weight, then normalize, every row
+        rows = [self.counts[k] for k in self.keys]
+        lengths = np.fromiter((len(c) for c, _ in rows), dtype=np.int64, count=n)
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        indices = np.concatenate([c for c, _ in rows] or [np.zeros(0, np.int64)])
+        data = np.concatenate([v for _, v in rows] or [np.zeros(0)]) * idf[indices]
+        row_of = np.repeat(np.arange(n), lengths)
+        norms = np.sqrt(np.bincount(row_of, weights=data**2, minlength=n))
+        data /= norms[row_of]
+        matrix = csr_matrix((data, indices, indptr), shape=(n, len(idf)))
+
+        # A row changes when it is new or uses a term whose weight changed
+        old_rows = np.array([previous.get(k, -1) for k in self.keys], dtype=np.int64)
+        reweighted = np.flatnonzero(~current)
+        changed = old_rows < 0
+        if len(reweighted):
+            changed |= matrix[:, reweighted].getnnz(axis=1) > 0
+        self.matrix = matrix
+
+        if (
+            (k, min_score) != (self.k, self.min_score)
+            or len(set(self.keys)) != n
+            or changed.sum() * 4 > n
+        ):
+            self.related, self.scores = top_k_similar(
+                matrix, k, min_score, max_bytes=max_bytes
+            )
+        else:
+            self.related, self.scores = self._update_related(
+                old_rows, changed, k, min_score, max_bytes
+            )
+        self.k, self.min_score = k, min_score
+        logger.info("Updated %r: %d rows changed", self, changed.sum())
+        return changed
+
+    def _update_related(
+        self,
+        old_rows: np.ndarray,
+        changed: np.ndarray,
+        k: int,
+        min_score: float,
+        max_bytes: int = 32 * 2**20,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Merge the previous most similar rows with those that changed.
+
+        Similarities of the changed rows are computed a block at a time, as
+        in `top_k_similar`, so memory stays within about `max_bytes`.
+        """
+        n = len(old_rows)
+        c, u = np.flatnonzero(changed), np.flatnonzero(~changed)
+        related = np.full((n, k), -1, dtype=np.int64)
+        scores = np.zeros((n, k))
+
+        # Unchanged rows keep their unchanged neighbors and add changed ones;
+        # old rows map to new ones, and -1 (the last entry) stays -1
+        moved = np.full(len(self.related) + 1, -1, dtype=np.int64)
+        moved[old_rows[u]] = u
+        old_related = moved[self.related[old_rows[u]]]
+        kept = old_related >= 0
+        best = np.where(kept, old_related, -1)
+        best_scores = np.where(kept, self.scores[old_rows[u]], 0.0)
+
+        step = max(1, max_bytes // (8 * n))
+        matrix_t = self.matrix.T.tocsr()
+        for start in range(0, len(c), step):
+            block = c[start : start + step]
+            sim = (self.matrix[block] @ matrix_t).toarray()
+            sim[np.arange(len(block)), block] = 0
+            # Changed rows are recomputed outright
+            related[block], scores[block] = _select(
+                *_candidates(sim, k, min_score), len(block), k
+            )
+            if not len(u):
+                continue
+            # ... and offered as neighbors to the unchanged rows
+            r, j = np.nonzero(best >= 0)
+            new_r, new_j, new_scores = _candidates(sim[:, u].T, k, min_score)
+            best, best_scores = _select(
+                np.concatenate([r, new_r]),
+                np.concatenate([best[r, j], block[new_j]]),
+                np.concatenate([best_scores[r, j], new_scores]),
+                len(u),
+                k,
+            )
+        related[u], scores[u] = best, best_scores
+
+        # A full row that lost a neighbor may have had a runner-up we never kept
+        full = (self.related[old_rows[u]] >= 0).all(axis=1)
+        lost = ((self.related[old_rows[u]] >= 0) & ~kept).any(axis=1)
+        redo = u[full & lost]
+        if len(redo):
+            related[redo], scores[redo] = top_k_similar(
+                self.matrix, k, min_score, rows=redo, max_bytes=max_bytes
+            )
+        return related, scores
+
+    @classmethod
+    def load(cls, path: str, fingerprint: str) -> "TfidfModel":
+        """Read a saved model, or start afresh if it is missing or stale."""
+        try:
+            with open(path, "rb") as f:
+                version, model = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError) as e:
+            logger.info("Starting a new TF-IDF model: %s", e)
+            return cls(fingerprint)
+        if version != cls.VERSION or model.fingerprint != fingerprint:
+            return cls(fingerprint)
+        return model
+
+    def save(self, path: str) -> None:
+        """Write the model to disk."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump((self.VERSION, self), f, protocol=pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,185 @@
+"""Write build outputs only when their content changes.
+
+Rewriting a file with identical content still bumps its modification time,
+so rsync, CDNs and the like treat it as changed. The writer compares new
+content against the existing file (sizes first, then bytes) and leaves
+identical files alone. Changed files are written to a temporary file and
+renamed into place, so nothing ever sees a half-written output.
+"""
+
+import logging
+import os
+import stat
+import uuid
+from typing import Callable, Iterable, List, Optional, Union
+
+from scrivo.trace import span
+
+__all__ = [
+    "OutputWriter",
+    "remove_output",
+    "same_content",
+    "same_file_content",
+    "write_atomic",
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+def same_content(path: str, data: bytes) -> bool:
+    """Is a regular file at `path` holding exactly `data`?"""
+    try:
+        st = os.lstat(path)
+        if not stat.S_ISREG(st.st_mode) or st.st_size != len(data):
+            return False
+        with open(path, "rb") as fh:
+            return fh.read() == data
+    except OSError:
+        return False
+
+
+def same_file_content(path: str, other: str) -> bool:
+    """Is a regular file at `other` identical to the file at `path`?"""
+    try:
+        st = os.lstat(other)
+        if not stat.S_ISREG(st.st_mode) or st.st_size != os.path.getsize(path):
+            return False
+        with open(path, "rb") as fh, open(other, "rb") as other_fh:
+            while True:
+                block = fh.read(2**16)
+                if block != other_fh.read(2**16):
+                    return False
+                if not block:
+                    return True
+    except OSError:
+        return False
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write a file through a temporary file and a rename."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    # Created like open() would, so the umask applies
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def remove_output(root: str, output: str) -> None:
+    """Remove a file, and any directories that leaves empty, up to the root.
+
+    Args:
+        root (str): the directory `output` is relative to; never removed
+        output (str): the file to remove
+    """
+    root = os.path.abspath(root)
+    path = os.path.join(root, output)
+    if os.path.lexists(path):
+        os.remove(path)
+    parent = os.path.dirname(path)
+    while parent != root and parent.startswith(root + os.sep):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            # Not empty (or someone else got to it first)
+            break
+        parent = os.path.dirname(parent)
+
+
+class OutputWriter:
+    """Writes the outputs of a build and records which ones changed.
+
+    Args:
+        build_dir (str): the build directory; changed paths are relative to it
+        on_change (callable): called with each changed output, as soon as it
+          is written
+
+    Attributes:
+        changed (list[str]): the outputs that were written
+        unchanged (int): the number of outputs left as they were
+    """
+
+    def __init__(
+        self, build_dir: str, on_change: Optional[Callable[[str], None]] = None
+    ) -> None:
+        """A writer starts out having written nothing."""
+        self.build_dir = build_dir
+        self.on_change = on_change
+        self.changed: List[str] = []
+        self.unchanged = 0
+
+    def __repr__(self) -> str:
+        """String representation of an OutputWriter."""
+        return f"OutputWriter({len(self.changed)} changed, {self.unchanged} unchanged)"
+
+    def write(self, path: str, content: Union[str, bytes]) -> bool:
+        """Write an output unless it already has this content.
+
+        Args:
+            path (str): the output file
+            content (str | bytes): its content; text is encoded as UTF-8
+
+        Returns:
+            (bool) whether the file was written
+        """
+        data = content.encode("utf-8") if isinstance(content, str) else content
+        output = os.path.relpath(path, self.build_dir)
+        with span("write", "io", output=output):
+            if same_content(path, data):
+                self.unchanged += 1
+                return False
+            write_atomic(path, data)
+        self._changed(output)
+        return True
+
+    def write_stream(self, path: str, chunks: Iterable[str]) -> bool:
+        """Write an output from pieces of text, unless it has this content.
+
+        The pieces go straight to a temporary file, which only replaces the
+        output if the two differ.
+
+        Args:
+            path (str): the output file
+            chunks (iterable[str]): its content; encoded as UTF-8
+
+        Returns:
+            (bool) whether the file was written
+        """
+        output = os.path.relpath(path, self.build_dir)
+        with span("write", "io", output=output):
+            directory = os.path.dirname(path) or "."
+            os.makedirs(directory, exist_ok=True)
+            tmp = os.path.join(
+                directory, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp"
+            )
+            try:
+                with open(tmp, "w", encoding="utf-8") as fh:
+                    fh.writelines(chunks)
+                if same_file_content(tmp, path):
+                    self.unchanged += 1
+                    return False
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        self._changed(output)
+        return True
+
+    def merge(self, changed: List[str], unchanged: int) -> None:
+        """Add what another writer (say, in a worker process) did."""
+        for output in changed:
+            self._changed(output)
+        self.unchanged += unchanged
+
+    def _changed(self, output: str) -> None:
+        self.changed.append(output)
+        if self.on_change is not None:
+            self.on_change(output)
@@ -5,46 +5,178 @@ Pages originate in Markdown and are to be rendered as HTML.
 
 import json
 import os
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Any, Dict, Optional, Tuple, TypeVar
+from importlib.metadata import version
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 
-from jinja2 import Environment, FileSystemLoader, Template
+from jinja2 import FileSystemBytecodeCache, FileSystemLoader, Template
 from markdown import Markdown
+from markdown.extensions.footnotes import FootnoteExtension
+
+from scrivo.cache import DiskCache
+from scrivo.markdown import (
+    HighlightCacheExtension,
+    PlaintextExtension,
+    YAMLMetadataExtension,
+    load_front_matter,
+    split_front_matter,
+)
+from scrivo.templates import TemplateEnvironment
+from scrivo.trace import span
+from scrivo.utils import content_hash, get_tz
+
+__all__ = [
+    "HighlightCache",
+    "Page",
+    "ParseCache",
+    "RelatedPages",
+    "highlighting",
+    "is_draft",
+    "load_templates_from_dir",
+    "scan_metadata",
+]
 
-from scrivo.markdown import YAMLMetadataExtension
-from scrivo.utils import get_tz
 
-__all__ = ["Page", "load_templates_from_dir"]
+# This is the entire configuration of the Markdown parser
+_MD_OPTIONS: Dict[str, Any] = {"output_format": "html5", "tab_length": 2}
+_MD_EXTENSIONS = [
+    "markdown.extensions.abbr",
+    "markdown.extensions.fenced_code",
+    "markdown.extensions.footnotes",
+    "markdown.extensions.tables",
+    "markdown.extensions.codehilite",
+    "markdown.extensions.smarty",
+    "markdown.extensions.toc",
+    "markdown.extensions.md_in_html",
+    "mdx_math",
+    YAMLMetadataExtension(),
+    PlaintextExtension(include_code=True),
+    HighlightCacheExtension(),
+]
+_MD_EXTENSION_CONFIGS: Dict[str, Dict[str, Any]] = {
+    "markdown.extensions.footnotes": {
+        "UNIQUE_IDS": True,
+        # https://github.com/jekyll/jekyll/issues/3751#issue-83081590
+        "BACKLINK_TEXT": "&#8617;&#xfe0e;",
+    },
+    "markdown.extensions.codehilite": {"use_pygments": True, "guess_lang": False},
+    "mdx_math": {"enable_dollar_delimiter": True},
+}
+# Anything whose upgrade could change the converted HTML
+_MD_PACKAGES = ("markdown", "pygments", "python-markdown-math", "scrivo")
+# Bump this when parse_markdown's output changes in a way the above don't show
+PARSER_REVISION = 3
 
+# What parse_markdown returns: HTML, metadata and plaintext
+Parsed = Tuple[str, Dict[str, Any], str]
 
-# This is the entire configuration of the Markdown parser
 _md_parser = Markdown(
-    output_format="html5",  # type: ignore
-    tab_length=2,
-    extensions=[
-        "markdown.extensions.abbr",
-        "markdown.extensions.fenced_code",
-        "markdown.extensions.footnotes",
-        "markdown.extensions.tables",
-        "markdown.extensions.codehilite",
-        "markdown.extensions.smarty",
-        "markdown.extensions.toc",
-        "markdown.extensions.md_in_html",
-        "mdx_math",
-        YAMLMetadataExtension(),
-    ],
-    extension_configs={
-        "markdown.extensions.footnotes": {
-            "UNIQUE_IDS": True,
-            # https://github.com/jekyll/jekyll/issues/3751#issue-83081590
-            "BACKLINK_TEXT": "&#8617;&#xfe0e;",
-        },
-        "markdown.extensions.codehilite": {"use_pygments": True, "guess_lang": False},
-        "mdx_math": {"enable_dollar_delimiter": True},
-    },
+    **_MD_OPTIONS,
+    extensions=_MD_EXTENSIONS,
+    extension_configs=_MD_EXTENSION_CONFIGS,
+)
+
+# Unique footnote IDs are numbered by the footnotes extension itself
+_md_footnotes = next(
+    e for e in _md_parser.registeredExtensions if isinstance(e, FootnoteExtension)
+)
+_md_highlights = next(
+    e for e in _MD_EXTENSIONS if isinstance(e, HighlightCacheExtension)
 )
 
 
+def parser_fingerprint() -> str:
+    """Return a hash of the Markdown parser configuration and its versions."""
+    extensions = [
+        e
+        if isinstance(e, str)
+        else (f"{type(e).__module__}.{type(e).__name__}", e.getConfigs())
+        for e in _MD_EXTENSIONS
+    ]
+    versions = [version(package) for package in _MD_PACKAGES]
+    return content_hash(
+        repr(
+            (
+                PARSER_REVISION,
+                _MD_OPTIONS,
+                extensions,
+                _MD_EXTENSION_CONFIGS,
+                versions,
+            )
+        )
+    )
+
+
+class ParseCache(DiskCache):
+    """An on-disk cache of parsed Markdown (HTML, metadata, text) by source hash.
+
+    The cache is dropped whenever the parser configuration or the version of
+    Markdown, Pygments, etc. changes.
+
+    Args:
+        directory (str): directory to keep the cache file in
+        max_bytes (int): size limit for the cache
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 2**20) -> None:
+        """Open the parse cache within a directory."""
+        super().__init__(
+            os.path.join(directory, "parse-cache.sqlite"),
+            fingerprint=parser_fingerprint(),
+            max_bytes=max_bytes,
+        )
+
+
+class HighlightCache(DiskCache):
+    """An on-disk cache of Pygments-highlighted code blocks.
+
+    Blocks are keyed by their language, code and CodeHilite options, so
+    they are reused even when the rest of a page changes. The cache is
+    dropped whenever Markdown or Pygments is upgraded.
+
+    Args:
+        directory (str): directory to keep the cache file in
+        max_bytes (int): size limit for the cache
+        readonly (bool): never write to the cache file
+    """
+
+    FILENAME = "highlight-cache.sqlite"
+
+    def __init__(
+        self, directory: str, max_bytes: int = 32 * 2**20, readonly: bool = False
+    ) -> None:
+        """Open the highlight cache within a directory."""
+        versions = [version(package) for package in ("markdown", "pygments")]
+        super().__init__(
+            os.path.join(directory, self.FILENAME),
+            fingerprint=content_hash(repr(versions)),
+            max_bytes=max_bytes,
+            readonly=readonly,
+        )
+
+
+@contextmanager
+def highlighting(cache: Optional[MutableMapping[str, str]]) -> Iterator[None]:
+    """Look up code blocks in a highlight cache while parsing Markdown."""
+    previous, _md_highlights.cache = _md_highlights.cache, cache
+    try:
+        yield
+    finally:
+        _md_highlights.cache = previous
+
+
 def get_default(dct, key, default=None, fn=None):
     """Get a value from a dict and transform if not the default."""
     value = dct.get(key, default)
@@ -118,66 +250,210 @@ def set_metadata(raw_meta: Dict) -> Dict[str, Any]:
     return meta
 
 
-def parse_markdown(source: str) -> Tuple[str, Dict]:
+def _header_lines(lines: Iterable[str]) -> Optional[List[str]]:
+    """Return the YAML block at the top of some lines, as the parser sees it."""
+    tab_length = _MD_OPTIONS["tab_length"]
+    block, _ = split_front_matter(
+        line.rstrip("\r\n").expandtabs(tab_length) for line in lines
+    )
+    return block
+
+
+def scan_metadata(lines: Iterable[str]) -> Dict[str, Any]:
+    """Read a page's metadata without converting the page.
+
+    Only the YAML block at the top is read (with libyaml, if PyYAML has it),
+    as the Markdown parser would read it.
+
+    Args:
+        lines (iterable[str]): the lines of the Markdown source, say an open
+          file; only the lines up to the end of the YAML block are read
+
+    Returns:
+        (dict[str, Any]) the metadata, as `parse_markdown` returns it
+    """
+    block = _header_lines(lines)
+    return set_metadata(load_front_matter(block) if block is not None else {})
+
+
+def is_draft(path: str) -> bool:
+    """Is a Markdown file a draft, going by its YAML block alone?"""
+    with open(path, "r") as f:
+        block = _header_lines(f)
+    # Most pages never mention drafts, so skip loading their YAML
+    if block is None or "draft" not in "\n".join(block).lower():
+        return False
+    return set_metadata(load_front_matter(block))["draft"]
+
+
+def parse_markdown(source: str) -> Parsed:
     """Parse a Markdown document using our custom parser.
 
     Args:
         source (str): the Markdown source text
 
     Returns:
-        tuple(str, dict):
+        tuple(str, dict, str):
             1. the converted output as a string
             2. any extracted metadata as a dict
+            3. a plaintext rendering: the title, tags and text
 
     """
     # Reset or we'll have leftover garbage from the previous file
     _md_parser.reset()
+    # Number footnotes from the source itself, not from the parse order, so a
+    # page converts the same way no matter which pages were parsed before it
+    _md_footnotes.unique_prefix = int(content_hash(source)[:6], 16)
     html: str = _md_parser.convert(source)
     meta: Dict = set_metadata(_md_parser.metadata)  # type: ignore
-    return html, meta
+    text = " ".join(
+        [meta["title"] or "", " ".join(meta["tags"]), _md_parser.plaintext]  # type: ignore
+    )
+    return html, meta, text
 
 
 # This TypeVar allows us to type hint a class method
 T = TypeVar("T", bound="Page")
 
 
+class RelatedPages(Tuple[Tuple[float, "Page"], ...]):
+    """(score, Page) pairs for a page's most similar pages, best first.
+
+    The dict-style accessors keep templates that were written against the
+    old {score: Page} dict working.
+    """
+
+    def items(self) -> Iterator[Tuple[float, "Page"]]:
+        """Iterate over the (score, Page) pairs."""
+        return iter(self)
+
+    def keys(self) -> Iterator[float]:
+        """Iterate over the scores."""
+        return (score for score, _ in self)
+
+    def values(self) -> Iterator["Page"]:
+        """Iterate over the pages."""
+        return (page for _, page in self)
+
+
 class Page:
     """A single page for the website.
 
+    Pages have no instance dicts, and hold their related pages as (index,
+    score) pairs into the list of all pages rather than as references, so
+    a site's pages stay small in memory. Paths derived from `website_path`
+    are worked out once.
+
+    A deferred page reads only its metadata up front and converts its
+    Markdown the first time its HTML or text is used, so pages that only
+    ever need metadata never pay for the conversion.
+
     Args:
         source (str): Markdown page source
         website_path (str): path relative to the website root
-        template (Template): Jinja2 template
+        parsed (mapping): previously parsed sources, keyed by source hash;
+          pages parsed here (but not deferred ones) are added to it
+        keep_source (bool): keep the source around after parsing it; when
+          False, `source` is None
+        defer (bool): put off converting the source until it is needed,
+          unless it is found in `parsed`
 
     Attributes:
-        (none)
+        source_hash (str): content hash of the Markdown source
+        plaintext (str): the title, tags and text of the page, without markup
 
     """
 
-    def __init__(self, source: str, website_path: str) -> None:
+    __slots__ = (
+        "source",
+        "website_path",
+        "source_hash",
+        "meta",
+        "_html",
+        "_plaintext",
+        "_unparsed",
+        "_slug",
+        "_rootdir",
+        "_escaped_html",
+        "_related",
+        "_all_pages",
+    )
+
+    def __init__(
+        self,
+        source: str,
+        website_path: str,
+        parsed: Optional[MutableMapping[str, Parsed]] = None,
+        keep_source: bool = True,
+        defer: bool = False,
+    ) -> None:
         """A Page is created from a source and with a path."""
-        self.source = source
+        self.source: Optional[str] = source if keep_source else None
         self.website_path = website_path
+        self.source_hash = content_hash(source)
+        self._slug = os.path.splitext(website_path)[0]
+        self._rootdir = os.path.dirname(website_path)
+        self._escaped_html: Optional[str] = None
+        self._unparsed: Optional[str] = None
+
+        # Parse the source to HTML and metadata, unless we already have
+        cached = parsed.get(self.source_hash) if parsed is not None else None
+        if cached is not None:
+            html, meta, plaintext = cached
+            self.meta = dict(meta)
+            self._set_content(html, plaintext)
+        elif defer:
+            self.meta = scan_metadata(source.split("\n"))
+            self._unparsed = source
+            self._html, self._plaintext = "", ""
+        else:
+            with span("parse", "page", page=website_path):
+                html, self.meta, plaintext = parse_markdown(source)
+            if parsed is not None:
+                parsed[self.source_hash] = (html, dict(self.meta), plaintext)
+            self._set_content(html, plaintext)
 
-        # Parse the source to HTML and metadata
-        self.html, self.meta = parse_markdown(self.source)
+        # Allow for related pages
+        self._related: Tuple[Tuple[int, float], ...] = ()
+        self._all_pages: Sequence[Page] = ()
 
+    def _set_content(self, html: str, plaintext: str) -> None:
+        """Keep the converted HTML and text."""
         # Hack to add text for R and Python
         if "r-programming" in self.meta.get("tags", []):
-            self.html += (
+            html += (
                 "\n\n<hr>\n\n"
                 "<p><i>This post and others like it are kindly republished by "
                 '<a href="https://www.r-bloggers.com/">R-bloggers</a>.</i></p>\n'
             )
         if "python-programming" in self.meta.get("tags", []):
-            self.html += (
+            html += (
                 "\n\n<hr>\n\n"
                 "<p><i>This post and others like it are kindly republished by "
                 '<a href="https://www.python-bloggers.com/">Python-bloggers</a>.</i></p>\n'
             )
+        self._html, self._plaintext = html, plaintext
 
-        # Allow for related pages
-        self.related_pages: Dict[float, Page] = {}
+    def _convert(self) -> None:
+        """Convert a deferred page's Markdown, if it has not been yet."""
+        if self._unparsed is None:
+            return
+        with span("parse", "page", page=self.website_path):
+            html, _, plaintext = parse_markdown(self._unparsed)
+        self._unparsed = None
+        self._set_content(html, plaintext)
+
+    @property
+    def html(self) -> str:
+        """Return the page's HTML."""
+        self._convert()
+        return self._html
+
+    @property
+    def plaintext(self) -> str:
+        """Return the title, tags and text of the page, without markup."""
+        self._convert()
+        return self._plaintext
 
     def __repr__(self) -> str:
         """String representation of a Page."""
@@ -213,12 +489,12 @@ class Page:
     @property
     def url(self) -> str:
         """Return the HTML-extension URL for the page."""
-        return self.slug + ".html"
+        return self._slug + ".html"
 
     @property
     def slug(self) -> str:
         """Return the no-extension slug for the page."""
-        return os.path.splitext(self.website_path)[0]
+        return self._slug
 
     @property
     def date(self) -> datetime:
@@ -230,45 +506,113 @@ class Page:
     @property
     def rootdir(self) -> str:
         """Return the "root" to return to."""
-        dirname = os.path.dirname(self.website_path)
-        return dirname
+        return self._rootdir
 
     @property
     def escaped_html(self) -> str:
         """Return escaped HTML for JSON feed."""
-        return json.dumps(self.html)
+        if self._escaped_html is None:
+            self._escaped_html = json.dumps(self.html)
+        return self._escaped_html
 
     @property
     def is_blog(self) -> bool:
         """Does this Page look blog-related?"""
         return self.website_path.startswith("blog/")
 
+    @property
+    def related_pages(self) -> RelatedPages:
+        """Return the most similar pages, as (score, Page) pairs."""
+        return RelatedPages((score, self._all_pages[i]) for i, score in self._related)
+
+    def bind_related_pages(
+        self, pages: Sequence["Page"], related: Iterable[Tuple[int, float]]
+    ) -> None:
+        """Set the most similar pages.
+
+        Args:
+            pages (sequence[Page]): all of the pages
+            related (iterable[tuple[int, float]]): (index into `pages`,
+              score) pairs, best first
+        """
+        self._all_pages = pages
+        self._related = tuple(related)
+
     def count_related_pages(
         self, threshold: float = 1.0, only_blog: bool = False
     ) -> float:
         """Return the number of related posts with a given score."""
         return sum(
             score >= threshold
-            for score, page in self.related_pages.items()
-            if not only_blog or page.is_blog
+            for i, score in self._related
+            if not only_blog or self._all_pages[i].is_blog
         )
 
     @classmethod
-    def from_path(cls, src: str, website_root: str) -> "Page":
+    def from_path(
+        cls,
+        src: str,
+        website_root: str,
+        parsed: Optional[MutableMapping[str, Parsed]] = None,
+        keep_source: bool = True,
+        defer: bool = False,
+    ) -> "Page":
         """Return a new Page read from a file.
 
         Args:
             src (str): path to the paper
             website_root (str): the local root of the website
+            parsed (mapping): previously parsed sources, keyed by source hash
+            keep_source (bool): keep the source around after parsing it
+            defer (bool): put off converting the source until it is needed
 
         Return:
             (Page) a new Page object
         """
         with open(src, "r") as f:
-            return Page(f.read(), os.path.relpath(src, website_root))
+            return Page(
+                f.read(),
+                os.path.relpath(src, website_root),
+                parsed,
+                keep_source,
+                defer,
+            )
 
 
 # Load templates
-def load_templates_from_dir(directory: str) -> Environment:
-    """Produce an Environment targeted at a directory."""
-    return Environment(loader=FileSystemLoader(directory))  # noqa: S701
+def load_templates_from_dir(
+    directory: str,
+    cache_dir: Optional[str] = None,
+    precompile: bool = False,
+    references: Optional[Dict[str, Optional[List[str]]]] = None,
+) -> TemplateEnvironment:
+    """Produce an Environment targeted at a directory.
+
+    Templates are not checked for changes once loaded; a build loads them
+    afresh.
+
+    Args:
+        directory (str): the template directory
+        cache_dir (str): keep compiled templates here between builds
+        precompile (bool): compile all templates ahead of time into Python
+          modules in `cache_dir` (ignored without one)
+        references (dict[str, list[str]]): template references found by an
+          earlier build, by template source hash
+
+    Returns:
+        (TemplateEnvironment) the templates
+    """
+    bytecode_cache = None
+    if cache_dir is not None:
+        bytecode_cache = FileSystemBytecodeCache(os.path.join(cache_dir, "jinja"))
+        os.makedirs(bytecode_cache.directory, exist_ok=True)
+    env = TemplateEnvironment(  # noqa: S701
+        loader=FileSystemLoader(directory),
+        bytecode_cache=bytecode_cache,
+        auto_reload=False,
+    )
+    if references is not None:
+        env.add_known_references(references)
+    if precompile and cache_dir is not None:
+        env.precompile(cache_dir)
+    return env
@@ -0,0 +1,297 @@
+"""Rebuild the site as its sources change and preview it over HTTP.
+
+The watcher polls the source and template directories, so it needs nothing
+beyond the standard library. Every change triggers an incremental build in
+the same (warm) process, which only rewrites the outputs that changed and
+keeps the pages and TF-IDF model in memory, so only changed sources are read.
+
+The preview server serves the build directory. With live reload, HTML pages
+get a small script that long-polls the server and reloads the page as soon
+as a build finishes.
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from scrivo.build import WarmState, compile_site
+from scrivo.config import Config
+
+__all__ = ["BuildGeneration", "SourceWatcher", "serve_site", "watch_site"]
+
+
+logger = logging.getLogger(__name__)
+
+# Live-reload requests go here rather than to the build directory
+RELOAD_PATH = "/__scrivo__/reload"
+RELOAD_SCRIPT = f"""<script>
+(function poll(generation) {{
+  fetch("{RELOAD_PATH}?since=" + generation)
+    .then(function (r) {{ return r.text(); }})
+    .then(function (g) {{
+      if (generation >= 0 && g !== String(generation)) location.reload();
+      else poll(Number(g));
+    }})
+    .catch(function () {{ setTimeout(function () {{ poll(generation); }}, 1000); }});
+}})(-1);
+</script>
+"""
+
+
+class SourceWatcher:
+    """Poll directory trees for added, changed and removed files.
+
+    Args:
+        directories (iterable[str]): the directories to watch
+        ignore (callable): skip files (and directories) this returns True for
+
+    Hidden files (editor swap files and the like) are always ignored.
+    """
+
+    def __init__(
+        self,
+        directories: Iterable[str],
+        ignore: Optional[Callable[[str], bool]] = None,
+    ) -> None:
+        """Take a first snapshot of the watched files."""
+        self.directories = [os.path.abspath(d) for d in directories]
+        self.ignore = ignore or (lambda path: False)
+        self.files = self.snapshot()
+
+    def __repr__(self) -> str:
+        """String representation of a SourceWatcher."""
+        return f"SourceWatcher({len(self.files)} files)"
+
+    def snapshot(self) -> Dict[str, Tuple[int, int]]:
+        """Return the modification time and size of every watched file."""
+        files: Dict[str, Tuple[int, int]] = {}
+        stack = list(self.directories)
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith(".") or self.ignore(entry.path):
+                    continue
+                try:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    else:
+                        st = entry.stat()
+                        files[entry.path] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    continue
+        return files
+
+    def changes(self) -> Set[str]:
+        """Return the files that changed since the last call."""
+        files = self.snapshot()
+        changed = {
+            p for p in files.keys() | self.files if files.get(p) != self.files.get(p)
+        }
+        self.files = files
+        return changed
+
+    def wait(self, interval: float = 0.1) -> Set[str]:
+        """Block until some files change, and return them."""
+        while True:
+            changed = self.changes()
+            if changed:
+                return changed
+            time.sleep(interval)
+
+
+class BuildGeneration:
+    """A counter of finished builds that clients can wait on."""
+
+    def __init__(self) -> None:
+        """Nothing has been built yet."""
+        self.value = 0
+        self._changed = threading.Condition()
+
+    def bump(self) -> None:
+        """Record a finished build and wake every waiting client."""
+        with self._changed:
+            self.value += 1
+            self._changed.notify_all()
+
+    def wait(self, since: int, timeout: float = 30.0) -> int:
+        """Wait until the generation differs from `since` (or time out)."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.value != since, timeout)
+            return self.value
+
+
+class PreviewHandler(SimpleHTTPRequestHandler):
+    """Serve the build directory, with live reload and extension-less URLs."""
+
+    generation: Optional[BuildGeneration] = None
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Send request logs to the logger rather than stderr."""
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def do_GET(self) -> None:
+        """Answer a live-reload poll, or serve a file."""
+        url = urlsplit(self.path)
+        if url.path == RELOAD_PATH and self.generation is not None:
+            since = parse_qs(url.query).get("since", ["-1"])[0]
+            try:
+                value = self.generation.wait(int(since))
+            except ValueError:
+                value = self.generation.value
+            self.send_text(str(value), "text/plain")
+            return
+        path = self.translate_path(url.path)
+        if os.path.isdir(path) and url.path.endswith("/"):
+            path = os.path.join(path, "index.html")
+        if self.generation is None or not path.endswith(".html"):
+            super().do_GET()
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                html = fh.read()
+        except OSError:
+            super().do_GET()
+            return
+        self.send_text(inject_reload_script(html), "text/html")
+
+    def translate_path(self, path: str) -> str:
+        """Map a URL to a file, adding ".html" as the live site does."""
+        translated = super().translate_path(path)
+        if not os.path.exists(translated) and os.path.isfile(translated + ".html"):
+            return translated + ".html"
+        return translated
+
+    def send_text(self, text: str, content_type: str) -> None:
+        """Send a complete, uncached text response."""
+        body = text.encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def inject_reload_script(html: str) -> str:
+    """Add the live-reload script to an HTML page."""
+    end = html.lower().rfind("</body>")
+    if end < 0:
+        return html + RELOAD_SCRIPT
+    return html[:end] + RELOAD_SCRIPT + html[end:]
+
+
+def watch_site(
+    config: Config,
+    interval: float = 0.1,
+    on_build: Optional[Callable[[], None]] = None,
+    **options: Any,
+) -> None:
+    """Build the site, then rebuild it incrementally whenever a source changes.
+
+    Changes to the configuration file itself need a restart.
+
+    Args:
+        config (Config): the website configuration
+        interval (float): seconds between polls of the source directories
+        on_build (callable): called after every successful build
+        options: passed on to `compile_site`
+    """
+    build = functools.partial(
+        compile_site,
+        source_dir=config.site.source_dir,
+        build_dir=config.site.build_dir,
+        config=config,
+        incremental=True,
+        warm=WarmState(),
+        **options,
+    )
+    build_dir = os.path.abspath(config.site.build_dir) + os.sep
+    # Builds write the build counter, which must not trigger another build
+    counter = None
+    if config.build_count_file is not None:
+        counter = os.path.abspath(
+            os.path.join(
+                config.site.source_dir, os.path.basename(config.build_count_file)
+            )
+        )
+
+    def ignore(path: str) -> bool:
+        return path == counter or (path + os.sep).startswith(build_dir)
+
+    build()
+    if on_build is not None:
+        on_build()
+    watcher = SourceWatcher(
+        [config.site.source_dir, config.templates.source_dir], ignore
+    )
+    logger.info("Watching %r for changes", watcher)
+    while True:
+        changed = watcher.wait(interval)
+        logger.info("%d files changed, rebuilding", len(changed))
+        timer_start = time.perf_counter()
+        try:
+            build()
+        except Exception:
+            logger.exception("Build failed; waiting for the next change")
+            continue
+        logger.info("Rebuilt in %.03f s", time.perf_counter() - timer_start)
+        if on_build is not None:
+            on_build()
+
+
+def serve_site(
+    config: Config,
+    host: str = "localhost",
+    port: int = 8000,
+    live_reload: bool = True,
+    interval: float = 0.1,
+    **options: Any,
+) -> None:
+    """Serve the build directory while rebuilding the site as it changes.
+
+    Args:
+        config (Config): the website configuration
+        host (str): the address to serve on
+        port (int): the port to serve on
+        live_reload (bool): reload pages in the browser after each build
+        interval (float): seconds between polls of the source directories
+        options: passed on to `compile_site`
+    """
+    if options.get("jobs", 1) != 1:
+        # See can_fork: no pool is forked beside the server's threads
+        logger.warning(
+            "The preview server's threads keep builds from forking: pages "
+            "render in this process alone, and many are parsed by spawned ones"
+        )
+    generation = BuildGeneration() if live_reload else None
+    handler = type(
+        "Handler",
+        (PreviewHandler,),
+        {"generation": generation},
+    )
+    server = ThreadingHTTPServer(
+        (host, port),
+        functools.partial(handler, directory=config.site.build_dir),
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving {config.site.build_dir} at http://{host}:{port}/")
+    try:
+        watch_site(
+            config,
+            interval,
+            on_build=generation.bump if generation is not None else None,
+            **options,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,141 @@
+"""Write the sitemap from the outputs of a build.
+
+The build knows every page it produced, so the sitemap is made from that
+list rather than from a scan of the build directory. Sitemaps hold at most
+50,000 URLs; a bigger site gets numbered sitemaps and a sitemap index that
+lists them. Every sitemap is also written gzipped, unless the build gzips
+all of its outputs anyway.
+"""
+
+import gzip
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+from scrivo.output import OutputWriter
+from scrivo.page import Page
+
+__all__ = [
+    "MAX_URLS",
+    "PAGE_EXTENSIONS",
+    "last_modified",
+    "page_url",
+    "render_sitemap",
+    "write_sitemaps",
+]
+
+
+logger = logging.getLogger(__name__)
+
+# The most URLs one sitemap may hold (https://www.sitemaps.org/protocol.html)
+MAX_URLS = 50_000
+# Outputs that are pages (feeds and the like are not)
+PAGE_EXTENSIONS = (".html", ".pdf")
+SITEMAP = "sitemap.xml"
+
+# A URL and when it last changed
+SitemapEntry = Tuple[str, Optional[datetime]]
+
+
+def page_url(base_url: str, output: str) -> str:
+    """Return the public URL of an output, as the site serves it.
+
+    "index.html" maps to its directory and other pages lose ".html".
+    """
+    path = output.replace(os.sep, "/")
+    if path == "index.html" or path.endswith("/index.html"):
+        path = path[: -len("index.html")]
+    elif path.endswith(".html"):
+        path = path[: -len(".html")]
+    return f"{base_url.rstrip('/')}/{path}"
+
+
+def last_modified(pages: Iterable[Page]) -> Optional[datetime]:
+    """Return when the newest of some pages last changed, if any are dated."""
+    dates = [p.meta["modified"] or p.meta["date"] for p in pages]
+    return max((d for d in dates if d is not None), default=None)
+
+
+def _lastmod(date: Optional[datetime]) -> str:
+    if date is None:
+        return ""
+    # W3C datetimes need a time zone; without one, give only the day
+    if date.tzinfo is None:
+        return f"<lastmod>{date.date().isoformat()}</lastmod>"
+    return f"<lastmod>{date.isoformat(timespec='seconds')}</lastmod>"
+
+
+def render_sitemap(entries: Iterable[SitemapEntry], index: bool = False) -> str:
+    """Return a sitemap, or a sitemap index, of some URLs.
+
+    Args:
+        entries (iterable[SitemapEntry]): the URLs and their last changes
+        index (bool): the URLs are of sitemaps, not pages
+    """
+    outer, inner = ("sitemapindex", "sitemap") if index else ("urlset", "url")
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f'<{outer} xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
+    ]
+    lines += [
+        f"<{inner}><loc>{escape(url)}</loc>{_lastmod(date)}</{inner}>"
+        for url, date in entries
+    ]
+    lines += [f"</{outer}>"]
+    return "\n".join(lines) + "\n"
+
+
+def _write(
+    writer: OutputWriter, path: str, content: str, compressed: bool
+) -> List[str]:
+    """Write a sitemap and maybe its gzipped copy; return their paths."""
+    data = content.encode("utf-8")
+    writer.write(path, data)
+    if not compressed:
+        return [path]
+    # No timestamp in the header, so unchanged sitemaps stay byte-identical
+    writer.write(path + ".gz", gzip.compress(data, mtime=0))
+    return [path, path + ".gz"]
+
+
+def write_sitemaps(
+    pages: Dict[str, Optional[datetime]],
+    base_url: str,
+    writer: OutputWriter,
+    max_urls: int = MAX_URLS,
+    compressed: bool = True,
+) -> List[str]:
+    """Write the sitemap (or sitemaps and an index) for a build.
+
+    Args:
+        pages (dict[str, datetime]): page outputs, relative to the build
+          directory, and when they last changed (if known)
+        base_url (str): the URL of the site
+        writer (OutputWriter): writes into the build directory
+        max_urls (int): the most URLs per sitemap
+        compressed (bool): also write a gzipped copy of each sitemap; leave
+          this off when the build gzips all its outputs anyway
+
+    Returns:
+        (list[str]) the sitemap files, relative to the build directory
+    """
+    entries = sorted((page_url(base_url, p), date) for p, date in pages.items())
+    shards: Sequence[List[SitemapEntry]] = [
+        entries[i : i + max_urls] for i in range(0, len(entries), max_urls)
+    ] or [[]]
+    root = os.path.join(writer.build_dir, SITEMAP)
+    if len(shards) == 1:
+        written = _write(writer, root, render_sitemap(shards[0]), compressed)
+    else:
+        written, index = [], []  # type: List[str], List[SitemapEntry]
+        for number, shard in enumerate(shards, start=1):
+            name = f"sitemap-{number}.xml"
+            path = os.path.join(writer.build_dir, name)
+            written += _write(writer, path, render_sitemap(shard), compressed)
+            dates = [date for _, date in shard if date is not None]
+            index += [(page_url(base_url, name), max(dates, default=None))]
+        written += _write(writer, root, render_sitemap(index, index=True), compressed)
+    logger.info("Sitemap: %d URLs in %d sitemaps", len(entries), len(shards))
+    return [os.path.relpath(path, writer.build_dir) for path in written]
@@ -0,0 +1,177 @@
+"""Jinja2 templates and the dependencies between them.
+
+A template pulls in others through `extends`, `include` and `import`. The
+closure of those references tells a build which outputs to render again
+when a template changes. References are found by parsing the templates, so
+nothing has to be rendered to know them; a template name that is only known
+at render time (say, `{% extends layout %}`) makes a template depend on
+every template. A build keeps the references it found, by the hash of each
+template's source, so the next one only parses templates that changed.
+
+Compiling templates is the expensive part of loading them. Compiled code can
+be kept between builds in a bytecode cache, or all templates can be compiled
+ahead of time into Python modules (along with their references), so a build
+with unchanged templates never lexes, parses or compiles one.
+"""
+
+import json
+import logging
+import os
+import shutil
+import uuid
+from typing import Dict, FrozenSet, List, Optional
+
+from jinja2 import BaseLoader, Environment, ModuleLoader, TemplateNotFound, meta
+
+from scrivo.utils import content_hash
+
+__all__ = ["TemplateEnvironment"]
+
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateEnvironment(Environment):
+    """A Jinja2 Environment that knows which templates each template uses.
+
+    Attributes:
+        sources (BaseLoader): the loader of template sources; `loader` may
+          be switched to precompiled modules, this one never is
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        """Create the Environment; references are found as they are needed."""
+        super().__init__(*args, **kwargs)
+        self.sources: BaseLoader = self.loader  # type: ignore
+        self._references: Dict[str, Optional[FrozenSet[str]]] = {}
+        # Template source hash -> references
+        self._known: Dict[str, Optional[FrozenSet[str]]] = {}
+        self._hashes: Optional[Dict[str, str]] = None
+
+    def references(self, name: str) -> Optional[FrozenSet[str]]:
+        """Return the templates a template refers to directly.
+
+        Args:
+            name (str): the template name
+
+        Returns:
+            (frozenset[str]) the referenced template names; None if some are
+              only known at render time
+        """
+        if name not in self._references:
+            try:
+                source, _, _ = self.sources.get_source(self, name)
+            except TemplateNotFound:
+                self._references[name] = frozenset()
+            else:
+                key = content_hash(source)
+                if key not in self._known:
+                    found = set(meta.find_referenced_templates(self.parse(source)))
+                    self._known[key] = None if None in found else frozenset(found)
+                self._references[name] = self._known[key]
+        return self._references[name]
+
+    def known_references(self) -> Dict[str, Optional[List[str]]]:
+        """Return the references found so far, by template source hash.
+
+        Only the current templates are included; references an earlier build
+        found for sources that have since changed are dropped.
+
+        Returns:
+            (dict[str, list[str]]) the hash of a template's source -> the
+              sorted names it refers to, or None if some are only known at
+              render time
+        """
+        current = set(self.template_hashes().values())
+        return {
+            k: None if v is None else sorted(v)
+            for k, v in self._known.items()
+            if k in current
+        }
+
+    def add_known_references(self, known: Dict[str, Optional[List[str]]]) -> None:
+        """Take references found by an earlier build, so as not to parse again.
+
+        Args:
+            known (dict[str, list[str]]): as returned by `known_references`
+        """
+        self._known.update(
+            (k, None if v is None else frozenset(v)) for k, v in known.items()
+        )
+
+    def dependencies(self, name: str) -> List[str]:
+        """Return every template that rendering a template can load.
+
+        Args:
+            name (str): the template name
+
+        Returns:
+            (list[str]) the template and everything it refers to, directly
+              or not, sorted by name
+        """
+        seen, stack = set(), [name]
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            found = self.references(current)
+            if found is None:
+                return sorted(seen.union(self.sources.list_templates()))
+            stack += found
+        return sorted(seen)
+
+    def template_hashes(self) -> Dict[str, str]:
+        """Return a content hash for every template."""
+        if self._hashes is None:
+            self._hashes = {}
+            for name in self.sources.list_templates():
+                source, _, _ = self.sources.get_source(self, name)
+                self._hashes[name] = content_hash(source)
+        return dict(self._hashes)
+
+    def precompile(self, cache_dir: str) -> str:
+        """Compile every template into Python modules, and load them from there.
+
+        The modules go into a directory named for the hashes of all the
+        templates, so editing any template compiles a fresh set (and removes
+        the old ones); otherwise the set from an earlier build is reused.
+
+        Args:
+            cache_dir (str): the directory to keep compiled templates in
+
+        Returns:
+            (str) the directory holding the modules
+        """
+        key = content_hash(repr(sorted(self.template_hashes().items())))
+        target = os.path.join(cache_dir, f"templates-{key}")
+        if not os.path.isdir(target):
+            tmp = os.path.join(cache_dir, f".templates-{uuid.uuid4().hex}.tmp")
+            self.compile_templates(tmp, zip=None, ignore_errors=False)
+            references: Dict[str, Optional[List[str]]] = {}
+            for name in self.sources.list_templates():
+                found = self.references(name)
+                references[name] = None if found is None else sorted(found)
+            with open(os.path.join(tmp, "references.json"), "w") as fh:
+                json.dump(references, fh)
+            try:
+                os.rename(tmp, target)
+            except OSError:
+                # Another build got there first
+                shutil.rmtree(tmp, ignore_errors=True)
+            logger.info("Compiled %d templates into %s", len(references), target)
+            for entry in os.scandir(cache_dir):
+                if entry.name.startswith("templates-") and entry.path != target:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+        with open(os.path.join(target, "references.json")) as fh:
+            self._references = {
+                k: None if v is None else frozenset(v) for k, v in json.load(fh).items()
+            }
+        hashes = self.template_hashes()
+        self._known.update(
+            (hashes[k], v) for k, v in self._references.items() if k in hashes
+        )
+        self.loader = ModuleLoader(target)
+        self.cache.clear()  # type: ignore
+        return target
@@ -0,0 +1,216 @@
+"""Structured tracing of builds.
+
+Spans time the stages of a build and the work done on each page (parsing,
+highlighting, tokenizing, rendering and writing), on the monotonic clock and
+in CPU time. They nest, so a trace shows where each stage spends its time.
+
+A span always measures its wall time, which is all it does unless tracing is
+on (see `tracing`); then it is also recorded, with its CPU time and, for
+stages, the peak memory of the process so far. The trace is written in the
+Chrome trace-event format, which chrome://tracing and Perfetto
+(https://ui.perfetto.dev) open.
+
+Forked worker processes inherit the tracer. They hand back what they
+recorded with `worker_events`, and the parent adds it with `add_events`.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # type: ignore
+
+__all__ = [
+    "Span",
+    "Tracer",
+    "add_events",
+    "span",
+    "tracing",
+    "worker_events",
+]
+
+# The spans recorded per page, in the order of the summary table's columns
+PAGE_SPANS = ("parse", "tokenize", "render")
+
+TraceEvent = Dict[str, Any]
+
+
+def peak_memory_mb() -> Optional[float]:
+    """Return the peak resident memory of this process in MiB, if known."""
+    if resource is None:
+        return None
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+class Span:
+    """A timed piece of work.
+
+    Attributes:
+        name (str): what is being done
+        cat (str): its category, like "stage" or "page"
+        args (dict): anything else worth recording
+        seconds (float): the wall time taken, once the span has ended
+    """
+
+    __slots__ = ("name", "cat", "args", "seconds")
+
+    def __init__(self, name: str, cat: str, args: Dict[str, Any]) -> None:
+        """A span that has not ended yet."""
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.seconds = 0.0
+
+    def __repr__(self) -> str:
+        """String representation of a Span."""
+        return f"Span({self.name!r}, {self.seconds:.03f} s)"
+
+
+class Tracer:
+    """Collects spans as Chrome trace events.
+
+    Attributes:
+        events (list[dict]): the trace events recorded so far
+    """
+
+    def __init__(self) -> None:
+        """A tracer starts its clock when it is created."""
+        self.events: List[TraceEvent] = []
+        self.origin_ns = time.perf_counter_ns()
+        self.pid = os.getpid()
+
+    def __repr__(self) -> str:
+        """String representation of a Tracer."""
+        return f"Tracer({len(self.events)} events)"
+
+    def record(self, span: Span, start_ns: int, end_ns: int, cpu_ns: int) -> TraceEvent:
+        """Add a finished span as a "complete" trace event."""
+        args = dict(span.args, cpu_ms=round(cpu_ns / 1e6, 3))
+        if span.cat == "stage":
+            args["peak_memory_mb"] = peak_memory_mb()
+        event = {
+            "name": span.name,
+            "cat": span.cat,
+            "ph": "X",
+            "ts": (start_ns - self.origin_ns) / 1e3,
+            "dur": (end_ns - start_ns) / 1e3,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": args,
+        }
+        self.events.append(event)
+        return event
+
+    def save(self, path: str) -> None:
+        """Write the trace as JSON, naming the main and worker processes."""
+        names = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": "scrivo" if pid == self.pid else "scrivo worker"},
+            }
+            for pid in sorted({e["pid"] for e in self.events} | {self.pid})
+        ]
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump({"traceEvents": names + self.events}, fh)
+
+    def page_times(self) -> Dict[str, Dict[str, float]]:
+        """Return the milliseconds spent on each page, by kind of work."""
+        times: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for event in self.events:
+            page = event.get("args", {}).get("page")
+            if event.get("cat") == "page" and page is not None:
+                times[page][event["name"]] += event["dur"] / 1e3
+        return times
+
+    def slowest_pages(self, n: int = 10) -> List[Tuple[str, Dict[str, float]]]:
+        """Return the `n` pages that took longest, with their times."""
+        times = self.page_times()
+        return sorted(times.items(), key=lambda kv: -sum(kv[1].values()))[:n]
+
+    def summary(self, n: int = 10) -> str:
+        """Return a table of the slowest pages."""
+        rows = self.slowest_pages(n)
+        width = max([len(page) for page, _ in rows] + [len("Slowest pages (ms)")])
+        lines = [
+            f"{'Slowest pages (ms)':<{width}}  {'total':>8}"
+            + "".join(f"  {name:>8}" for name in PAGE_SPANS)
+        ]
+        for page, times in rows:
+            lines += [
+                f"{page:<{width}}  {sum(times.values()):8.1f}"
+                + "".join(f"  {times.get(name, 0.0):8.1f}" for name in PAGE_SPANS)
+            ]
+        return "\n".join(lines)
+
+
+# The active tracer, if tracing is on
+_tracer: Optional[Tracer] = None
+
+
+@contextmanager
+def tracing(path: Optional[str] = None) -> Iterator[Tracer]:
+    """Record spans while the context is active.
+
+    Args:
+        path (str): write the trace here when the context exits
+    """
+    global _tracer
+    previous, tracer = _tracer, Tracer()
+    _tracer = tracer
+    try:
+        yield tracer
+    finally:
+        _tracer = previous
+        if path is not None:
+            tracer.save(path)
+
+
+@contextmanager
+def span(name: str, cat: str = "build", **args: Any) -> Iterator[Span]:
+    """Time a piece of work, recording it if tracing is on.
+
+    Args:
+        name (str): what is being done
+        cat (str): its category; "stage" spans record peak memory, and
+          "page" spans with a `page` argument count toward the page summary
+        args: anything else worth recording, like the page
+    """
+    current = Span(name, cat, args)
+    tracer = _tracer
+    cpu_start = time.process_time_ns() if tracer is not None else 0
+    start = time.perf_counter_ns()
+    try:
+        yield current
+    finally:
+        end = time.perf_counter_ns()
+        current.seconds = (end - start) / 1e9
+        if tracer is not None:
+            tracer.record(current, start, end, time.process_time_ns() - cpu_start)
+
+
+def worker_events() -> List[TraceEvent]:
+    """Take the events recorded in this (forked worker) process."""
+    if _tracer is None or os.getpid() == _tracer.pid:
+        return []
+    pid = os.getpid()
+    events = [e for e in _tracer.events if e["pid"] == pid]
+    _tracer.events = []
+    return events
+
+
+def add_events(events: List[TraceEvent]) -> None:
+    """Add events that a worker process recorded to the trace."""
+    if _tracer is not None:
+        _tracer.events += events
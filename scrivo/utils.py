@@ -1,22 +1,30 @@
 """Miscellaneous utilities."""
 
+import functools
+import hashlib
 import logging
-import time
+import os
 from datetime import timezone
+from typing import List, Sequence, TypeVar, Union
 from zoneinfo import ZoneInfo
 
-__all__ = ["logtime"]
+from scrivo.trace import span
+
+__all__ = ["chunked", "content_hash", "cpu_jobs", "logtime"]
+
+T = TypeVar("T")
 
 
 def logtime(fn):
-    """Wrap a function with a performance logging statement."""
+    """Wrap a function with a performance logging statement (and a span)."""
     logger = logging.getLogger(__name__)
     fname = fn.__name__
 
+    @functools.wraps(fn)
     def wrap(*args, **kwargs):
-        timer_start = time.time()
-        out = fn(*args, **kwargs)
-        logger.info("%s() finished in %.03f sec", fname, time.time() - timer_start)
+        with span(fname, "stage") as timer:
+            out = fn(*args, **kwargs)
+        logger.info("%s() finished in %.03f sec", fname, timer.seconds)
         return out
 
     return wrap
@@ -25,3 +33,21 @@ def logtime(fn):
 def get_tz() -> timezone:
     """Set timezone to Eastern."""
     return ZoneInfo("America/New_York")
+
+
+def content_hash(data: Union[str, bytes]) -> str:
+    """Return a short hex digest identifying some content."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def cpu_jobs(jobs: int) -> int:
+    """Return a worker count, where zero means one per CPU."""
+    return jobs if jobs > 0 else os.cpu_count() or 1
+
+
+def chunked(items: Sequence[T], jobs: int, per_job: int = 4) -> List[Sequence[T]]:
+    """Split items into batches to spread across a number of workers."""
+    size = max(1, -(-len(items) // (jobs * per_job)))
+    return [items[i : i + size] for i in range(0, len(items), size)]
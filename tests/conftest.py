@@ -0,0 +1,94 @@
+"""Fixtures shared by the tests."""
+
+import glob
+import os
+import threading
+
+import pytest
+
+import scrivo.build
+from scrivo.bench.corpus import CorpusSpec, generate_corpus
+from scrivo.build import compile_site
+from scrivo.config import read_config
+
+
+class WatchedPool(scrivo.build.ProcessPoolExecutor):
+    """A process pool that records how it starts its workers and when it runs.
+
+    No pool may fork its workers while other threads are running.
+    """
+
+    contexts = []
+    running = False
+
+    def __init__(self, max_workers=None, mp_context=None, **kwargs):
+        method = "fork" if mp_context is None else mp_context.get_start_method()
+        if method == "fork":
+            assert threading.active_count() == 1, threading.enumerate()
+        WatchedPool.contexts.append(method)
+        super().__init__(max_workers, mp_context, **kwargs)
+
+    def __enter__(self):
+        WatchedPool.running = True
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        try:
+            return super().__exit__(*exc)
+        finally:
+            WatchedPool.running = False
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    """Build with WatchedPool; its `contexts` are the start methods used."""
+    monkeypatch.setattr(scrivo.build, "ProcessPoolExecutor", WatchedPool)
+    WatchedPool.contexts = []
+    WatchedPool.running = False
+    return WatchedPool
+
+
+@pytest.fixture
+def site(tmp_path):
+    """Return a function that makes a small synthetic site and reads its config.
+
+    It takes a name for the site's directory and any `CorpusSpec` fields.
+    """
+
+    def make(name="site", **spec):
+        options = dict(pages=6, tags=2, years=1, words=20, code_blocks=0, drafts=0)
+        options.update(spec)
+        path = generate_corpus(str(tmp_path / name), CorpusSpec(**options))
+        return read_config(path)
+
+    return make
+
+
+@pytest.fixture
+def build():
+    """Return a function that builds a site from its config, with any options."""
+
+    def build(config, **options):
+        return compile_site(
+            source_dir=config.site.source_dir,
+            build_dir=config.site.build_dir,
+            config=config,
+            **options,
+        )
+
+    return build
+
+
+@pytest.fixture
+def snapshot():
+    """Return a function that reads the outputs of a build matching a pattern."""
+
+    def snapshot(config, pattern="*.html"):
+        build_dir = config.site.build_dir
+        outputs = {}
+        for path in glob.glob(os.path.join(build_dir, "**", pattern), recursive=True):
+            with open(path, "rb") as fh:
+                outputs[os.path.relpath(path, build_dir)] = fh.read()
+        return outputs
+
+    return snapshot
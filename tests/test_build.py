@@ -0,0 +1,23 @@
+"""Building a site."""
+
+import re
+
+
+def related_links(outputs):
+    """Return the number of related pages listed on each post."""
+    return {
+        path: len(re.findall(rb"<ul>(.*?)</ul>", html)[-1].split(b"<li>")) - 1
+        for path, html in outputs.items()
+        if "/post-" in path
+    }
+
+
+def test_min_related_score(site, build, snapshot):
+    config = site(pages=20, tags=4, years=2, words=60)
+    build(config, max_related=5)
+    assert set(related_links(snapshot(config)).values()) == {5}
+
+    # Also when the previous model found more
+    for incremental in (True, False):
+        build(config, incremental=incremental, max_related=5, min_related_score=1.0)
+        assert set(related_links(snapshot(config)).values()) == {0}
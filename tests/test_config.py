@@ -0,0 +1,9 @@
+"""Site configuration."""
+
+from scrivo.config import DEFAULT_TAG_FEEDS, FeedTemplatesConfig
+
+
+def test_feed_defaults():
+    feeds = FeedTemplatesConfig(rss="rss.xml", rss_tag="rss-tag.xml", json="f.json")
+    assert feeds.tags == DEFAULT_TAG_FEEDS
+    assert feeds.max_items is None
@@ -0,0 +1,84 @@
+"""Deploying what changed to a local directory."""
+
+import glob
+import os
+
+import pytest
+
+from scrivo.deploy import LocalTarget, deploy, plan_deploy
+from scrivo.manifest import STATE_DIR, BuildManifest
+
+
+def files(directory):
+    """Return the content of every file under a directory, but scrivo's state."""
+    found = {}
+    for pwd, dirs, names in os.walk(directory):
+        if STATE_DIR in dirs:
+            dirs.remove(STATE_DIR)
+        for name in names:
+            path = os.path.join(pwd, name)
+            with open(path, "rb") as fh:
+                found[os.path.relpath(path, directory)] = fh.read()
+    return found
+
+
+def test_plan_deploy():
+    deployed = {"same": ("a", 1, 1), "edited": ("b", 1, 1), "gone": ("c", 1, 1)}
+    current = {"same": ("a", 1, 2), "edited": ("B", 2, 2), "new": ("d", 1, 1)}
+    plan = plan_deploy(current, deployed)
+    assert plan.added == ["new"]
+    assert plan.changed == ["edited"]
+    assert plan.deleted == ["gone"]
+    assert plan.uploads == ["edited", "new"]
+
+
+def test_deploy_to_a_directory(site, build, tmp_path):
+    config = site()
+    build_dir = config.site.build_dir
+    target = LocalTarget(str(tmp_path / "www"))
+    with pytest.raises(FileNotFoundError):
+        deploy(build_dir, target)
+
+    build(config, max_related=0)
+    plan = deploy(build_dir, target, transfers=2)
+    assert plan.changed == plan.deleted == []
+    assert sorted(plan.added) == sorted(BuildManifest.load(build_dir).outputs)
+    assert files(target.directory) == files(build_dir)
+
+    # Nothing changed
+    assert deploy(build_dir, target) == ([], [], [])
+
+    # Edit one post, delete another and add an asset
+    posts = sorted(glob.glob(os.path.join(config.site.source_dir, "blog/*/*/*.md")))
+    edited, removed = posts[0], posts[-1]
+    with open(edited, "a") as fh:
+        fh.write("\nOne more line.\n")
+    os.remove(removed)
+    with open(os.path.join(config.site.source_dir, "image.png"), "wb") as fh:
+        fh.write(b"\x89PNG")
+    build(config, incremental=True, max_related=0)
+
+    def html(source):
+        return os.path.relpath(source, config.site.source_dir)[: -len(".md")] + ".html"
+
+    # A dry run only says what would happen
+    before = files(target.directory)
+    plan = deploy(build_dir, target, dry_run=True)
+    assert plan.added == ["image.png"]
+    assert html(edited) in plan.changed
+    assert html(removed) in plan.deleted
+    assert files(target.directory) == before
+
+    assert deploy(build_dir, target) == plan
+    assert files(target.directory) == files(build_dir)
+    assert deploy(build_dir, target) == ([], [], [])
+
+
+def test_deleting_prunes_directories(tmp_path):
+    target = LocalTarget(str(tmp_path))
+    os.makedirs(tmp_path / "a" / "b")
+    (tmp_path / "a" / "b" / "page.html").write_text("hi")
+    (tmp_path / "a" / "keep.html").write_text("hi")
+    target.delete(["a/b/page.html"])
+    assert not (tmp_path / "a" / "b").exists()
+    assert (tmp_path / "a" / "keep.html").exists()
@@ -0,0 +1,47 @@
+"""Feeds, and the items they reuse."""
+
+import os
+import re
+
+import scrivo.page
+from scrivo.feeds import FeedCache
+from scrivo.manifest import STATE_DIR
+
+# A tag feed whose items show the feed's tag
+TAG_TEMPLATE = (
+    "<rss><channel>{% for post in posts %}{% block item scoped %}<item><title>"
+    "{{ post.meta.title }}</title><category>{{ tag }}</category></item>"
+    "{% endblock %}{% endfor %}</channel></rss>"
+)
+
+
+def test_changing_the_parser(site, build, snapshot, monkeypatch):
+    config = site()
+    build(config, max_related=0)
+
+    # A new parser revision, which renders differently
+    convert = scrivo.page._md_parser.convert
+    monkeypatch.setattr(scrivo.page, "PARSER_REVISION", 99)
+    monkeypatch.setattr(
+        scrivo.page._md_parser, "convert", lambda s: convert(s) + "<!--new-->"
+    )
+    build(config, max_related=0)
+    rss = snapshot(config, "rss.xml")["blog/rss.xml"]
+    assert rss.count(b"&lt;!--new--&gt;") == 6
+
+
+def test_items_that_show_the_tag(site, build, snapshot):
+    config = site(tags=3)
+    with open(os.path.join(config.templates.source_dir, "rss-tag.xml"), "w") as fh:
+        fh.write(TAG_TEMPLATE)
+    build(config, max_related=0)
+    feeds = snapshot(config, "rss-tag-*.xml")
+    assert len(feeds) == 3
+    for path, rss in feeds.items():
+        tag = os.path.basename(path)[len("rss-") : -len(".xml")].encode()
+        items = re.findall(rb"<item>.*?</item>", rss)
+        assert items
+        assert all(b"<category>" + tag + b"</category>" in i for i in items)
+    # Items that only show their post are still reused
+    with FeedCache(os.path.join(config.site.build_dir, STATE_DIR)) as cache:
+        assert len(cache) == 6
@@ -0,0 +1,46 @@
+"""No process is forked while other threads are running."""
+
+import threading
+
+from scrivo.compress import GzipSidecars
+
+SPEC = dict(pages=12, tags=3, years=2, words=40, code_blocks=1)
+OPTIONS = dict(jobs=2, max_related=3, parallel_archives=True, gzip_outputs=True)
+
+
+def test_sidecars_wait_to_start(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_text("<p>Hello</p>" * 100)
+    sidecars = GzipSidecars(str(tmp_path), jobs=2)
+    sidecars.submit("page.html")
+    sidecars.submit("page.html")
+    assert not any(t.name.startswith("gzip") for t in threading.enumerate())
+    assert sidecars.finish(["page.html"]) == ["page.html.gz"]
+    assert (tmp_path / "page.html.gz").exists()
+
+
+def test_gzip_threads_start_after_forking(site, build, snapshot, pools):
+    config = site(**SPEC)
+    build(config, **OPTIONS)
+    assert pools.contexts.count("fork") == 3
+    assert "blog/index.html.gz" in snapshot(config, "*.html.gz")
+
+
+def test_no_forking_beside_other_threads(site, build, snapshot, pools):
+    config = site("a", **SPEC)
+    build(config, **OPTIONS)
+    expected = snapshot(config, "*.html*")
+
+    # Like the preview server
+    done = threading.Event()
+    thread = threading.Thread(target=done.wait)
+    thread.start()
+    try:
+        config = site("b", **SPEC)
+        pools.contexts.clear()
+        build(config, **OPTIONS)
+    finally:
+        done.set()
+        thread.join()
+    assert pools.contexts == ["spawn"]
+    assert snapshot(config, "*.html*") == expected
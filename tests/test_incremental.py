@@ -0,0 +1,137 @@
+"""Incremental builds match full builds."""
+
+import glob
+import os
+
+import scrivo.page
+from scrivo.build import WarmState
+
+# A post template that shows something of each related page beyond its title
+BLOG_TEMPLATE = (
+    "{% extends 'base.html' %}{% block body %}<h1>{{ title }}</h1>{{ content }}"
+    "<ul>{% for score, p in related_pages.items() %}"
+    "<li><a href='/{{ p.url }}'>{{ p.meta.title }}</a> {{ p.meta.html_desc }}</li>"
+    "{% endfor %}</ul>{% endblock %}"
+)
+
+# The only post of its month, year and tag
+LONELY_POST = """---
+title: Lonely
+date: 2001-01-01 9:00 AM
+tags: [lonely]
+---
+
+Hi.
+"""
+
+
+def test_editing_a_related_page(site, build, snapshot):
+    config = site(pages=20, tags=4, years=2, words=60)
+    with open(os.path.join(config.templates.source_dir, "blog.html"), "w") as fh:
+        fh.write(BLOG_TEMPLATE)
+    build(config, max_related=5)
+
+    # The post that is most often related to others
+    outputs = snapshot(config)
+    posts = sorted(glob.glob(os.path.join(config.site.source_dir, "blog/*/*/*.md")))
+    url = {p: os.path.relpath(p, config.site.source_dir)[: -len(".md")] for p in posts}
+    post = max(
+        posts,
+        key=lambda p: sum(
+            f"/{url[p]}.html'".encode() in html for html in outputs.values()
+        ),
+    )
+
+    # Change what the related lists show, but not the text they are found from
+    with open(post) as fh:
+        source = fh.read()
+    with open(post, "w") as fh:
+        fh.write(source.replace("\n---\n", "\nhtml_desc: A new description\n---\n", 1))
+    changed = build(config, incremental=True, max_related=5)
+    incremental = snapshot(config)
+    assert len([c for c in changed if c.endswith(".html")]) > 1
+
+    build(config, max_related=5)
+    assert snapshot(config) == incremental
+
+
+def test_changing_the_parser(site, build, snapshot, monkeypatch):
+    config = site()
+    build(config, max_related=5)
+
+    # A new parser revision, which renders differently
+    convert = scrivo.page._md_parser.convert
+    monkeypatch.setattr(scrivo.page, "PARSER_REVISION", 99)
+    monkeypatch.setattr(
+        scrivo.page._md_parser, "convert", lambda s: convert(s) + "<!--new-->"
+    )
+    build(config, incremental=True, max_related=5)
+    posts = {
+        path: html
+        for path, html in snapshot(config).items()
+        if os.path.basename(path).startswith("post-")
+    }
+    assert len(posts) == 6
+    assert all(b"<!--new-->" in html for html in posts.values())
+
+
+def test_full_builds_do_not_depend_on_history(site, build, snapshot):
+    config = site(pages=300, tags=4, years=2, words=60)
+    build(config, max_related=5)
+
+    # Small enough a change that the incremental build keeps most weights
+    posts = sorted(glob.glob(os.path.join(config.site.source_dir, "blog/*/*/*.md")))
+    os.remove(posts[0])
+    build(config, incremental=True, max_related=5)
+
+    build(config, max_related=5)
+    full = snapshot(config)
+    build(config, max_related=5, cache=False)
+    assert snapshot(config) == full
+
+
+def test_removing_the_last_post_of_a_month_and_tag(site, build):
+    config = site()
+    build(config, max_related=5)
+    post = os.path.join(config.site.source_dir, "blog/2001/01/lonely.md")
+    os.makedirs(os.path.dirname(post))
+    with open(post, "w") as fh:
+        fh.write(LONELY_POST)
+    build(config, incremental=True, max_related=5)
+    outputs = [
+        os.path.join(config.site.build_dir, d)
+        for d in ("blog/2001", "blog/tags/lonely")
+    ]
+    assert all(os.path.isdir(d) for d in outputs)
+
+    os.remove(post)
+    build(config, incremental=True, max_related=5)
+    assert not any(os.path.exists(d) for d in outputs)
+    assert os.path.isdir(os.path.join(config.site.build_dir, "blog/tags"))
+
+
+def test_warm_rebuilds(site, build, snapshot):
+    # The same site, rebuilt in this process and as if by new ones
+    config, cold = site("warm"), site("cold")
+    warm = WarmState()
+    build(config, incremental=True, max_related=3, warm=warm)
+    build(cold, incremental=True, max_related=3)
+    pages = {path: page for path, (_, page) in warm.pages.items()}
+    model = warm.model
+
+    def edit_a_post(config):
+        posts = sorted(glob.glob(os.path.join(config.site.source_dir, "blog/*/*/*.md")))
+        with open(posts[0], "a") as fh:
+            fh.write("\nOne more line.\n")
+        return posts[0]
+
+    edited = edit_a_post(config)
+    edit_a_post(cold)
+    build(config, incremental=True, max_related=3, warm=warm)
+    build(cold, incremental=True, max_related=3)
+
+    # Only the edited post was read again, and the model stayed in memory
+    changed = [p for p, (_, page) in warm.pages.items() if page is not pages[p]]
+    assert changed == [edited]
+    assert warm.model is model
+    assert snapshot(config) == snapshot(cold)
@@ -0,0 +1,103 @@
+"""The plaintext Markdown extension."""
+
+import pytest
+from markdown import Markdown
+
+from scrivo.markdown import PlaintextExtension
+
+FENCED = """\
+Some code:
+
+```python
+answer = 6 * 7
+```
+
+That was it.
+"""
+
+INDENTED = """\
+Some code:
+
+    answer = 6 * 7
+
+That was it.
+"""
+
+# A bit of everything BeautifulSoup used to get the text of
+DOCUMENT = """\
+# A "quoted" title
+
+Some *emphasis*, `inline code` and a [link](https://example.com).
+
+- one & two
+- three < four
+
+| Name | Value |
+|------|-------|
+| pi   | 3.14  |
+
+<div class="note">Raw <b>HTML</b> too.</div>
+
+```python
+print("hello, world")
+```
+
+It's done -- really...
+"""
+
+
+def plaintext(source, include_code=True, codehilite=True):
+    """Return the plaintext of a document, parsed much like the site's pages."""
+    extensions = [
+        "markdown.extensions.fenced_code",
+        "markdown.extensions.footnotes",
+        "markdown.extensions.tables",
+        "markdown.extensions.smarty",
+        PlaintextExtension(include_code=include_code),
+    ]
+    if codehilite:
+        extensions += ["markdown.extensions.codehilite"]
+    md = Markdown(output_format="html5", extensions=extensions)
+    html = md.convert(source)
+    return html, md.plaintext
+
+
+@pytest.mark.parametrize("codehilite", [True, False])
+def test_code_blocks(codehilite):
+    for source in (FENCED, INDENTED):
+        _, text = plaintext(source, codehilite=codehilite)
+        assert text == "Some code: answer = 6 * 7 That was it."
+        _, text = plaintext(source, include_code=False, codehilite=codehilite)
+        assert text == "Some code: That was it."
+
+
+def test_inline_code_is_text():
+    _, text = plaintext("Call `answer()` now.", include_code=False)
+    assert text == "Call answer() now."
+
+
+def test_footnotes():
+    _, text = plaintext("Claim.[^1]\n\n[^1]: The source.\n")
+    # The reference number, the note and no backlink
+    assert text == "Claim. 1 The source."
+
+
+def test_entities():
+    _, text = plaintext('Fish &amp; chips &eacute; &#8364; < 3 "quoted" it\'s')
+    assert text == "Fish & chips é € < 3 “quoted” it’s"
+
+
+def test_plaintext_is_reset():
+    md = Markdown(extensions=[PlaintextExtension()])
+    md.convert("First")
+    md.reset()
+    assert md.plaintext == ""
+    md.convert("Second")
+    assert md.plaintext == "Second"
+
+
+def test_matches_beautifulsoup():
+    bs4 = pytest.importorskip("bs4")
+    html, text = plaintext(DOCUMENT)
+    soup = bs4.BeautifulSoup(html, features="html.parser")
+    assert text == " ".join(soup.get_text(separator=" ", strip=True).split())
@@ -0,0 +1,61 @@
+"""The tokens pages are compared by."""
+
+import pytest
+
+from scrivo.ml.page_similarity import tokenize_stop_stem
+from scrivo.page import parse_markdown
+
+SOURCE = r"""---
+title: Euler's identity
+tags: [math]
+---
+
+The identity $e^{i\pi} + 1 = 0$ links five constants.
+
+$$\sum_{n=0}^\infty \frac{x^n}{n!} = e^x$$
+
+<div class="note">A <em>raw</em> note.<script>track("note")</script></div>
+
+Some code:
+
+```python
+exp = math.exp(1)
+```
+
+Text.[^1]
+
+[^1]: A footnote.
+"""
+
+# Math and scripts are not text
+TOKENS = [
+    "euler",
+    "ident",
+    "math",
+    "ident",
+    "link",
+    "constant",
+    "raw",
+    "note",
+    "code",
+    "exp",
+    "math",
+    "exp",
+    "text",
+    "footnot",
+]
+
+
+def test_tokens_of_a_page_with_math():
+    _, _, plaintext = parse_markdown(SOURCE)
+    assert tokenize_stop_stem(plaintext.lower()) == TOKENS
+
+
+def test_tokens_match_beautifulsoup():
+    bs4 = pytest.importorskip("bs4")
+    html, meta, _ = parse_markdown(SOURCE)
+    text = bs4.BeautifulSoup(html, features="html.parser").get_text(
+        separator=" ", strip=True
+    )
+    text = " ".join([meta["title"], " ".join(meta["tags"]), text])
+    assert tokenize_stop_stem(text.lower()) == TOKENS
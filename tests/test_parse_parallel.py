@@ -0,0 +1,57 @@
+"""Parsing pages across processes, with the highlight cache."""
+
+import os
+
+from scrivo.build import parse_pages_parallel
+from scrivo.page import HighlightCache, highlighting, parse_markdown
+
+SOURCE = """---
+title: Post {i}
+---
+
+Some text.
+
+```python
+def f{i}(x):
+    return x + {i}
+```
+
+```bash
+echo {i}
+```
+"""
+
+
+def write_posts(directory, n=24):
+    paths = []
+    for i in range(n):
+        path = os.path.join(directory, f"post-{i}.md")
+        with open(path, "w") as fh:
+            fh.write(SOURCE.format(i=i))
+        paths += [path]
+    return paths
+
+
+def test_parallel_parse_with_cold_highlight_cache(tmp_path, pools):
+    class WatchedCache(HighlightCache):
+        """A highlight cache that fails if written to while workers read it."""
+
+        def __setitem__(self, key, value):
+            assert not pools.running, "highlight cache written during the pool"
+            super().__setitem__(key, value)
+
+    paths = write_posts(str(tmp_path))
+    state = str(tmp_path / "state")
+    parsed = {}
+    with WatchedCache(state) as highlights:
+        parse_pages_parallel(paths, parsed, jobs=4, highlights=highlights)
+        assert len(highlights) == 2 * len(paths)
+    assert len(parsed) == len(paths)
+
+    # Same as parsing in this process, with or without the cache
+    with HighlightCache(state) as highlights, highlighting(highlights):
+        for path in paths:
+            with open(path) as fh:
+                source = fh.read()
+            assert parse_markdown(source) in parsed.values()
+        assert highlights.misses == 0
@@ -0,0 +1,49 @@
+"""Template references are kept between builds."""
+
+import os
+
+import pytest
+
+from scrivo.manifest import BuildManifest
+from scrivo.templates import TemplateEnvironment
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """Record the source of every template parsed."""
+    names = []
+    parse = TemplateEnvironment.parse
+
+    def watched(self, source, name=None, filename=None):
+        names.append(source)
+        return parse(self, source, name, filename)
+
+    monkeypatch.setattr(TemplateEnvironment, "parse", watched)
+    return names
+
+
+@pytest.mark.parametrize("precompile", [False, True])
+def test_references_are_not_parsed_again(site, build, parsed, precompile):
+    config = site()
+    options = dict(incremental=True, max_related=0, precompile_templates=precompile)
+    build(config, **options)
+    assert parsed
+    first = BuildManifest.load(config.site.build_dir).references
+    assert first
+
+    parsed.clear()
+    build(config, **options)
+    assert parsed == []
+    assert BuildManifest.load(config.site.build_dir).references == first
+
+    # Only the edited template is parsed
+    path = os.path.join(config.templates.source_dir, "blog.html")
+    with open(path) as fh:
+        source = fh.read() + "\n"
+    with open(path, "w") as fh:
+        fh.write(source)
+    parsed.clear()
+    build(config, **options)
+    assert parsed == [source]
+    references = BuildManifest.load(config.site.build_dir).references
+    assert len(references) == len(first)
@@ -0,0 +1,103 @@
+"""The incrementally updated TF-IDF model."""
+
+import random
+
+import numpy as np
+import pytest
+
+import scrivo.ml.tfidf
+from scrivo.ml.tfidf import TfidfModel, top_k_similar
+
+K = 5
+
+
+def make_corpus(n, seed=0, topics=40):
+    """Return documents of common words plus words on their own topic."""
+    rng = random.Random(seed)
+    common = [f"w{i}" for i in range(50)]
+    weights = [1 / r for r in range(1, len(common) + 1)]
+    docs = {}
+    for i in range(n):
+        t = rng.randrange(topics)
+        topic = [f"t{t}-{j}" for j in range(50)]
+        docs[f"doc-{i}"] = rng.choices(common, weights, k=rng.randint(20, 100)) + [
+            rng.choice(topic) for _ in range(rng.randint(20, 100))
+        ]
+    return docs
+
+
+def fit(model, docs, **options):
+    keys = list(docs)
+    return model.update(keys, lambda i: docs[keys[i]], k=K, **options)
+
+
+@pytest.fixture
+def full_refits(monkeypatch):
+    """Count the calls to top_k_similar that cover every row."""
+    calls = []
+
+    def counting(matrix, k, min_score=0.0, rows=None, **options):
+        if rows is None:
+            calls.append(matrix.shape[0])
+        return top_k_similar(matrix, k, min_score, rows, **options)
+
+    monkeypatch.setattr(scrivo.ml.tfidf, "top_k_similar", counting)
+    return calls
+
+
+def check_model(model, docs):
+    """The model's neighbors are exact for its weights, and near a refit's."""
+    related, scores = top_k_similar(model.matrix, K)
+    assert (model.related == related).all()
+    assert np.allclose(model.scores, scores)
+    refit = TfidfModel()
+    fit(refit, docs)
+    assert np.allclose(model.scores, refit.scores, atol=0.02)
+
+
+@pytest.mark.parametrize("change", ["add", "remove", "edit"])
+def test_one_post_takes_the_incremental_path(change, full_refits):
+    docs = make_corpus(400)
+    model = TfidfModel()
+    fit(model, docs)
+    assert full_refits == [400]
+
+    if change == "add":
+        docs["new"] = make_corpus(1, seed=1)["doc-0"]
+    elif change == "remove":
+        del docs["doc-7"]
+    else:
+        docs["doc-7"] = docs["doc-7"] + ["w1", "w5", "t3-7"]
+        docs["doc-7-edited"] = docs.pop("doc-7")
+    changed = fit(model, docs)
+    assert full_refits == [400]
+    assert changed.sum() * 4 < len(docs)
+    check_model(model, docs)
+
+
+def test_drifting_weights_are_refreshed(full_refits):
+    docs = make_corpus(100)
+    model = TfidfModel()
+    fit(model, docs)
+    for i in range(60):
+        docs[f"new-{i}"] = make_corpus(1, seed=i + 1)["doc-0"]
+        fit(model, docs)
+        n = len(docs)
+        exact = np.log((1 + n) / (1 + model.df)) + 1
+        assert np.all(np.abs(model.idf - exact) <= model.IDF_TOLERANCE * exact)
+    # Now and then the drift reaches the common terms, and everything is redone
+    assert len(full_refits) > 1
+    check_model(model, docs)
+
+
+def test_incremental_update_in_small_blocks(full_refits):
+    docs = make_corpus(400)
+    model = TfidfModel()
+    fit(model, docs, max_bytes=4096)
+    # Edit enough posts that several blocks of changed rows are needed
+    for i in range(0, 400, 9):
+        docs[f"doc-{i}-edited"] = docs.pop(f"doc-{i}") + ["w3", "t0-1"]
+    changed = fit(model, docs, max_bytes=4096)
+    assert full_refits == [400]
+    assert changed.sum() > 4096 // (8 * 400)
+    check_model(model, docs)